@@ -0,0 +1,171 @@
+"""autotune.py
+
+Throughput autotuning of batch size, loader workers, prefetch depth and torch
+threads for a solver, before it trains.
+
+Every candidate runs a short timed trial of real training steps (data loading
+included) on the solver's phase and dataset. Net, optimizer and loss smoothing
+are restored after each trial. Candidates that exceed the memory limit (process
+plus loader worker RSS) or run out of memory are rejected. The search goes one
+setting at a time, keeping the best value of the settings already tuned. The
+chosen configuration is saved per host, phase, dataset and device in
+root_dir/autotune/<hostname>.json and reused by later runs.
+"""
+
+import os
+import copy
+import json
+import time
+import socket
+
+import torch
+
+from memory import rss_mb, children_pids
+
+
+SETTINGS = ['batch_size', 'num_workers', 'prefetch_factor', 'num_threads']
+
+
+def tune_file(args):
+    return os.path.join(args.root_dir, 'autotune', socket.gethostname() + '.json')
+
+
+def tune_key(solver):
+    return '{}/{}/{}'.format(type(solver).__name__, solver.args.dataset.lower(), 'cuda' if solver.args.cuda else 'cpu')
+
+
+def candidates(args):
+    n_cpus = os.cpu_count() or 1
+    batch_sizes = [int(size) for size in args.autotune_batch_sizes.split(',')]
+    workers = sorted(set([0, 2, 4, 8, 16, 32, n_cpus]) & set(range(n_cpus + 1)))
+    threads = sorted(set([1, 2, 4, n_cpus // 2, n_cpus]) & set(range(1, n_cpus + 1)))
+    return {'batch_size': batch_sizes, 'num_workers': workers, 'prefetch_factor': [2, 4, 8], 'num_threads': threads}
+
+
+def current_config(args):
+    return {'batch_size': args.batch_size, 'num_workers': args.num_workers,
+            'prefetch_factor': args.prefetch_factor, 'num_threads': args.num_threads or torch.get_num_threads()}
+
+
+def apply_config(solver, config):
+    from dataset import return_loader
+    for setting in SETTINGS:
+        setattr(solver.args, setting, config[setting])
+    torch.set_num_threads(config['num_threads'])
+    # only the loader takes the new settings; the dataset, slow to build, is kept
+    solver.data_loader = return_loader(solver.args, solver.data_loader.dataset, solver.require_attr)
+
+
+def trial(solver, config, n_warmup, n_steps, mem_limit_mb=0):
+    """samples/sec of training steps with a config, or None if it does not fit in memory."""
+    apply_config(solver, config)
+    if solver.args.cuda:
+        torch.cuda.empty_cache()
+        torch.cuda.reset_peak_memory_stats()
+
+    def batches():
+        while True:
+            for x in solver.data_loader:
+                yield x
+
+    data = batches()
+    peak_mb = 0.
+    try:
+        for i in range(n_warmup + n_steps):
+            if i == n_warmup:
+                if solver.args.cuda:
+                    torch.cuda.synchronize()
+                start = time.time()
+            solver.train_step(next(data))
+            if i == n_warmup - 1 or i == n_warmup + n_steps - 1:
+                peak_mb = max(peak_mb, rss_mb() + sum(rss_mb(pid) for pid in children_pids()))
+                if mem_limit_mb > 0 and peak_mb > mem_limit_mb:
+                    return None, peak_mb
+        if solver.args.cuda:
+            torch.cuda.synchronize()
+        elapsed = time.time() - start
+    except RuntimeError as e:
+        # CUDA allocations, or a loader worker killed by the host
+        if 'out of memory' not in str(e) and 'DataLoader worker' not in str(e):
+            raise
+        return None, peak_mb
+    finally:
+        # shuts the loader workers down
+        data.close()
+        solver.optim.zero_grad()
+    return n_steps * config['batch_size'] / elapsed, peak_mb
+
+
+def search(solver):
+    """Coordinate search over SETTINGS; returns the best config and the trial log."""
+    args = solver.args
+    states = copy.deepcopy({'net': solver.net.state_dict(), 'optim': solver.optim.state_dict()})
+    convergence = copy.deepcopy(solver.convergence)
+    global_iter, timer_enabled = solver.global_iter, solver.timer.enabled
+    # an iteration that is no multiple of gather_step or display_save_step: no visdom, no checkpoints
+    solver.global_iter = 1
+    solver.timer.enabled = False
+    solver.net_mode(train=True)
+    solver.prepare_training()
+
+    best = current_config(args)
+    best_score = None
+    log = []
+    try:
+        for setting, values in candidates(args).items():
+            for value in values:
+                config = dict(best, **{setting: value})
+                if best_score is not None and config == best:
+                    continue
+                if setting == 'prefetch_factor' and config['num_workers'] == 0:
+                    continue
+                score, peak_mb = trial(solver, config, args.autotune_warmup, args.autotune_steps,
+                                       args.autotune_mem_mb)
+                log.append(dict(config, samples_per_sec=score, peak_rss_mb=peak_mb))
+                print('[Autotune] {} -> {}'.format(', '.join('{}={}'.format(k, config[k]) for k in SETTINGS),
+                                                   'rejected' if score is None else '{:.1f} samples/s'.format(score)))
+                solver.net.load_state_dict(states['net'])
+                solver.optim.load_state_dict(states['optim'])
+                if score is not None and (best_score is None or score > best_score):
+                    best, best_score = config, score
+    finally:
+        solver.convergence = convergence
+        solver.global_iter = global_iter
+        solver.timer.enabled = timer_enabled
+        # prepare_training turns C_max into a tensor, train() does it again
+        args.C_max = float(args.C_max) if torch.is_tensor(args.C_max) else args.C_max
+
+    if best_score is None:
+        raise MemoryError('no autotune configuration fits in {} MB'.format(args.autotune_mem_mb))
+    return dict(best, samples_per_sec=best_score), log
+
+
+def run(solver):
+    """Apply the saved configuration of this host and phase, or search for one first."""
+    args = solver.args
+    file_path = tune_file(args)
+    key = tune_key(solver)
+    results = {}
+    if os.path.isfile(file_path):
+        with open(file_path) as f:
+            results = json.load(f)
+
+    if key in results and not args.autotune_refresh:
+        config = results[key]
+        print("=> reusing autotuned {} from '{}'".format(key, file_path))
+    else:
+        config, log = search(solver)
+        config['torch'] = torch.__version__
+        config['n_cpus'] = os.cpu_count()
+        config['time'] = time.time()
+        results[key] = config
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, 'w') as f:
+            json.dump(results, f, indent=2)
+        with open(os.path.join(solver.output_dir, 'autotune.json'), 'w') as f:
+            json.dump({'best': config, 'trials': log}, f, indent=2)
+
+    apply_config(solver, config)
+    print('[Autotune] {}: {} ({:.1f} samples/s)'.format(
+        key, ', '.join('{}={}'.format(k, config[k]) for k in SETTINGS), config['samples_per_sec']))
+    return config
@@ -0,0 +1,461 @@
+"""benchmark.py
+
+Reproducible performance benchmark on synthetic data, without network or visdom.
+
+    loader     samples/sec of every return_data dataset
+    decode     per-image decode+resize time with and without JPEG draft mode
+    train      steps/sec and peak memory of every solver phase and batch size
+    traverse   wall-clock of vis_traverse
+    inference  latency of the serving graphs
+    startup    time to import, build a headless solver and get its first batch,
+               and time to the first inference from a checkpoint, in fresh interpreters
+    checkpoint bytes written, save time and restore latency of the torch and delta formats
+
+Training trials run in fresh processes so their peak memory is their own.
+Results are written as JSON; with --bench_baseline the run is compared against
+a previous result and regressions beyond --bench_tolerance are flagged.
+"""
+
+import os
+import sys
+import copy
+import json
+import time
+import shutil
+import platform
+import tempfile
+import resource
+import subprocess
+import multiprocessing
+
+import numpy as np
+import torch
+
+
+CELEBA_KEYS = ['5_o_Clock_Shadow', 'Arched_Eyebrows', 'Attractive', 'Bags_Under_Eyes', 'Bald', 'Bangs',
+               'Big_Lips', 'Big_Nose', 'Black_Hair', 'Blond_Hair', 'Blurry', 'Brown_Hair', 'Bushy_Eyebrows',
+               'Chubby', 'Double_Chin', 'Eyeglasses', 'Goatee', 'Gray_Hair', 'Heavy_Makeup', 'High_Cheekbones',
+               'Male', 'Mouth_Slightly_Open', 'Mustache', 'Narrow_Eyes', 'No_Beard', 'Oval_Face', 'Pale_Skin',
+               'Pointy_Nose', 'Receding_Hairline', 'Rosy_Cheeks', 'Sideburns', 'Smiling', 'Straight_Hair',
+               'Wavy_Hair', 'Wearing_Earrings', 'Wearing_Hat', 'Wearing_Lipstick', 'Wearing_Necklace',
+               'Wearing_Necktie', 'Young']
+
+# (phase, dataset, SCAN)
+TRAIN_PHASES = [('ori_beta_VAE', 'dsprites', False),
+                ('DAE', 'celeba', True),
+                ('beta_VAE', 'celeba', True),
+                ('SCAN', 'celeba', True)]
+
+
+#---------------------------------SYNTHETIC DATA-------------------------------------#
+
+def _smooth_images(rng, n, width, height, nc=3):
+    """Low-frequency noise, so JPEG sizes and decode costs resemble photographs."""
+    from PIL import Image
+    for _ in range(n):
+        coarse = rng.randint(0, 256, size=[height // 16, width // 16, nc]).astype(np.uint8)
+        image = Image.fromarray(coarse).resize((width, height), Image.BILINEAR)
+        yield image
+
+
+def make_celeba(dset_dir, n, rng):
+    root = os.path.join(dset_dir, 'CelebA')
+    os.makedirs(os.path.join(root, 'img_align_celeba'), exist_ok=True)
+    os.makedirs(os.path.join(root, 'Anno'), exist_ok=True)
+    lines = [str(n) + '\n', ' '.join(CELEBA_KEYS) + ' \n']
+    attrs = np.where(rng.rand(n, len(CELEBA_KEYS)) < 0.2, 1, -1)
+    for i, image in enumerate(_smooth_images(rng, n, 178, 218)):
+        name = '{:06d}.jpg'.format(i + 1)
+        image.save(os.path.join(root, 'img_align_celeba', name), quality=95)
+        lines.append(name + ' ' + ' '.join('{:2d}'.format(a) for a in attrs[i]) + '\n')
+    with open(os.path.join(root, 'Anno', 'list_attr_celeba.txt'), 'w') as f:
+        f.writelines(lines)
+
+
+def make_3dchairs(dset_dir, n, rng):
+    root = os.path.join(dset_dir, '3DChairs', 'images')
+    os.makedirs(root, exist_ok=True)
+    for i, image in enumerate(_smooth_images(rng, n, 600, 600)):
+        image.save(os.path.join(root, '{}_image_{:03d}.png'.format(i + 1, i)))
+
+
+def make_dsprites(dset_dir, n, rng):
+    root = os.path.join(dset_dir, 'dsprites-dataset')
+    os.makedirs(root, exist_ok=True)
+    sizes = np.array([1, 3, 6, 40, 32, 32])
+    latents_classes = rng.randint(0, sizes, size=[n, len(sizes)])
+    imgs = (rng.rand(n, 64, 64) > 0.9).astype(np.uint8)
+    np.savez(os.path.join(root, 'dsprites_ndarray_co1sh3sc6or40x32y32_64x64.npz'), imgs=imgs,
+             latents_classes=latents_classes, latents_values=latents_classes.astype(np.float64))
+
+
+def make_datasets(root_dir, n, seed=0):
+    rng = np.random.RandomState(seed)
+    dset_dir = os.path.join(root_dir, 'dataset')
+    make_celeba(dset_dir, n, rng)
+    make_3dchairs(dset_dir, n, rng)
+    make_dsprites(dset_dir, n, rng)
+    return dset_dir
+
+
+def bench_args(args, root_dir):
+    args = copy.deepcopy(args)
+    args.root_dir = root_dir
+    args.dset_dir = os.path.join(root_dir, 'dataset')
+    args.vis_on = False
+    args.save_output = True
+    args.ckpt_name = 'none'
+    args.display_save_step = sys.maxsize
+    args.profile = False
+    args.trace_start = -1
+    args.eval_metrics = False
+    return args
+
+
+#---------------------------------MEASUREMENTS-------------------------------------#
+
+def peak_memory_mb(uses_cuda=False):
+    # ru_maxrss is in kilobytes on linux and bytes on macos
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    rss = rss / 2.**20 if platform.system() == 'Darwin' else rss / 2.**10
+    memory = {'peak_rss_mb': rss}
+    if uses_cuda:
+        memory['peak_cuda_mb'] = torch.cuda.max_memory_allocated() / 2.**20
+    return memory
+
+
+def bench_loader(args, dataset, require_attr, n_batches):
+    from dataset import return_data
+
+    args = copy.deepcopy(args)
+    args.dataset = dataset
+    loader = return_data(args, require_attr)
+    iterator = iter(loader)
+    next(iterator)
+    start = time.time()
+    n = 0
+    for _ in range(n_batches):
+        try:
+            next(iterator)
+        except StopIteration:
+            iterator = iter(loader)
+            next(iterator)
+        n += args.batch_size
+    return {'samples_per_sec': n / (time.time() - start)}
+
+
+def bench_decode(dset_dir, n_images, image_size=64):
+    """Compare the full-resolution and the draft-mode decode of the synthetic CelebA JPEGs."""
+    from torchvision import transforms
+    from torchvision.datasets.folder import pil_loader
+    from dataset import open_image
+
+    root = os.path.join(dset_dir, 'CelebA', 'img_align_celeba')
+    paths = sorted(os.path.join(root, name) for name in os.listdir(root))[:n_images]
+    transform = transforms.Compose([
+        transforms.Resize((image_size, image_size)),
+        transforms.ToTensor(),])
+
+    def decode_all(loader):
+        start = time.time()
+        images = [transform(loader(path)) for path in paths]
+        return torch.stack(images), (time.time() - start) / len(paths)
+
+    full, full_time = decode_all(pil_loader)
+    draft, draft_time = decode_all(lambda path: open_image(path, image_size))
+    difference = (full - draft).abs() * 255
+    return {'full_ms_per_image': full_time * 1e3,
+            'draft_ms_per_image': draft_time * 1e3,
+            'draft_speedup': full_time / draft_time,
+            'mean_abs_diff_8bit': difference.mean().item(),
+            'max_abs_diff_8bit': difference.max().item()}
+
+
+def _train_trial(args, phase, dataset, use_scan, batch_size, n_warmup, n_steps):
+    import solver
+
+    torch.manual_seed(args.seed)
+    np.random.seed(args.seed)
+    args.dataset = dataset
+    args.SCAN = use_scan
+    args.phase = phase
+    args.batch_size = batch_size
+
+    model = getattr(solver, phase)(args)
+    model.net_mode(train=True)
+    model.prepare_training()
+
+    def batches():
+        while True:
+            for x in model.data_loader:
+                yield x
+
+    data = batches()
+    steps = []
+    for i in range(n_warmup + n_steps):
+        x = next(data)
+        start = time.time()
+        model.global_iter += 1
+        model.train_step(x)
+        if args.cuda:
+            torch.cuda.synchronize()
+        steps.append(time.time() - start)
+    steps = np.asarray(steps[n_warmup:])
+
+    result = {'steps_per_sec': len(steps) / steps.sum(),
+              'samples_per_sec': len(steps) * batch_size / steps.sum(),
+              'step_p50_ms': float(np.percentile(steps, 50) * 1e3),
+              'step_p90_ms': float(np.percentile(steps, 90) * 1e3)}
+
+    # the dsprites traversal reads fixed indices of the full 737k-image set; the DAE has no traversal
+    if dataset != 'dsprites' and hasattr(model, 'vis_traverse'):
+        start = time.time()
+        model.vis_traverse()
+        result['vis_traverse_sec'] = time.time() - start
+    result.update(peak_memory_mb(args.cuda))
+    return result
+
+
+def bench_train(args, phase, dataset, use_scan, batch_size, n_warmup, n_steps):
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(1) as pool:
+        return pool.apply(_train_trial, (args, phase, dataset, use_scan, batch_size, n_warmup, n_steps))
+
+
+def bench_inference(args, batch_sizes, n_repeat=20):
+    from inference import net_spec, serving_graphs
+
+    args = copy.deepcopy(args)
+    args.dataset = 'celeba'
+    nets = {}
+    for phase in ['DAE', 'beta_VAE', 'SCAN']:
+        model, z_dim, nc, _ = net_spec(args, phase)
+        nets[phase] = model(z_dim, nc).eval()
+
+    inputs = {'img2sym': lambda b: torch.rand(b, 3, 64, 64),
+              'sym2img': lambda b: torch.rand(b, 40),
+              'DAE_encoder': lambda b: torch.rand(b, 3, 64, 64),
+              'beta_VAE_encoder': lambda b: torch.rand(b, 3, 64, 64)}
+    graphs = serving_graphs(nets)
+    results = {}
+    with torch.no_grad():
+        for name, make_input in inputs.items():
+            for batch_size in [1] + batch_sizes:
+                x = make_input(batch_size)
+                graphs[name](x)
+                latencies = []
+                for _ in range(n_repeat):
+                    start = time.time()
+                    graphs[name](x)
+                    latencies.append(time.time() - start)
+                latencies = np.asarray(latencies) * 1e3
+                results['{}/batch_{}'.format(name, batch_size)] = {
+                    'latency_p50_ms': float(np.percentile(latencies, 50)),
+                    'latency_p90_ms': float(np.percentile(latencies, 90)),
+                    'samples_per_sec': float(batch_size / np.median(latencies) * 1e3)}
+    return results
+
+
+FIRST_BATCH_SCRIPT = '''
+import json, sys, time
+start = time.time()
+import main, solver
+args = main.parse_args(sys.argv[1:])
+result = {'import_sec': time.time() - start}
+model = solver.DAE(args)
+result['solver_init_sec'] = time.time() - start
+next(iter(model.data_loader))
+result['first_batch_sec'] = time.time() - start
+print(json.dumps(result))
+'''
+
+FIRST_INFERENCE_SCRIPT = '''
+import json, sys, time
+start = time.time()
+import torch, main, inference
+args = main.parse_args(sys.argv[1:])
+net = inference.load_net(args, 'DAE')
+with torch.no_grad():
+    net(torch.rand(1, 3, 64, 64))
+print(json.dumps({'first_inference_sec': time.time() - start}))
+'''
+
+
+def bench_startup(args, n_repeat=3):
+    """Cold start timings, each the best of n_repeat fresh interpreters."""
+    import torch.optim as optim
+    from model import DAE_net
+
+    net = DAE_net(args.DAE_z_dim, 3)
+    ckpt_dir = os.path.join(args.root_dir, args.DAE_env_name, args.ckpt_dir)
+    os.makedirs(ckpt_dir, exist_ok=True)
+    torch.save({'iter': 0, 'win_states': {'recon': None}, 'net_states': net.state_dict(),
+                'optim_states': optim.Adam(net.parameters()).state_dict()}, os.path.join(ckpt_dir, 'startup'))
+
+    argv = ['--root_dir', args.root_dir, '--dataset', 'celeba', '--SCAN', '--phase', 'DAE',
+            '--vis_on', 'False', '--cuda', str(args.cuda), '--num_workers', str(args.num_workers),
+            '--batch_size', str(args.batch_size), '--ckpt_name', 'startup']
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    results = {}
+    for script in [FIRST_BATCH_SCRIPT, FIRST_INFERENCE_SCRIPT]:
+        for _ in range(n_repeat):
+            output = subprocess.check_output([sys.executable, '-c', script] + argv, cwd=repo_dir)
+            timings = json.loads(output.decode().strip().splitlines()[-1])
+            for key, value in timings.items():
+                results[key] = min(results.get(key, value), value)
+    return results
+
+
+def _dir_bytes(directory):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(directory) for name in names)
+
+
+def states_equal(a, b):
+    """Whether two checkpoint dicts hold the same tensors, bit for bit, and the same other values."""
+    if torch.is_tensor(a) or torch.is_tensor(b):
+        return (torch.is_tensor(a) and torch.is_tensor(b) and a.dtype == b.dtype and a.shape == b.shape
+                and torch.equal(a.reshape(-1).view(torch.uint8), b.reshape(-1).view(torch.uint8)))
+    elif isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(states_equal(a[key], b[key]) for key in a)
+    elif isinstance(a, (list, tuple)) and isinstance(b, (list, tuple)):
+        return len(a) == len(b) and all(states_equal(x, y) for x, y in zip(a, b))
+    return a == b
+
+
+def bench_checkpoint(args, root_dir, n_saves=20, steps_per_save=5):
+    """Checkpoint a beta-VAE trained on noise in both formats, then restore every iteration."""
+    import torch.optim as optim
+    from model import BetaVAE_H_net
+    from ckpt_store import CheckpointStore
+    from utils import load_state
+
+    torch.manual_seed(args.seed)
+    net = BetaVAE_H_net(args.beta_VAE_z_dim, 3)
+    optimizer = optim.Adam(net.parameters(), lr=args.lr)
+    dirs = {fmt: os.path.join(root_dir, 'ckpt_' + fmt) for fmt in ['torch', 'delta']}
+    for directory in dirs.values():
+        os.makedirs(directory, exist_ok=True)
+    store = CheckpointStore(dirs['delta'], args.ckpt_full_every)
+    save_sec = {'torch': 0., 'delta': 0.}
+
+    for i in range(1, n_saves + 1):
+        for _ in range(steps_per_save):
+            x_recon, mu, logvar = net(torch.rand(16, 3, 64, 64))
+            optimizer.zero_grad()
+            (x_recon.mean() + mu.pow(2).mean() + logvar.exp().mean()).backward()
+            optimizer.step()
+        states = {'iter': i * steps_per_save, 'win_states': {'recon': None},
+                  'net_states': net.state_dict(), 'optim_states': optimizer.state_dict()}
+        for filename in [str(states['iter']), 'last']:
+            start = time.time()
+            with open(os.path.join(dirs['torch'], filename), 'wb+') as f:
+                torch.save(states, f)
+            save_sec['torch'] += time.time() - start
+            start = time.time()
+            store.save(states, os.path.join(dirs['delta'], filename))
+            save_sec['delta'] += time.time() - start
+
+    results = {}
+    for fmt, directory in dirs.items():
+        latencies = []
+        for i in range(1, n_saves + 1):
+            start = time.time()
+            load_state(os.path.join(directory, str(i * steps_per_save)))
+            latencies.append(time.time() - start)
+        latencies = np.asarray(latencies) * 1e3
+        results[fmt] = {'bytes': _dir_bytes(directory), 'save_ms': save_sec[fmt] / n_saves * 1e3,
+                        'restore_p50_ms': float(np.percentile(latencies, 50)),
+                        'restore_max_ms': float(latencies.max())}
+    # every iteration, most of them deltas between two full snapshots, must match torch.save bit for bit
+    results['lossless'] = all(states_equal(load_state(os.path.join(dirs['delta'], str(i * steps_per_save))),
+                                           load_state(os.path.join(dirs['torch'], str(i * steps_per_save))))
+                              for i in range(1, n_saves + 1))
+    results['bytes_ratio'] = results['delta']['bytes'] / results['torch']['bytes']
+    return results
+
+
+#---------------------------------COMPARISON-------------------------------------#
+
+def _flatten(results, prefix=''):
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, prefix + key + '/'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[prefix + key] = value
+    return flat
+
+
+# sections of the results that describe the run rather than measure it
+NOT_METRICS = ['meta', 'regressions']
+# metrics ending so are rates and ratios to maximize; all others are times, sizes and errors to minimize
+HIGHER_IS_BETTER = ('per_sec', 'speedup')
+
+
+def compare(results, baseline, tolerance):
+    """Return the metrics that got worse than baseline by more than tolerance."""
+    regressions = {}
+    new, old = [_flatten({key: value for key, value in r.items() if key not in NOT_METRICS})
+                for r in [results, baseline]]
+    for key in sorted(set(new) & set(old)):
+        if old[key] == 0:
+            continue
+        change = new[key] / old[key] - 1
+        higher_is_better = key.endswith(HIGHER_IS_BETTER)
+        if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+            regressions[key] = {'baseline': old[key], 'current': new[key], 'change': change}
+    return regressions
+
+
+def run(args):
+    batch_sizes = [int(b) for b in args.bench_batch_sizes.split(',')]
+    root_dir = tempfile.mkdtemp(prefix='scan_bench_')
+    try:
+        make_datasets(root_dir, args.bench_images, args.seed)
+        args = bench_args(args, root_dir)
+
+        results = {'meta': {'torch': torch.__version__, 'python': platform.python_version(),
+                            'platform': platform.platform(), 'cpu_count': os.cpu_count(),
+                            'num_threads': torch.get_num_threads(), 'cuda': args.cuda,
+                            'num_workers': args.num_workers, 'images': args.bench_images},
+                   'loader': {}, 'decode': {}, 'train': {}, 'inference': {}, 'startup': {}, 'checkpoint': {}}
+
+        for dataset, require_attr in [('celeba', False), ('celeba', True), ('3dchairs', False), ('dsprites', False)]:
+            name = dataset + ('_attr' if require_attr else '')
+            results['loader'][name] = bench_loader(args, dataset, require_attr, args.bench_steps)
+            print('[loader] {}: {:.1f} samples/s'.format(name, results['loader'][name]['samples_per_sec']))
+
+        results['decode'] = bench_decode(args.dset_dir, args.bench_images, args.image_size)
+        print('[decode] draft mode: {:.2f}x faster, mean abs diff {:.2f}/255'.format(
+            results['decode']['draft_speedup'], results['decode']['mean_abs_diff_8bit']))
+
+        for phase, dataset, use_scan in TRAIN_PHASES:
+            for batch_size in batch_sizes:
+                name = '{}/batch_{}'.format(phase, batch_size)
+                results['train'][name] = bench_train(args, phase, dataset, use_scan, batch_size,
+                                                     args.bench_warmup, args.bench_steps)
+                print('[train] {}: {:.2f} steps/s, peak rss {:.0f} MB'.format(
+                    name, results['train'][name]['steps_per_sec'], results['train'][name]['peak_rss_mb']))
+
+        results['inference'] = bench_inference(args, batch_sizes)
+        results['startup'] = bench_startup(args)
+        print('[startup] first batch {:.2f}s, first inference {:.2f}s'.format(
+            results['startup']['first_batch_sec'], results['startup']['first_inference_sec']))
+        results['checkpoint'] = bench_checkpoint(args, root_dir)
+        print('[checkpoint] delta format writes {:.1%} of the bytes, restores in {:.1f} ms (torch {:.1f} ms), lossless: {}'.format(
+            results['checkpoint']['bytes_ratio'], results['checkpoint']['delta']['restore_p50_ms'],
+            results['checkpoint']['torch']['restore_p50_ms'], results['checkpoint']['lossless']))
+    finally:
+        shutil.rmtree(root_dir, ignore_errors=True)
+
+    if args.bench_baseline:
+        with open(args.bench_baseline) as f:
+            results['regressions'] = compare(results, json.load(f), args.bench_tolerance)
+        for key, entry in results['regressions'].items():
+            print('[regression] {}: {:.4g} -> {:.4g} ({:+.1%})'.format(
+                key, entry['baseline'], entry['current'], entry['change']))
+
+    with open(args.bench_out, 'w') as f:
+        json.dump(results, f, indent=2)
+    print("=> saved benchmark results to '{}'".format(args.bench_out))
+    return results
@@ -0,0 +1,148 @@
+"""ckpt_store.py
+
+Compressed, delta-encoded checkpoint storage.
+
+A checkpoint file written by CheckpointStore is a small manifest: the checkpoint
+dict with every tensor replaced by a reference to a content-addressed object in
+<ckpt_dir>/objects. Every `full_every` iterations the objects are full snapshots
+of the tensors. In between, each object is the XOR of a tensor's bytes with its
+last snapshot, which is lossless, and is mostly zero bytes when training moves
+weights little. Objects are byte-shuffled (all first bytes of the elements,
+then all second bytes, ...) and zlib compressed, and identical objects are
+stored once. Unchanged tensors, and the 'last' copy of every checkpoint, cost
+no tensor bytes at all.
+
+Any checkpoint is restored from at most two objects per tensor, its snapshot
+and its delta. utils.load_state resolves manifests transparently.
+"""
+
+import os
+import io
+import zlib
+import hashlib
+
+import numpy as np
+import torch
+
+
+FORMAT = 'delta-v1'
+
+
+def tensor_bytes(tensor):
+    return tensor.detach().cpu().contiguous().reshape(-1).view(torch.uint8).numpy()
+
+
+def shuffle(data, itemsize):
+    return data.reshape(-1, itemsize).T.tobytes() if itemsize > 1 else data.tobytes()
+
+
+def unshuffle(data, itemsize):
+    data = np.frombuffer(data, dtype=np.uint8)
+    return data.reshape(itemsize, -1).T.reshape(-1) if itemsize > 1 and data.size else data
+
+
+def write_atomic(file_path, data):
+    tmp_path = '{}.tmp{}'.format(file_path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, file_path)
+
+
+class CheckpointStore(object):
+    """Writes checkpoints of a directory as manifests of shared, compressed tensor objects."""
+
+    def __init__(self, ckpt_dir, full_every=10, level=6):
+        self.ckpt_dir = ckpt_dir
+        self.object_dir = os.path.join(ckpt_dir, 'objects')
+        self.full_every = full_every
+        self.level = level
+        # path -> raw bytes, object and dtype of the tensors at the last full snapshot
+        self.snapshot = {}
+        self.n_since_snapshot = None
+        self.last_iter = None
+        self.bytes_written = 0
+
+    def object_path(self, key):
+        return os.path.join(self.object_dir, key[:2], key)
+
+    def put(self, data, dtype, itemsize):
+        """Store raw bytes once; returns their key."""
+        # the shuffle depends on the element size, so equal bytes of another dtype are another object
+        sha = hashlib.sha1('{}:{}:'.format(dtype, itemsize).encode())
+        sha.update(data)
+        key = sha.hexdigest()
+        file_path = self.object_path(key)
+        if not os.path.isfile(file_path):
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            compressed = zlib.compress(shuffle(data, itemsize), self.level)
+            write_atomic(file_path, compressed)
+            self.bytes_written += len(compressed)
+        return key
+
+    def encode(self, obj, path, full):
+        if torch.is_tensor(obj):
+            data = tensor_bytes(obj)
+            ref = {'__object__': None, 'dtype': str(obj.dtype).replace('torch.', ''),
+                   'shape': list(obj.shape), 'itemsize': obj.element_size(), 'base': None}
+            base = self.snapshot.get(path)
+            if full or base is None or base[0].shape != data.shape or base[2] != ref['dtype']:
+                ref['__object__'] = self.put(data, ref['dtype'], ref['itemsize'])
+                # data is a view of the live tensor on CPU, which keeps training
+                self.snapshot[path] = (data.copy(), ref['__object__'], ref['dtype'])
+            elif np.array_equal(base[0], data):
+                ref['__object__'] = base[1]
+            else:
+                ref['__object__'] = self.put(np.bitwise_xor(base[0], data), ref['dtype'], ref['itemsize'])
+                ref['base'] = base[1]
+            return ref
+        elif isinstance(obj, dict):
+            return {key: self.encode(value, '{}/{}'.format(path, key), full) for key, value in obj.items()}
+        elif isinstance(obj, (list, tuple)):
+            return type(obj)(self.encode(value, '{}/{}'.format(path, i), full) for i, value in enumerate(obj))
+        return obj
+
+    def save(self, states, file_path):
+        """Write states (a checkpoint dict) as a manifest at file_path."""
+        iteration = states.get('iter')
+        if iteration != self.last_iter:
+            self.n_since_snapshot = 0 if self.n_since_snapshot is None else self.n_since_snapshot + 1
+            self.last_iter = iteration
+        full = self.n_since_snapshot % self.full_every == 0
+        if full and self.n_since_snapshot > 0:
+            self.snapshot = {}
+            self.n_since_snapshot = 0
+
+        manifest = {'__ckpt_store__': FORMAT, 'states': self.encode(states, '', full)}
+        buffer = io.BytesIO()
+        torch.save(manifest, buffer)
+        write_atomic(file_path, buffer.getvalue())
+        self.bytes_written += buffer.tell()
+
+
+def _read(object_dir, key, itemsize, cache):
+    if key not in cache:
+        with open(os.path.join(object_dir, key[:2], key), 'rb') as f:
+            cache[key] = unshuffle(zlib.decompress(f.read()), itemsize)
+    return cache[key]
+
+
+def _decode(obj, object_dir, map_location, cache):
+    if isinstance(obj, dict) and '__object__' in obj:
+        data = _read(object_dir, obj['__object__'], obj['itemsize'], cache)
+        if obj['base'] is not None:
+            data = np.bitwise_xor(_read(object_dir, obj['base'], obj['itemsize'], cache), data)
+        tensor = torch.from_numpy(np.array(data, dtype=np.uint8)).view(getattr(torch, obj['dtype']))
+        return tensor.reshape(obj['shape']).to(map_location)
+    elif isinstance(obj, dict):
+        return {key: _decode(value, object_dir, map_location, cache) for key, value in obj.items()}
+    elif isinstance(obj, (list, tuple)):
+        return type(obj)(_decode(value, object_dir, map_location, cache) for value in obj)
+    return obj
+
+
+def restore(manifest, file_path, map_location='cpu'):
+    """Rebuild the checkpoint dict of a manifest loaded from file_path."""
+    if manifest['__ckpt_store__'] != FORMAT:
+        raise NotImplementedError('unknown checkpoint store format {}'.format(manifest['__ckpt_store__']))
+    object_dir = os.path.join(os.path.dirname(os.path.abspath(file_path)), 'objects')
+    return _decode(manifest['states'], object_dir, map_location, {})
@@ -0,0 +1,165 @@
+"""concepts.py
+
+Nearest-concept img2sym with a precomputed table of SCAN posteriors.
+
+CelebA's attribute vectors take far fewer distinct values than there are
+images. Every distinct vector (a concept) is encoded once by SCAN_net, and an
+image is labelled with the concept whose posterior is closest to the image's
+beta-VAE posterior, in the KL(image || concept) of dual_kl_divergence:
+
+    KL = 1/2 sum_d [ -1 + var_x/var_y + (mu_x - mu_y)^2/var_y + logvar_y - logvar_x ]
+       = 1/2 [ (var_x + mu_x^2) . (1/var_y) - 2 mu_x . (mu_y/var_y)
+               + sum_d (mu_y^2/var_y + logvar_y) - sum_d logvar_x - z_dim ]
+
+so the KLs of a batch of images against a chunk of concepts take two matrix
+products. Chunks keep the [images, concepts] matrix small.
+
+The job builds the table from every attribute combination of the dataset, saves
+it as checkpoints/concepts_<ckpt_name> of the SCAN env, and compares accuracy
+and throughput with the SCAN decoder path on --concept_samples random images of
+the dataset (concepts_report.json). Those images' attribute vectors are in the
+table, so accuracy measures the encoder and the KL search, not generalization
+to unseen combinations.
+"""
+
+import os
+import json
+import time
+
+import numpy as np
+import torch
+
+from inference import load_nets, checkpoint_path, Img2Sym
+from utils import load_state, sample_batch, throughput
+
+
+def nearest(mu_x, logvar_x, precision_t, weighted_mu_t, offset, chunk=4096):
+    """Index and KL of the closest concept of every image posterior, over chunks of the table."""
+    x_term = -logvar_x.sum(1, keepdim=True) - mu_x.size(1)
+    squares = logvar_x.exp() + mu_x.pow(2)
+    best_kl = mu_x.new_full((mu_x.size(0),), float('inf'))
+    best = torch.zeros(mu_x.size(0), dtype=torch.long, device=mu_x.device)
+    for first in range(0, offset.size(0), chunk):
+        last = first + chunk
+        kl = torch.addmm(offset[first:last].unsqueeze(0) + x_term, squares, precision_t[:, first:last])
+        kl.addmm_(mu_x, weighted_mu_t[:, first:last], alpha=-2)
+        kl_min, index = kl.min(1)
+        closer = kl_min < best_kl
+        best_kl = torch.where(closer, kl_min, best_kl)
+        best = torch.where(closer, index + first, best)
+    return best, best_kl * 0.5
+
+
+class ConceptTable(object):
+    """SCAN posteriors of the distinct attribute vectors, laid out for the pairwise KL."""
+
+    def __init__(self, attributes, counts, mu, logvar):
+        self.attributes = attributes
+        self.counts = counts
+        self.mu = mu
+        self.logvar = logvar
+        precision = (-logvar).exp()
+        self.precision_t = precision.t().contiguous()
+        self.weighted_mu_t = (mu * precision).t().contiguous()
+        self.offset = (mu.pow(2) * precision + logvar).sum(1)
+
+    @classmethod
+    def build(cls, SCAN_net, attr_tensor, batch_size=4096):
+        """Dedupe the (binarized) attribute matrix and encode every distinct row once."""
+        attributes, counts = np.unique(np.asarray(attr_tensor) >= 0.5, axis=0, return_counts=True)
+        attributes = torch.from_numpy(attributes.astype(np.float32))
+        device = next(SCAN_net.parameters()).device
+        distributions = []
+        with torch.no_grad():
+            for i in range(0, len(attributes), batch_size):
+                distributions.append(SCAN_net._encode(attributes[i:i+batch_size].to(device)).cpu())
+        distributions = torch.cat(distributions)
+        z_dim = SCAN_net.z_dim
+        return cls(attributes, torch.from_numpy(counts), distributions[:, :z_dim], distributions[:, z_dim:])
+
+    def __len__(self):
+        return len(self.attributes)
+
+    def to(self, device):
+        return ConceptTable(self.attributes.to(device), self.counts.to(device),
+                            self.mu.to(device), self.logvar.to(device))
+
+    def nearest(self, mu_x, logvar_x, chunk=4096):
+        """Index and KL of the closest concept of every image posterior."""
+        return nearest(mu_x, logvar_x, self.precision_t, self.weighted_mu_t, self.offset, chunk)
+
+    def state_dict(self):
+        return {'attributes': self.attributes, 'counts': self.counts, 'mu': self.mu, 'logvar': self.logvar}
+
+    @classmethod
+    def load(cls, file_path, map_location='cpu'):
+        states = load_state(file_path, map_location)
+        return cls(states['attributes'], states['counts'], states['mu'], states['logvar'])
+
+
+class NearestConcept(torch.nn.Module):
+    """image -> beta-VAE posterior -> attributes of the nearest concept"""
+
+    def __init__(self, beta_VAE_net, table, chunk=4096):
+        super(NearestConcept, self).__init__()
+        self.encoder = beta_VAE_net.encoder
+        self.z_dim = beta_VAE_net.z_dim
+        self.chunk = chunk
+        # buffers, so that the table follows .to(device) and is part of the state_dict
+        self.register_buffer('attributes', table.attributes)
+        self.register_buffer('precision_t', table.precision_t)
+        self.register_buffer('weighted_mu_t', table.weighted_mu_t)
+        self.register_buffer('offset', table.offset)
+
+    def forward(self, x):
+        distributions = self.encoder(x)
+        index, _ = nearest(distributions[:, :self.z_dim], distributions[:, self.z_dim:],
+                           self.precision_t, self.weighted_mu_t, self.offset, self.chunk)
+        return self.attributes[index]
+
+
+def table_path(args):
+    return checkpoint_path(args, 'SCAN', 'concepts_' + args.ckpt_name)
+
+
+def run(args):
+    from dataset import return_dataset
+
+    nets = load_nets(args, ['beta_VAE', 'SCAN'])
+    if len(nets) < 2:
+        raise FileNotFoundError('the concept table needs beta_VAE and SCAN checkpoints named {}'.format(args.ckpt_name))
+    dataset = return_dataset(args, require_attr=True)
+
+    start = time.time()
+    table = ConceptTable.build(nets['SCAN'], dataset.attr_tensor)
+    build_sec = time.time() - start
+    torch.save(table.state_dict(), table_path(args))
+    print("=> saved {} concepts for {} images to '{}' ({:.1f}s)".format(
+        len(table), len(dataset), table_path(args), build_sec))
+
+    rng = np.random.RandomState(args.seed)
+    indices = rng.choice(len(dataset), min(args.concept_samples, len(dataset)), replace=False)
+    x, y = sample_batch(dataset, indices, args.num_workers)[:2]
+    y = (y >= 0.5).float()
+
+    graphs = {'decoder': Img2Sym(nets['beta_VAE'], nets['SCAN']).eval(),
+              'concepts': NearestConcept(nets['beta_VAE'], table, args.concept_chunk).eval()}
+    report = {'n_images': len(dataset), 'n_concepts': len(table), 'build_sec': build_sec,
+              'eval_samples': len(indices), 'graphs': {}}
+    with torch.no_grad():
+        predictions = {'decoder': (graphs['decoder'](x) > 0.5).float(), 'concepts': graphs['concepts'](x)}
+    for name, graph in graphs.items():
+        report['graphs'][name] = {'accuracy': (predictions[name] == y).float().mean().item(),
+                                  'exact_match': (predictions[name] == y).all(1).float().mean().item(),
+                                  'samples_per_sec': throughput(graph, x[:args.batch_size])}
+    report['agreement'] = (predictions['decoder'] == predictions['concepts']).float().mean().item()
+    report['speedup'] = report['graphs']['concepts']['samples_per_sec'] / report['graphs']['decoder']['samples_per_sec']
+
+    output_dir = os.path.join(args.root_dir, args.SCAN_env_name, args.output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, 'concepts_report.json'), 'w') as f:
+        json.dump(report, f, indent=2)
+    for name, entry in report['graphs'].items():
+        print('[{}] '.format(name) + ' '.join('{}:{:.4f}'.format(key, value) for key, value in entry.items()))
+    print('[agreement] {:.4f} [speedup] {:.2f}x'.format(report['agreement'], report['speedup']))
+    return report
@@ -0,0 +1,106 @@
+"""convergence.py
+
+Plateau detection on exponentially smoothed losses.
+
+Loss components are smoothed on their device every iteration (no host sync);
+every `check_step` iterations the smoothed `metric` is compared with its best
+value so far. After `patience` checks without a relative improvement of at
+least `min_delta`, the controller either decays the learning rate (mode
+'decay', at most `max_decays` times) or stops the run (mode 'stop', or 'decay'
+once the decays are used up).
+"""
+
+
+# smoothed losses every phase's solver reports
+PHASE_METRICS = {'DAE': ['loss', 'recon'],
+                 'beta_VAE': ['loss', 'recon', 'kld'],
+                 'SCAN': ['loss', 'recon', 'kld', 'relv']}
+
+
+class ConvergenceController(object):
+    def __init__(self, mode='none', metric='loss', ema_decay=0.99, check_step=1000, patience=10,
+                 min_delta=1e-3, lr_decay=0.5, max_decays=3):
+        if mode not in ['none', 'stop', 'decay']:
+            raise NotImplementedError('only support early_stop none, stop or decay')
+        self.mode = mode
+        self.enabled = mode != 'none'
+        self.metric = metric
+        self.ema_decay = ema_decay
+        self.check_step = check_step
+        self.patience = patience
+        self.min_delta = min_delta
+        self.lr_decay = lr_decay
+        self.max_decays = max_decays
+
+        self.ema = {}
+        self.n_updates = 0
+        self.best = None
+        self.bad_checks = 0
+        self.n_decays = 0
+        self.stopped = False
+        self.stop_reason = None
+
+    def update(self, **losses):
+        if not self.enabled:
+            return
+        self.n_updates += 1
+        for name, value in losses.items():
+            value = value.detach()
+            if name in self.ema:
+                self.ema[name] = self.ema_decay * self.ema[name] + (1 - self.ema_decay) * value
+            else:
+                self.ema[name] = (1 - self.ema_decay) * value
+
+    def smoothed(self):
+        """Bias-corrected smoothed losses as floats."""
+        correction = 1 - self.ema_decay ** self.n_updates
+        return {name: float(value) / correction for name, value in self.ema.items()}
+
+    def check(self, global_iter, optim):
+        """Call once per iteration; returns a message when the controller acts."""
+        if not self.enabled or global_iter % self.check_step != 0 or self.metric not in self.ema:
+            return None
+        smoothed = self.smoothed()
+        value = smoothed[self.metric]
+        if self.best is None or value < self.best - self.min_delta * abs(self.best):
+            self.best = value
+            self.bad_checks = 0
+            return None
+
+        self.bad_checks += 1
+        if self.bad_checks < self.patience:
+            return None
+        self.bad_checks = 0
+        losses = ' '.join('{}:{:.4f}'.format(name, v) for name, v in smoothed.items())
+
+        if self.mode == 'decay' and self.n_decays < self.max_decays:
+            self.n_decays += 1
+            for group in optim.param_groups:
+                group['lr'] *= self.lr_decay
+            return '[{}] {} plateaued at {:.4f}, lr decayed to {:.3g} ({}/{}) [{}]'.format(
+                global_iter, self.metric, value, optim.param_groups[0]['lr'],
+                self.n_decays, self.max_decays, losses)
+
+        self.stopped = True
+        self.stop_reason = {'iter': global_iter, 'metric': self.metric, 'value': value, 'best': self.best,
+                            'patience': self.patience, 'min_delta': self.min_delta,
+                            'lr_decays': self.n_decays, 'smoothed_losses': smoothed}
+        return '[{}] {} plateaued at {:.4f} (best {:.4f}) for {} checks, stopping [{}]'.format(
+            global_iter, self.metric, value, self.best, self.patience, losses)
+
+    def state_dict(self):
+        return {'smoothed': self.smoothed() if self.n_updates else {},
+                'n_updates': self.n_updates,
+                'best': self.best,
+                'bad_checks': self.bad_checks,
+                'n_decays': self.n_decays,
+                'stop_reason': self.stop_reason}
+
+    def load_state_dict(self, states):
+        """Restore the smoothing and the plateau bookkeeping; a stopped run may train further."""
+        self.n_updates = states['n_updates']
+        correction = 1 - self.ema_decay ** self.n_updates
+        self.ema = {name: value * correction for name, value in states['smoothed'].items()}
+        self.best = states['best']
+        self.bad_checks = states['bad_checks']
+        self.n_decays = states['n_decays']
@@ -1,22 +1,46 @@
 """dataset.py"""
 
 import os
+from functools import partial
 import numpy as np
 
 import torch
-from torch.utils.data import Dataset, DataLoader
+from torch.utils.data import Dataset, DataLoader, IterableDataset, Sampler
 from torchvision.datasets import ImageFolder
 from torchvision import transforms
 from tqdm import tqdm
+from PIL import Image
 
 
 def is_power_of_2(num):
     return ((num & (num - 1)) == 0) and num != 0
 
 
+def open_image(fp, draft_size=None):
+    """Decode an image file (path or file object) to RGB.
+
+    With draft_size, JPEGs are decoded in the DCT domain at the largest
+    power-of-two reduction (1/2, 1/4, 1/8) that keeps both sides at least
+    draft_size. Other formats ignore it.
+    """
+    img = Image.open(fp)
+    if draft_size is not None:
+        img.draft('RGB', (draft_size, draft_size))
+    return img.convert('RGB')
+
+
 class CustomImageFolder(ImageFolder):
-    def __init__(self, root, transform=None):
-        super(CustomImageFolder, self).__init__(root, transform)
+    def __init__(self, root, transform=None, draft_size=None):
+        if draft_size is None:
+            super(CustomImageFolder, self).__init__(root, transform)
+        else:
+            super(CustomImageFolder, self).__init__(root, transform, loader=partial(open_image, draft_size=draft_size))
+
+    def find_classes(self, directory):
+        # CelebA keeps its annotations in root/Anno, which holds no images
+        classes = sorted(entry.name for entry in os.scandir(directory)
+                         if entry.is_dir() and entry.name != 'Anno')
+        return classes, {name: i for i, name in enumerate(classes)}
 
     def __getitem__(self, index):
         path = self.imgs[index][0]
@@ -27,8 +51,8 @@ class CustomImageFolder(ImageFolder):
         return img
 
 class CustomMixDataset(Dataset):
-    def __init__(self, root, transform=None):
-        self.image_folder = CustomImageFolder(root, transform)
+    def __init__(self, root, transform=None, draft_size=None):
+        self.image_folder = CustomImageFolder(root, transform, draft_size)
         self.attr_tensor = self.get_tensor(root)
 
     def __getitem__(self, index):
@@ -62,8 +86,10 @@ class CustomMixDataset(Dataset):
         return attr_tensor
 
 class CustomTensorDataset(Dataset):
-    def __init__(self, data_tensor):
+    def __init__(self, data_tensor, latents_classes=None, latents_values=None):
         self.data_tensor = data_tensor
+        self.latents_classes = latents_classes
+        self.latents_values = latents_values
 
     def __getitem__(self, index):
         return self.data_tensor[index]
@@ -72,20 +98,91 @@ class CustomTensorDataset(Dataset):
         return self.data_tensor.size(0)
 
 
-def return_data(args, require_attr=False):
+class IndexedDataset(Dataset):
+    """Prepends the dataset index to every item, to look up cached latents.
+
+    With attributes_only, the images of a CustomMixDataset are not loaded at all:
+    items are [index, attributes, keys].
+    """
+
+    def __init__(self, dataset, attributes_only=False):
+        self.dataset = dataset
+        self.attributes_only = attributes_only
+        self.attr_tensor = getattr(dataset, 'attr_tensor', None)
+
+    def __getitem__(self, index):
+        if self.attributes_only:
+            return [index, self.dataset.attr_tensor[index], self.dataset.keys]
+        return [index, self.dataset[index]]
+
+    def __len__(self):
+        return len(self.dataset)
+
+
+class AttributeBalancedSampler(Sampler):
+    """Batch sampler covering rare attributes.
+
+    A `coverage` fraction of every batch is drawn from per-attribute pools of
+    positive examples: an attribute is picked with probability proportional to
+    count ** -alpha (alpha=0: every attribute equally often, alpha=1: rarer
+    attributes more often), then one of its positives uniformly. The rest of the
+    batch is drawn uniformly from the dataset. Pools are built once, and batches
+    are drawn in chunks with vectorized numpy sampling.
+    """
+
+    def __init__(self, attr_tensor, batch_size, n_batches, coverage=0.5, alpha=0., seed=0, chunk=1024):
+        if not 0 < coverage <= 1:
+            raise ValueError('attribute coverage must be in (0, 1], got {}'.format(coverage))
+        positives = np.asarray(attr_tensor) >= 0.5
+        self.n = positives.shape[0]
+        self.batch_size = batch_size
+        self.n_batches = n_batches
+        self.n_balanced = int(round(coverage * batch_size))
+        self.seed = seed
+        self.chunk = chunk
+        self.epoch = 0
+
+        # the pool of attribute k is self.pool[self.start[k]:self.start[k]+self.count[k]]
+        _, self.pool = np.nonzero(positives.T)
+        self.count = positives.sum(0)
+        self.start = np.cumsum(self.count) - self.count
+        weights = np.where(self.count > 0, np.maximum(self.count, 1) ** -float(alpha), 0.)
+        self.p = weights / weights.sum()
+
+    def __len__(self):
+        return self.n_batches
+
+    def __iter__(self):
+        rng = np.random.RandomState([self.seed, self.epoch])
+        self.epoch += 1
+        for first in range(0, self.n_batches, self.chunk):
+            n = min(self.chunk, self.n_batches - first)
+            attrs = rng.choice(len(self.p), size=[n, self.n_balanced], p=self.p)
+            offsets = (rng.rand(n, self.n_balanced) * self.count[attrs]).astype(np.int64)
+            balanced = self.pool[self.start[attrs] + offsets]
+            uniform = rng.randint(self.n, size=[n, self.batch_size - self.n_balanced])
+            batches = np.concatenate([balanced, uniform], axis=1)
+            for batch in batches:
+                yield batch.tolist()
+
+
+def return_data(args, require_attr=False, with_index=False):
+    return return_loader(args, return_dataset(args, require_attr, with_index), require_attr)
+
+
+def return_dataset(args, require_attr=False, with_index=False):
     name = args.dataset
     dset_dir = args.dset_dir
-    batch_size = args.batch_size
-    num_workers = args.num_workers
     image_size = args.image_size
     assert image_size == 64, 'currently only image size of 64 is supported'
+    draft_size = image_size if args.jpeg_draft else None
 
     if name.lower() == '3dchairs':
         root = os.path.join(dset_dir, '3DChairs')
         transform = transforms.Compose([
             transforms.Resize((image_size, image_size)),
             transforms.ToTensor(),])
-        train_kwargs = {'root':root, 'transform':transform}
+        train_kwargs = {'root':root, 'transform':transform, 'draft_size':draft_size}
         dset = CustomImageFolder
 
     elif name.lower() == 'celeba':
@@ -93,7 +190,7 @@ def return_data(args, require_attr=False):
         transform = transforms.Compose([
             transforms.Resize((image_size, image_size)),
             transforms.ToTensor(),])
-        train_kwargs = {'root':root, 'transform':transform}
+        train_kwargs = {'root':root, 'transform':transform, 'draft_size':draft_size}
         dset = CustomImageFolder if not require_attr else CustomMixDataset
 
     elif name.lower() == 'dsprites':
@@ -104,21 +201,58 @@ def return_data(args, require_attr=False):
             subprocess.call(['./download_dsprites.sh'])
             print('Finished')
         data = np.load(root, encoding='bytes')
+        latents_classes = data['latents_classes']
+        latents_values = data['latents_values']
         data = torch.from_numpy(data['imgs']).unsqueeze(1).float()
-        train_kwargs = {'data_tensor':data}
+        train_kwargs = {'data_tensor':data,
+                        'latents_classes':latents_classes,
+                        'latents_values':latents_values}
         dset = CustomTensorDataset
 
     else:
         raise NotImplementedError
 
+    if args.dset_format == 'shards':
+        from shards import ShardedImageDataset, shard_root
+        if name.lower() not in ['3dchairs', 'celeba']:
+            raise NotImplementedError('only image folder datasets can be sharded')
+        train_kwargs = {'root':shard_root(name, dset_dir), 'transform':transform, 'require_attr':require_attr,
+                        'buffer_size':args.shuffle_buffer, 'seed':args.seed, 'draft_size':draft_size}
+        dset = ShardedImageDataset
 
     train_data = dset(**train_kwargs)
-    train_loader = DataLoader(train_data,
-                              batch_size=batch_size,
-                              shuffle=True,
-                              num_workers=num_workers,
-                              pin_memory=True,
-                              drop_last=True)
+    if with_index:
+        if isinstance(train_data, IterableDataset):
+            raise NotImplementedError('cached latents need a random access dataset')
+        train_data = IndexedDataset(train_data, attributes_only=require_attr)
+    return train_data
+
+
+def return_loader(args, train_data, require_attr=False):
+    """DataLoader of a dataset built by return_dataset; cheap, unlike building the dataset."""
+    batch_size = args.batch_size
+    num_workers = args.num_workers
+    # batches each loader worker keeps ready; only valid with workers
+    loader_kwargs = {'prefetch_factor': args.prefetch_factor} if num_workers > 0 else {}
+
+    if require_attr and args.balanced_sampling:
+        if isinstance(train_data, IterableDataset):
+            raise NotImplementedError('attribute balanced sampling needs a random access dataset')
+        batch_sampler = AttributeBalancedSampler(train_data.attr_tensor, batch_size, len(train_data) // batch_size,
+                                                 args.attr_coverage, args.attr_alpha, args.seed)
+        train_loader = DataLoader(train_data,
+                                  batch_sampler=batch_sampler,
+                                  num_workers=num_workers,
+                                  pin_memory=True,
+                                  **loader_kwargs)
+    else:
+        train_loader = DataLoader(train_data,
+                                  batch_size=batch_size,
+                                  shuffle=not isinstance(train_data, IterableDataset),
+                                  num_workers=num_workers,
+                                  pin_memory=True,
+                                  drop_last=True,
+                                  **loader_kwargs)
 
     data_loader = train_loader
 
@@ -0,0 +1,71 @@
+"""export.py
+
+Exports trained nets into a deployable bundle under root_dir/export_dir:
+    <phase>_weights.pt         weights-only state dict in the chosen dtype
+    <phase>_{encoder,decoder}  traced TorchScript graphs
+    img2sym, sym2img           fused traced graphs, when the needed nets exist
+    *.onnx                     the same graphs in ONNX, optional
+    manifest.json              model classes, latent sizes and file names
+
+Bundles are loaded with inference.load_graph / inference.load_bundle_net.
+"""
+
+import os
+import json
+
+import torch
+
+from inference import PHASES, DTYPES, net_spec, load_nets, serving_graphs
+
+
+def example_inputs(nets, nc):
+    inputs = {}
+    for phase, net in nets.items():
+        if phase == 'SCAN':
+            inputs[phase + '_encoder'] = torch.rand(1, net.nc)
+        else:
+            inputs[phase + '_encoder'] = torch.rand(1, nc, 64, 64)
+        inputs[phase + '_decoder'] = torch.randn(1, net.z_dim)
+    inputs['img2sym'] = torch.rand(1, nc, 64, 64)
+    inputs['sym2img'] = torch.rand(1, 40)
+    return inputs
+
+
+def export_onnx(graph, example, file_path):
+    torch.onnx.export(graph, example, file_path, input_names=['input'], output_names=['output'],
+                      dynamic_axes={'input': {0: 'batch'}, 'output': {0: 'batch'}})
+
+
+def run(args):
+    export_dir = os.path.join(args.root_dir, args.export_dir)
+    os.makedirs(export_dir, exist_ok=True)
+    nets = load_nets(args, PHASES if args.SCAN else ['beta_VAE'])
+    if not nets:
+        raise FileNotFoundError('no checkpoint named {} to export'.format(args.ckpt_name))
+
+    manifest = {'ckpt_name': args.ckpt_name, 'dtype': args.export_dtype, 'nets': {}, 'graphs': {}}
+    for phase, net in nets.items():
+        file_name = '{}_weights.pt'.format(phase)
+        states = {key: value.to(DTYPES[args.export_dtype]) for key, value in net.state_dict().items()}
+        torch.save(states, os.path.join(export_dir, file_name))
+        manifest['nets'][phase] = {'model': net.__class__.__name__, 'z_dim': net.z_dim,
+                                   'nc': net.nc, 'weights': file_name}
+
+    nc = net_spec(args, 'beta_VAE')[2]
+    inputs = example_inputs(nets, nc)
+    with torch.no_grad():
+        for name, graph in serving_graphs(nets).items():
+            graph.eval()
+            traced = torch.jit.trace(graph, inputs[name])
+            traced.save(os.path.join(export_dir, name + '.pt'))
+            manifest['graphs'][name] = {'torchscript': name + '.pt',
+                                        'input_shape': list(inputs[name].shape[1:])}
+            if args.export_onnx:
+                export_onnx(graph, inputs[name], os.path.join(export_dir, name + '.onnx'))
+                manifest['graphs'][name]['onnx'] = name + '.onnx'
+            print("=> exported '{}'".format(name))
+
+    with open(os.path.join(export_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    print("=> saved bundle to '{}'".format(export_dir))
+    return manifest
@@ -0,0 +1,139 @@
+"""inference.py
+
+Builds the frozen nets from checkpoints or exported bundles without the training
+stack: only torch and model.py are imported, no visdom, PIL, tqdm or torchvision.
+"""
+
+import os
+import json
+
+import torch
+import torch.nn as nn
+
+from model import BetaVAE_H_net, BetaVAE_B_net, DAE_net, SCAN_net
+from utils import load_state
+
+
+PHASES = ['DAE', 'beta_VAE', 'SCAN']
+MODELS = {'DAE_net': DAE_net, 'BetaVAE_H_net': BetaVAE_H_net,
+          'BetaVAE_B_net': BetaVAE_B_net, 'SCAN_net': SCAN_net}
+DTYPES = {'float32': torch.float32, 'float16': torch.float16, 'bfloat16': torch.bfloat16}
+
+
+def image_channels(dataset):
+    if dataset.lower() == 'dsprites':
+        return 1
+    elif dataset.lower() in ['3dchairs', 'celeba']:
+        return 3
+    else:
+        raise NotImplementedError
+
+
+def net_spec(args, phase):
+    """Return (model class, z_dim, nc, env_name) of a phase, as the solvers build it."""
+    if phase == 'DAE':
+        return DAE_net, args.DAE_z_dim, image_channels(args.dataset), args.DAE_env_name
+    elif phase == 'beta_VAE':
+        if args.model == 'H':
+            model = BetaVAE_H_net
+        elif args.model == 'B':
+            model = BetaVAE_B_net
+        else:
+            raise NotImplementedError('only support model H or B')
+        return model, args.beta_VAE_z_dim, image_channels(args.dataset), args.beta_VAE_env_name
+    elif phase == 'SCAN':
+        return SCAN_net, args.SCAN_z_dim, 40, args.SCAN_env_name
+    else:
+        raise NotImplementedError
+
+
+def checkpoint_path(args, phase, ckpt_name=None):
+    env_name = net_spec(args, phase)[3]
+    return os.path.join(args.root_dir, env_name, args.ckpt_dir, ckpt_name or args.ckpt_name)
+
+
+def load_net(args, phase, ckpt_name=None, map_location='cpu'):
+    """Load the weights of a phase from its training checkpoint, ignoring optimizer and visdom states."""
+    model, z_dim, nc, _ = net_spec(args, phase)
+    checkpoint = load_state(checkpoint_path(args, phase, ckpt_name), map_location)
+    net = model(checkpoint.get('z_dim', z_dim), nc)
+    net.load_state_dict(checkpoint['net_states'])
+    return net.eval()
+
+
+def load_nets(args, phases=PHASES, ckpt_name=None, map_location='cpu'):
+    return {phase: load_net(args, phase, ckpt_name, map_location) for phase in phases
+            if os.path.isfile(checkpoint_path(args, phase, ckpt_name))}
+
+
+#---------------------------------GRAPHS-------------------------------------#
+# Serving graphs are deterministic: latents are taken at the posterior mean.
+
+class Encoder(nn.Module):
+    def __init__(self, net):
+        super(Encoder, self).__init__()
+        self.encoder = net.encoder
+        self.z_dim = net.z_dim
+
+    def forward(self, x):
+        return self.encoder(x)[:, :self.z_dim]
+
+class Img2Sym(nn.Module):
+    """image -> beta-VAE posterior mean -> SCAN decoder -> attribute probabilities"""
+
+    def __init__(self, beta_VAE_net, SCAN_net):
+        super(Img2Sym, self).__init__()
+        self.encoder = Encoder(beta_VAE_net)
+        self.decoder = SCAN_net.decoder
+
+    def forward(self, x):
+        return self.decoder(self.encoder(x))
+
+class Sym2Img(nn.Module):
+    """attributes -> SCAN posterior mean -> beta-VAE decoder -> DAE -> image"""
+
+    def __init__(self, SCAN_net, beta_VAE_net, DAE_net):
+        super(Sym2Img, self).__init__()
+        self.encoder = Encoder(SCAN_net)
+        self.decoder = beta_VAE_net.decoder
+        self.DAE_net = DAE_net
+
+    def forward(self, y):
+        return self.DAE_net(self.decoder(self.encoder(y)))
+
+
+def serving_graphs(nets):
+    """Return the traceable serving graphs available from a dict of loaded nets."""
+    graphs = {}
+    for phase, net in nets.items():
+        graphs[phase + '_encoder'] = net.encoder
+        graphs[phase + '_decoder'] = net.decoder
+    if 'beta_VAE' in nets and 'SCAN' in nets:
+        graphs['img2sym'] = Img2Sym(nets['beta_VAE'], nets['SCAN'])
+        if 'DAE' in nets:
+            graphs['sym2img'] = Sym2Img(nets['SCAN'], nets['beta_VAE'], nets['DAE'])
+    return graphs
+
+
+#---------------------------------BUNDLES-------------------------------------#
+
+def load_manifest(export_dir):
+    with open(os.path.join(export_dir, 'manifest.json')) as f:
+        return json.load(f)
+
+def load_graph(export_dir, name, map_location='cpu'):
+    """Load an exported TorchScript graph, e.g. 'img2sym' or 'beta_VAE_encoder'."""
+    return torch.jit.load(os.path.join(export_dir, name + '.pt'), map_location=map_location)
+
+def load_bundle_net(export_dir, phase, dtype=torch.float32, map_location='cpu'):
+    """Build a phase's net from its memory-mapped weights-only artifact."""
+    spec = load_manifest(export_dir)['nets'][phase]
+    states = load_state(os.path.join(export_dir, spec['weights']), map_location, mmap=True)
+    net = MODELS[spec['model']](spec['z_dim'], spec['nc'])
+    states = {key: value.to(dtype) for key, value in states.items()}
+    try:
+        # keeps the memory-mapped storages when no cast was needed
+        net.load_state_dict(states, assign=True)
+    except TypeError:
+        net.load_state_dict(states)
+    return net.eval()
@@ -0,0 +1,159 @@
+"""latent_stats.py
+
+One-pass latent activity statistics and pruned-latent export.
+
+Every latent's KL to the prior and the moments of the aggregate posterior are
+accumulated batch by batch over the whole dataset. Latents whose mean KL stays
+under a threshold have collapsed to the prior; they are removed from the last
+encoder layer and the first decoder layer. Fixing them to the prior mean (zero)
+drops their decoder columns without changing the output.
+"""
+
+import os
+import json
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader
+
+from inference import checkpoint_path
+
+
+class LatentStatistics(object):
+    """Running accumulators of per-dimension posterior statistics."""
+
+    def __init__(self, z_dim):
+        self.z_dim = z_dim
+        self.n = 0
+        self.sum_kl = np.zeros(z_dim)
+        self.sum_mu = np.zeros(z_dim)
+        self.sum_mu2 = np.zeros(z_dim)
+        self.sum_var = np.zeros(z_dim)
+
+    def update(self, mu, logvar):
+        mu = mu.detach().double()
+        logvar = logvar.detach().double()
+        var = logvar.exp()
+        self.n += mu.size(0)
+        self.sum_kl += (-0.5*(1 + logvar - mu.pow(2) - var)).sum(0).cpu().numpy()
+        self.sum_mu += mu.sum(0).cpu().numpy()
+        self.sum_mu2 += mu.pow(2).sum(0).cpu().numpy()
+        self.sum_var += var.sum(0).cpu().numpy()
+
+    @property
+    def kl(self):
+        return self.sum_kl / self.n
+
+    @property
+    def mean(self):
+        """Mean of the aggregate posterior."""
+        return self.sum_mu / self.n
+
+    @property
+    def variance(self):
+        """Variance of the aggregate posterior: E[var] + Var[mu]."""
+        return self.sum_var / self.n + self.sum_mu2 / self.n - self.mean ** 2
+
+    def active_dims(self, threshold=0.01):
+        return np.flatnonzero(self.kl > threshold)
+
+    def state_dict(self):
+        return {'n': self.n,
+                'kl': self.kl.tolist(),
+                'mean': self.mean.tolist(),
+                'variance': self.variance.tolist(),
+                'posterior_variance': (self.sum_var / self.n).tolist()}
+
+
+def collect_statistics(encoder, batches, z_dim, uses_cuda=False):
+    """Stream batches through encoder and accumulate statistics of its posterior."""
+    stats = LatentStatistics(z_dim)
+    with torch.no_grad():
+        for x in batches:
+            x = x.float()
+            x = x.cuda() if uses_cuda else x
+            distributions = encoder(x).view(x.size(0), -1)
+            stats.update(distributions[:, :z_dim], distributions[:, z_dim:])
+    return stats
+
+
+def _linear_layers(sequential):
+    return [name for name, m in sequential.named_children() if isinstance(m, nn.Linear)]
+
+
+def prune_net(net, active_dims):
+    """Return a copy of an AutoEncoder keeping only the latent dimensions in active_dims."""
+    active_dims = torch.as_tensor(np.asarray(active_dims), dtype=torch.long)
+    z_dim = net.z_dim
+    pruned = net.__class__(len(active_dims), net.nc)
+
+    encoder_out = 'encoder.{}.'.format(_linear_layers(net.encoder)[-1])
+    decoder_in = 'decoder.{}.'.format(_linear_layers(net.decoder)[0])
+    rows = torch.cat([active_dims, active_dims + z_dim])
+
+    states = {}
+    for key, value in net.state_dict().items():
+        value = value.cpu()
+        if key.startswith(encoder_out):
+            value = value[rows]
+        elif key == decoder_in + 'weight':
+            value = value[:, active_dims]
+        states[key] = value.clone()
+    pruned.load_state_dict(states)
+    return pruned
+
+
+def save_pruned(net, stats, active_dims, file_path):
+    states = {'net_states': prune_net(net, active_dims).state_dict(),
+              'z_dim': len(active_dims),
+              'full_z_dim': net.z_dim,
+              'nc': net.nc,
+              'active_dims': [int(d) for d in active_dims],
+              'stats': stats.state_dict()}
+    with open(file_path, mode='wb+') as f:
+        torch.save(states, f)
+    print("=> saved pruned net '{}' ({}/{} latents)".format(file_path, len(active_dims), net.z_dim))
+
+
+def run(solver):
+    """Collect latent statistics of a trained solver and export its pruned nets.
+
+    For SCAN, the beta-VAE (over images) and SCAN (over attributes) share one
+    latent space through the relevance term, so both are pruned to the union of
+    their active dimensions.
+    """
+    args = solver.args
+    threshold = args.kl_threshold
+    dataset = solver.dataset
+    loader = DataLoader(dataset, batch_size=args.metric_batch_size, shuffle=False,
+                        num_workers=args.num_workers, pin_memory=args.cuda)
+    solver.net_mode(train=False)
+
+    if hasattr(solver, 'beta_VAE_net'):
+        beta_VAE_net = solver.beta_VAE_net
+        image_stats = collect_statistics(beta_VAE_net._encode, (data[0] for data in loader),
+                                         beta_VAE_net.z_dim, args.cuda)
+        attr_batches = (torch.from_numpy(dataset.attr_tensor[i:i+args.metric_batch_size])
+                        for i in range(0, len(dataset), args.metric_batch_size))
+        attr_stats = collect_statistics(solver.net._encode, attr_batches, solver.z_dim, args.cuda)
+
+        active_dims = np.union1d(image_stats.active_dims(threshold), attr_stats.active_dims(threshold))
+        pruned = [(beta_VAE_net, image_stats, 'beta_VAE'), (solver.net, attr_stats, 'SCAN')]
+    else:
+        stats = collect_statistics(solver.net._encode, loader, solver.z_dim, args.cuda)
+        active_dims = stats.active_dims(threshold)
+        pruned = [(solver.net, stats, 'beta_VAE')]
+
+    report = {}
+    for net, stats, name in pruned:
+        # next to the phase's own checkpoints, where inference.load_net(args, name, 'pruned_<ckpt_name>') looks
+        save_pruned(net, stats, active_dims, checkpoint_path(args, name, 'pruned_' + args.ckpt_name))
+        report[name] = stats.state_dict()
+    report['active_dims'] = [int(d) for d in active_dims]
+    report['kl_threshold'] = threshold
+
+    with open(os.path.join(solver.output_dir, 'latent_stats.json'), 'w') as f:
+        json.dump(report, f, indent=2)
+    solver.net_mode(train=True)
+    return report
@@ -0,0 +1,232 @@
+"""latent_store.py
+
+Versioned on-disk cache of frozen-net outputs over a dataset: the DAE embedding
+of every image (beta_VAE phase) and the beta-VAE posterior of every image (SCAN).
+
+    root_dir/latent_dir/<phase>/
+        CURRENT                  name of the complete version that readers use
+        <version>/meta.json      checkpoint hash, data settings, size and chunking
+        <version>/chunk-00000.npy, ...
+
+A version is named after a hash of the checkpoint's net weights and of the data
+settings. It is encoded chunk by chunk by parallel worker processes. Each chunk
+is written to a temporary file and renamed, so an interrupted refresh resumes
+from the chunks on disk. CURRENT is replaced by an atomic rename once every
+chunk exists, so readers keep using the previous version until then.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import multiprocessing
+
+import numpy as np
+import torch
+
+from inference import checkpoint_path, load_net
+from utils import load_state
+
+
+def store_dir(args, phase):
+    return os.path.join(args.root_dir, args.latent_dir, phase)
+
+
+def data_settings(args):
+    """Everything besides the checkpoint that changes the images a latent is computed from."""
+    return {'dataset': args.dataset.lower(), 'image_size': args.image_size, 'jpeg_draft': args.jpeg_draft}
+
+
+def states_version(args, states):
+    """Hash of net weights and of the data settings."""
+    sha = hashlib.sha1(json.dumps(data_settings(args), sort_keys=True).encode())
+    for name in sorted(states):
+        sha.update(name.encode())
+        sha.update(states[name].cpu().numpy().tobytes())
+    return sha.hexdigest()[:16]
+
+
+def version_of(args, phase):
+    """Version of the latents of the phase's current checkpoint."""
+    return states_version(args, load_state(checkpoint_path(args, phase))['net_states'])
+
+
+def chunk_path(version_dir, chunk):
+    return os.path.join(version_dir, 'chunk-{:05d}.npy'.format(chunk))
+
+
+def current_version(root):
+    try:
+        with open(os.path.join(root, 'CURRENT')) as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return None
+
+
+def write_atomic(file_path, write):
+    tmp_path = '{}.tmp{}'.format(file_path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        write(f)
+    os.replace(tmp_path, file_path)
+
+
+class LatentStore(object):
+    """Reader of the current version of a phase's latents, indexed like the dataset.
+
+    A store bound to the frozen net the latents stand in for (see open_store)
+    only switches to a version together with the checkpoint it was computed
+    from, which it loads into the net.
+    """
+
+    def __init__(self, root, args=None, phase=None, net=None):
+        self.root = root
+        self.args = args
+        self.phase = phase
+        self.net = net
+        self.version = None
+        self.meta = None
+        self.latents = None
+        self.reload()
+
+    def reload(self):
+        """Switch to a newer complete version, if any; returns a message when it did or could not."""
+        version = current_version(self.root)
+        if version is None or version == self.version:
+            return None
+        states = None
+        if self.net is not None:
+            states = load_state(checkpoint_path(self.args, self.phase))['net_states']
+            if states_version(self.args, states) != version:
+                if self.version is not None or not self.args.latent_allow_stale:
+                    # the checkpoint moved on again since the refresh; wait for the next one
+                    return "=> latents '{}' version {} do not match the {} checkpoint, kept version {}".format(
+                        self.root, version, self.phase, self.version)
+                # explicitly allowed: the frozen net stays at its own checkpoint
+                states = None
+        version_dir = os.path.join(self.root, version)
+        with open(os.path.join(version_dir, 'meta.json')) as f:
+            meta = json.load(f)
+        self.latents = np.concatenate([np.load(chunk_path(version_dir, chunk))
+                                       for chunk in range(meta['n_chunks'])])
+        self.version, self.meta = version, meta
+        if states is not None:
+            self.net.load_state_dict(states)
+        return "=> loaded latents '{}' (version {}, iter {})".format(self.root, version, meta['iter'])
+
+    def __len__(self):
+        return len(self.latents)
+
+    def __getitem__(self, index):
+        return self.latents[np.asarray(index)]
+
+
+def open_store(args, phase, net):
+    """Open the latents of a phase for a downstream solver whose frozen net of that phase is net.
+
+    Latents computed from another checkpoint than the phase's current one are
+    refused, unless --latent_allow_stale.
+    """
+    root = store_dir(args, phase)
+    version = current_version(root)
+    if version is None:
+        raise FileNotFoundError("no complete latents at '{}', run --job latent_cache first".format(root))
+    with open(os.path.join(root, version, 'meta.json')) as f:
+        meta = json.load(f)
+    if meta['data'] != data_settings(args):
+        raise ValueError('latents at {} were computed with {}, not {}'.format(root, meta['data'], data_settings(args)))
+    if version != version_of(args, phase):
+        if not args.latent_allow_stale:
+            raise ValueError("latents at '{}' are from another {} checkpoint, refresh them with --job latent_cache "
+                             "(or train against them anyway with --latent_allow_stale True)".format(root, phase))
+        print("=> latents at '{}' are from another {} checkpoint than the frozen net".format(root, phase))
+    store = LatentStore(root, args, phase, net)
+    if store.version is None:
+        raise ValueError("the {} checkpoint changed while opening the latents at '{}', try again".format(phase, root))
+    print("=> loaded latents '{}' (version {}, iter {})".format(store.root, store.version, store.meta['iter']))
+    return store
+
+
+#---------------------------------REFRESH-------------------------------------#
+
+_worker = {}
+
+def _init_worker(args, phase, version_dir):
+    from dataset import return_data
+    torch.set_num_threads(args.latent_threads)
+    map_location = 'cuda' if args.cuda else 'cpu'
+    _worker['net'] = load_net(args, phase, map_location=map_location)
+    _worker['dataset'] = return_data(args).dataset
+    _worker['args'] = args
+    _worker['version_dir'] = version_dir
+
+def _encode_chunk(chunk):
+    from torch.utils.data import DataLoader, Subset
+    args, dataset, net = _worker['args'], _worker['dataset'], _worker['net']
+    indices = range(chunk * args.latent_chunk, min((chunk + 1) * args.latent_chunk, len(dataset)))
+    loader = DataLoader(Subset(dataset, indices), batch_size=args.metric_batch_size, num_workers=0)
+    latents = []
+    with torch.no_grad():
+        for x in loader:
+            if args.cuda:
+                x = x.cuda()
+            latents.append(net._encode(x).view(x.size(0), -1).cpu().numpy().astype(np.float32))
+    write_atomic(chunk_path(_worker['version_dir'], chunk), lambda f: np.save(f, np.concatenate(latents)))
+    return chunk
+
+
+def refresh(args, phase):
+    """Bring the phase's latents up to date with its checkpoint; returns the current version."""
+    from tqdm import tqdm
+    from dataset import return_data
+    root = store_dir(args, phase)
+    version = version_of(args, phase)
+    previous = current_version(root)
+    if version == previous:
+        print("=> latents '{}' are up to date (version {})".format(root, version))
+        return version
+
+    version_dir = os.path.join(root, version)
+    os.makedirs(version_dir, exist_ok=True)
+    meta_path = os.path.join(version_dir, 'meta.json')
+    if not os.path.isfile(meta_path):
+        n = len(return_data(args).dataset)
+        meta = {'phase': phase, 'checkpoint': checkpoint_path(args, phase),
+                'iter': load_state(checkpoint_path(args, phase))['iter'], 'data': data_settings(args),
+                'n': n, 'chunk': args.latent_chunk, 'n_chunks': (n + args.latent_chunk - 1) // args.latent_chunk}
+        write_atomic(meta_path, lambda f: f.write(json.dumps(meta, indent=2).encode()))
+    with open(meta_path) as f:
+        meta = json.load(f)
+    # resumes with the chunking the version was started with
+    args.latent_chunk = meta['chunk']
+
+    missing = [chunk for chunk in range(meta['n_chunks']) if not os.path.isfile(chunk_path(version_dir, chunk))]
+    pbar = tqdm(total=meta['n_chunks'], initial=meta['n_chunks'] - len(missing))
+    pbar.set_description('[{} latents {}]'.format(phase, version))
+    if args.latent_workers > 0:
+        context = multiprocessing.get_context('spawn')
+        with context.Pool(args.latent_workers, _init_worker, (args, phase, version_dir)) as pool:
+            for _ in pool.imap_unordered(_encode_chunk, missing):
+                pbar.update(1)
+    else:
+        _init_worker(args, phase, version_dir)
+        for chunk in missing:
+            _encode_chunk(chunk)
+            pbar.update(1)
+    pbar.close()
+
+    write_atomic(os.path.join(root, 'CURRENT'), lambda f: f.write(version.encode()))
+    # readers may still be opening the previous version; older and abandoned ones go
+    for entry in os.listdir(root):
+        if entry not in [version, previous] and os.path.isdir(os.path.join(root, entry)):
+            shutil.rmtree(os.path.join(root, entry), ignore_errors=True)
+    print("=> latents '{}' now at version {} (iter {})".format(root, version, meta['iter']))
+    return version
+
+
+def run(args):
+    """Refresh the latents of every frozen phase with a checkpoint."""
+    for phase in ['DAE', 'beta_VAE']:
+        if os.path.isfile(checkpoint_path(args, phase)):
+            refresh(args, phase)
+        else:
+            print("=> no {} checkpoint at '{}', skipped".format(phase, checkpoint_path(args, phase)))
@@ -2,11 +2,11 @@
 
 import argparse
 import os
+import sys
 
 import numpy as np
 import torch
 
-from solver import ori_beta_VAE, DAE, beta_VAE, SCAN
 from utils import str2bool
 
 torch.backends.cudnn.enabled = True
@@ -19,8 +19,18 @@ parser.add_argument('--phase', default='DAE', type=str, help='the stage of the t
 
 parser.add_argument('--image_size', default=64, type=int, help='image size. now only (64,64) is supported')
 parser.add_argument('--num_workers', default=20, type=int, help='dataloader num_workers')
+parser.add_argument('--prefetch_factor', default=2, type=int, help='number of batches loaded in advance by each dataloader worker')
+parser.add_argument('--num_threads', default=0, type=int, help='torch intra-op threads, 0 for the torch default')
+parser.add_argument('--autotune', default=False, type=str2bool, help='before training, pick the batch size, num_workers, prefetch_factor and num_threads with the highest throughput')
+parser.add_argument('--autotune_refresh', default=False, type=str2bool, help='search again even if this host and phase already have an autotuned configuration')
+parser.add_argument('--autotune_batch_sizes', default='16,32,64,128', type=str, help='comma separated batch sizes tried by --autotune')
+parser.add_argument('--autotune_mem_mb', default=0, type=float, help='reject autotune configurations whose process and worker RSS exceed this (MB), 0 for no limit')
+parser.add_argument('--autotune_warmup', default=5, type=int, help='untimed steps of every autotune trial')
+parser.add_argument('--autotune_steps', default=20, type=int, help='timed steps of every autotune trial')
 parser.add_argument('--train', default=True, type=str2bool, help='train or traverse')
+parser.add_argument('--job', default=None, type=str, help='run a standalone job instead of train/traverse: {metrics, latent_stats, latent_cache, export, quantize, concepts, serve, benchmark, pack_shards}')
 parser.add_argument('--seed', default=1, type=int, help='random seed')
+parser.add_argument('--n_seeds', default=1, type=int, help='beta_VAE phase: train this many replicas, seeded seed, seed+1, ..., in one process')
 parser.add_argument('--cuda', default=True, type=str2bool, help='enable cuda')
 parser.add_argument('--max_iter', default=1e6, type=float, help='maximum training iteration')
 parser.add_argument('--batch_size', default=64, type=int, help='batch size')
@@ -39,11 +49,31 @@ parser.add_argument('--lr', default=1e-4, type=float, help='learning rate')
 parser.add_argument('--beta1', default=0.9, type=float, help='Adam optimizer beta1')
 parser.add_argument('--beta2', default=0.999, type=float, help='Adam optimizer beta2')
 parser.add_argument('--epsilon', default=1e-8, type=float, help='Adam optimizer epsilon')
+parser.add_argument('--early_stop', default='none', type=str, help='action on a loss plateau: {none, stop, decay}; decay lowers the lr, then stops once max_lr_decays are used')
+parser.add_argument('--plateau_metric', default='loss', type=str, help='smoothed loss judged for plateaus: {loss, recon, kld, relv}')
+parser.add_argument('--plateau_check_step', default=1000, type=int, help='number of iterations between plateau checks')
+parser.add_argument('--plateau_patience', default=10, type=int, help='number of checks without improvement that make a plateau')
+parser.add_argument('--plateau_min_delta', default=1e-3, type=float, help='relative improvement of the smoothed loss that resets the patience')
+parser.add_argument('--ema_decay', default=0.99, type=float, help='decay of the exponential moving average of the losses')
+parser.add_argument('--lr_decay_factor', default=0.5, type=float, help='factor the lr is multiplied by on a plateau with --early_stop decay')
+parser.add_argument('--max_lr_decays', default=3, type=int, help='number of lr decays before --early_stop decay stops the run')
 
 parser.add_argument('--vis_on', default=True, type=str2bool, help='enable visdom visualization')
 parser.add_argument('--vis_port', default=6059, type=str, help='visdom port number')
 parser.add_argument('--gather_step', default=1000, type=int, help='numer of iterations after which data is gathered for visdom')
 parser.add_argument('--display_save_step', default=10000, type=int, help='number of iterations after which to display data and save checkpoint')
+parser.add_argument('--profile', default=False, type=str2bool, help='time every stage of the training loop and print a summary at every checkpoint')
+parser.add_argument('--profile_window', default=1000, type=int, help='number of recent iterations the timing percentiles are computed over')
+parser.add_argument('--trace_start', default=-1, type=int, help='iteration at which to start a torch.profiler trace, -1 to disable')
+parser.add_argument('--trace_iters', default=5, type=int, help='number of iterations captured in the torch.profiler trace')
+parser.add_argument('--mem_monitor', default=False, type=str2bool, help='record process, loader worker and allocator memory during training')
+parser.add_argument('--mem_step', default=1000, type=int, help='number of iterations between memory samples')
+parser.add_argument('--mem_window', default=10, type=int, help='number of memory samples over which monotonic growth is flagged')
+parser.add_argument('--mem_growth_mb', default=50, type=float, help='growth (MB) over the window above which a monotonic increase is reported')
+parser.add_argument('--mem_budget_mb', default=0, type=float, help='stop with MemoryError when process RSS plus loader worker private memory exceed this (MB), checked every iteration, 0 to disable')
+parser.add_argument('--eval_metrics', default=False, type=str2bool, help='compute disentanglement metrics (beta-VAE, FactorVAE, MIG) at every checkpoint, dsprites only')
+parser.add_argument('--metric_batch_size', default=2048, type=int, help='batch size of the encoder passes used by the evaluation jobs')
+parser.add_argument('--kl_threshold', default=0.01, type=float, help='mean KL (nats) under which a latent is considered collapsed to the prior')
 
 parser.add_argument('--root_dir', default='/data/hc/SCAN', type=str, help='root directory')
 parser.add_argument('--DAE_env_name', default='DAE', type=str, help='visdom env name')
@@ -51,16 +81,78 @@ parser.add_argument('--beta_VAE_env_name', default='beta_VAE', type=str, help='v
 parser.add_argument('--SCAN_env_name', default='SCAN', type=str, help='visdom env name')
 parser.add_argument('--dset_dir', default='dataset', type=str, help='dataset directory')
 parser.add_argument('--dataset', default='CelebA', type=str, help='dataset name')
+parser.add_argument('--jpeg_draft', default=False, type=str2bool, help='decode JPEGs at a reduced DCT scale close to image_size before resizing')
+parser.add_argument('--balanced_sampling', default=False, type=str2bool, help='draw SCAN batches with attribute-balanced sampling')
+parser.add_argument('--attr_coverage', default=0.5, type=float, help='fraction of every balanced batch drawn from per-attribute positive pools, in (0, 1]')
+parser.add_argument('--attr_alpha', default=0., type=float, help='attributes are picked with probability count**-alpha: 0 uniform, 1 favours rare attributes')
+parser.add_argument('--dset_format', default='folder', type=str, help='read images from the image folder or from packed shards: {folder, shards}')
+parser.add_argument('--shard_size_mb', default=256, type=int, help='approximate size of a shard written by --job pack_shards')
+parser.add_argument('--shuffle_buffer', default=2000, type=int, help='number of decoded images each loader worker shuffles within, for sharded datasets')
+parser.add_argument('--latent_cache', default=False, type=str2bool, help='train beta_VAE/SCAN on the cached DAE/beta-VAE latents of --job latent_cache instead of encoding every batch')
+parser.add_argument('--latent_allow_stale', default=False, type=str2bool, help='train on cached latents computed from another checkpoint than the frozen net')
+parser.add_argument('--latent_dir', default='latents', type=str, help='directory of the versioned latent caches, under root_dir')
+parser.add_argument('--latent_chunk', default=8192, type=int, help='number of images per latent cache chunk')
+parser.add_argument('--latent_workers', default=4, type=int, help='number of processes encoding latent cache chunks, 0 to encode in the main process')
+parser.add_argument('--latent_threads', default=1, type=int, help='torch threads of every latent cache process')
 parser.add_argument('--save_output', default=True, type=str2bool, help='save traverse images and gif')
 parser.add_argument('--output_dir', default='outputs', type=str, help='output directory')
 parser.add_argument('--ckpt_dir', default='checkpoints', type=str, help='checkpoint directory')
 parser.add_argument('--ckpt_name', default='last', type=str, help='name of the previous checkpoint')
-
-args = parser.parse_args()
-
-args.dset_dir = os.path.join(args.root_dir, args.dset_dir)
-
-args.cuda = args.cuda and torch.cuda.is_available()
+parser.add_argument('--ckpt_format', default='torch', type=str, help='checkpoint files: {torch, delta}; delta writes compressed deltas against periodic full snapshots')
+parser.add_argument('--ckpt_full_every', default=10, type=int, help='number of checkpoints between full snapshots with --ckpt_format delta')
+parser.add_argument('--export_dir', default='export', type=str, help='directory of the exported inference bundle')
+parser.add_argument('--export_dtype', default='float32', type=str, help='dtype of the exported weights: {float32, float16, bfloat16}')
+parser.add_argument('--export_onnx', default=False, type=str2bool, help='also export the traced graphs to ONNX')
+parser.add_argument('--quant_static', default=False, type=str2bool, help='statically quantize the conv/deconv stacks, not only the Linear layers')
+parser.add_argument('--quant_backend', default='fbgemm', type=str, help='quantized engine: {fbgemm, x86, qnnpack}')
+parser.add_argument('--quant_calib_samples', default=512, type=int, help='number of images used to calibrate static quantization')
+parser.add_argument('--quant_samples', default=2000, type=int, help='number of held-out images of the quantization accuracy report')
+parser.add_argument('--concept_samples', default=2000, type=int, help='number of images of the --job concepts accuracy report')
+parser.add_argument('--concept_chunk', default=4096, type=int, help='number of concepts scored at once by the nearest-concept search')
+parser.add_argument('--serve_workers', default=4, type=int, help='number of forked serving workers sharing one copy of the weights')
+parser.add_argument('--serve_threads', default=1, type=int, help='torch threads of every serving worker')
+parser.add_argument('--serve_requests', default=1000, type=int, help='number of random requests sent by --job serve')
+parser.add_argument('--serve_batch_size', default=16, type=int, help='batch size of every request sent by --job serve')
+parser.add_argument('--serve_watch', default=0, type=float, help='seconds between checks of the served checkpoint files, which are hot-swapped when they change; 0 to disable')
+parser.add_argument('--serve_swap_ckpt', default=None, type=str, help='checkpoint hot-swapped in by --job serve, defaults to --ckpt_name')
+parser.add_argument('--bench_out', default='benchmark.json', type=str, help='file the benchmark results are written to')
+parser.add_argument('--bench_baseline', default=None, type=str, help='previous benchmark results to flag regressions against')
+parser.add_argument('--bench_tolerance', default=0.1, type=float, help='relative change beyond which a benchmark metric is a regression')
+parser.add_argument('--bench_images', default=512, type=int, help='number of synthetic images per benchmark dataset')
+parser.add_argument('--bench_batch_sizes', default='16,64', type=str, help='comma separated batch sizes of the training benchmark')
+parser.add_argument('--bench_warmup', default=3, type=int, help='untimed iterations before every benchmark measurement')
+parser.add_argument('--bench_steps', default=20, type=int, help='timed iterations of every benchmark measurement')
+
+def parse_args(argv=None):
+    args = parser.parse_args(argv)
+    if args.job == 'metrics' or args.eval_metrics:
+        # checked up front, not at the first checkpoint of a training run
+        if args.dataset.lower() != 'dsprites':
+            parser.error('disentanglement metrics need the ground-truth latents of --dataset dsprites')
+        if args.SCAN and (args.phase != 'beta_VAE' or args.n_seeds > 1):
+            parser.error('disentanglement metrics are computed for a single beta_VAE: --phase beta_VAE --n_seeds 1')
+    if args.early_stop != 'none':
+        from convergence import PHASE_METRICS
+        metrics = PHASE_METRICS.get(args.phase if args.SCAN else 'beta_VAE', [])
+        if args.plateau_metric not in metrics:
+            parser.error('--plateau_metric {} is not tracked in this phase, choose from {}'.format(
+                args.plateau_metric, metrics))
+    if args.SCAN and args.phase == 'beta_VAE' and args.n_seeds > 1:
+        # replicas are checkpointed separately; they are displayed and traversed one at a time
+        if not args.train and args.job is None:
+            parser.error('traverse a single replica: --n_seeds 1 --beta_VAE_env_name {}_seed<seed>'.format(
+                args.beta_VAE_env_name))
+        if args.vis_on:
+            parser.error('the multi-seed beta_VAE has no visdom display, pass --vis_on False')
+    if args.job == 'latent_stats' and args.SCAN and (args.phase not in ['beta_VAE', 'SCAN'] or args.n_seeds > 1):
+        parser.error('latent statistics are computed for a single beta_VAE or SCAN: --phase beta_VAE or SCAN, --n_seeds 1')
+
+    args.dset_dir = os.path.join(args.root_dir, args.dset_dir)
+
+    args.cuda = args.cuda and torch.cuda.is_available()
+    if args.num_threads > 0:
+        torch.set_num_threads(args.num_threads)
+    return args
 
 def main(args):
     seed = args.seed
@@ -68,21 +160,63 @@ def main(args):
     torch.cuda.manual_seed(seed)
     np.random.seed(seed)
 
+    # jobs and solvers are imported on demand, so that e.g. an export never loads visdom or torchvision
+    if args.job == 'export':
+        import export
+        export.run(args)
+        return
+    elif args.job == 'quantize':
+        import quantize
+        quantize.run(args)
+        return
+    elif args.job == 'concepts':
+        import concepts
+        concepts.run(args)
+        return
+    elif args.job == 'latent_cache':
+        import latent_store
+        latent_store.run(args)
+        return
+    elif args.job == 'serve':
+        import serve
+        serve.run(args)
+        return
+    elif args.job == 'pack_shards':
+        import shards
+        shards.run(args)
+        return
+    elif args.job == 'benchmark':
+        import benchmark
+        if benchmark.run(args).get('regressions'):
+            sys.exit(1)
+        return
+
+    import solver
     if not args.SCAN:
-        model = ori_beta_VAE
+        model = solver.ori_beta_VAE
     else:
         if args.phase == 'DAE':
-            model = DAE
+            model = solver.DAE
+        elif args.phase == 'beta_VAE' and args.n_seeds > 1:
+            model = solver.beta_VAE_ensemble
         elif args.phase == 'beta_VAE':
-            model = beta_VAE
+            model = solver.beta_VAE
         elif args.phase == 'SCAN':
-            model = SCAN
+            model = solver.SCAN
     model = model(args)
 
-    if args.train:
+    if args.job == 'metrics':
+        model.eval_metrics()
+    elif args.job == 'latent_stats':
+        import latent_stats
+        latent_stats.run(model)
+    elif args.train:
+        if args.autotune:
+            import autotune
+            autotune.run(model)
         model.train()
     else:
         model.vis_traverse()
 
 if __name__ == "__main__":
-    main(args)
+    main(parse_args())
@@ -0,0 +1,221 @@
+"""memory.py
+
+Memory accounting of a training run: process and loader worker RSS, CUDA
+allocator stats, the largest live tensors grouped by owner (nets, optimizers,
+gather buffers, ...), detection of monotonic growth and a hard memory budget.
+
+RSS is read from /proc (linux). psutil is used instead when it is installed.
+"""
+
+import os
+import gc
+import json
+import time
+from collections import deque
+
+import torch
+import torch.nn as nn
+from torch.optim import Optimizer
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def rss_mb(pid=None):
+    pid = os.getpid() if pid is None else pid
+    if psutil is not None:
+        try:
+            return psutil.Process(pid).memory_info().rss / 2.**20
+        except psutil.Error:
+            return 0.
+    try:
+        with open('/proc/{}/statm'.format(pid)) as f:
+            return int(f.read().split()[1]) * PAGE_SIZE / 2.**20
+    except (IOError, OSError, ValueError):
+        return 0.
+
+
+def private_mb(pid=None):
+    """Memory only this process maps, excluding pages shared with a parent or with shared memory."""
+    pid = os.getpid() if pid is None else pid
+    try:
+        with open('/proc/{}/smaps_rollup'.format(pid)) as f:
+            return sum(int(line.split()[1]) for line in f
+                       if line.startswith(('Private_Clean:', 'Private_Dirty:'))) / 2.**10
+    except (IOError, OSError, ValueError):
+        return rss_mb(pid)
+
+
+def children_pids(pid=None):
+    pid = os.getpid() if pid is None else pid
+    if psutil is not None:
+        try:
+            return [child.pid for child in psutil.Process(pid).children(recursive=True)]
+        except psutil.Error:
+            return []
+    children = []
+    try:
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit():
+                continue
+            try:
+                with open('/proc/{}/stat'.format(entry)) as f:
+                    # the command name may contain spaces, the ppid follows its closing parenthesis
+                    ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+            except (IOError, OSError, ValueError, IndexError):
+                continue
+            if ppid == pid:
+                children.append(int(entry))
+    except OSError:
+        pass
+    return children
+
+
+def _tensors(obj, seen):
+    """Yield (path, tensor) of the tensors reachable from obj through modules, optimizers and containers."""
+    if torch.is_tensor(obj):
+        if id(obj) not in seen:
+            seen.add(id(obj))
+            yield '', obj
+            if obj.grad is not None:
+                for path, tensor in _tensors(obj.grad, seen):
+                    yield '.grad', tensor
+    elif isinstance(obj, nn.Module):
+        for name, tensor in list(obj.named_parameters()) + list(obj.named_buffers()):
+            for path, t in _tensors(tensor, seen):
+                yield '.' + name + path, t
+    elif isinstance(obj, Optimizer):
+        for i, state in enumerate(obj.state.values()):
+            for path, tensor in _tensors(state, seen):
+                yield '.state[{}]{}'.format(i, path), tensor
+    elif isinstance(obj, dict):
+        for key, value in obj.items():
+            for path, tensor in _tensors(value, seen):
+                yield '[{!r}]{}'.format(key, path), tensor
+    elif isinstance(obj, (list, tuple, deque)):
+        for i, value in enumerate(obj):
+            for path, tensor in _tensors(value, seen):
+                yield '[{}]{}'.format(i, path), tensor
+
+
+def tensor_census(owners, include_unowned=True):
+    """Return [(owner, path, MB, device)] of live tensors, largest first, and the MB held by each owner."""
+    seen = set()
+    entries = []
+    for owner, obj in owners.items():
+        for path, tensor in _tensors(obj, seen):
+            entries.append((owner, path, tensor.element_size() * tensor.nelement() / 2.**20, str(tensor.device)))
+    if include_unowned:
+        for obj in gc.get_objects():
+            try:
+                if torch.is_tensor(obj) and id(obj) not in seen:
+                    seen.add(id(obj))
+                    entries.append(('other', '', obj.element_size() * obj.nelement() / 2.**20, str(obj.device)))
+            except ReferenceError:
+                continue
+    entries.sort(key=lambda entry: -entry[2])
+    totals = {}
+    for owner, _, size, _ in entries:
+        totals[owner] = totals.get(owner, 0.) + size
+    return entries, totals
+
+
+class MemoryMonitor(object):
+    """Samples memory every `step` iterations, flags growth over `window` samples and enforces a budget.
+
+    The budget is checked at every iteration, with or without sampling: it
+    only reads the RSS of the process and of its known loader workers.
+    """
+
+    def __init__(self, enabled=True, step=1000, window=10, growth_mb=50., budget_mb=0.,
+                 phase='', log_path=None, uses_cuda=False):
+        self.enabled = enabled
+        self.step = step
+        self.window = window
+        self.growth_mb = growth_mb
+        self.budget_mb = budget_mb
+        self.phase = phase
+        self.log_path = log_path
+        self.uses_cuda = uses_cuda
+        self.history = deque(maxlen=window)
+        self.worker_pids = None
+
+    def total_mb(self):
+        """Process RSS plus the private memory of the loader workers.
+
+        Pages a worker shares with this process (the copy-on-write dataset,
+        torch libraries) are already in its RSS and are not counted again.
+        Workers are listed again once one of them has exited.
+        """
+        if self.worker_pids is None:
+            self.worker_pids = children_pids()
+        workers = [private_mb(pid) for pid in self.worker_pids]
+        if not all(workers):
+            self.worker_pids = children_pids()
+            workers = [private_mb(pid) for pid in self.worker_pids]
+        return rss_mb() + sum(workers)
+
+    def sample(self, global_iter):
+        workers = {pid: rss_mb(pid) for pid in children_pids()}
+        self.worker_pids = list(workers)
+        sample = {'time': time.time(), 'iter': global_iter, 'phase': self.phase,
+                  'rss_mb': rss_mb(), 'workers_rss_mb': sum(workers.values()), 'n_workers': len(workers)}
+        sample['total_rss_mb'] = sample['rss_mb'] + sample['workers_rss_mb']
+        if self.uses_cuda:
+            sample['cuda_allocated_mb'] = torch.cuda.memory_allocated() / 2.**20
+            sample['cuda_reserved_mb'] = torch.cuda.memory_reserved() / 2.**20
+            sample['cuda_peak_mb'] = torch.cuda.max_memory_allocated() / 2.**20
+        return sample
+
+    def growing(self):
+        """True if RSS never decreased over a full window and grew by more than growth_mb."""
+        if len(self.history) < self.window:
+            return False
+        rss = [sample['total_rss_mb'] for sample in self.history]
+        monotonic = all(b >= a for a, b in zip(rss, rss[1:]))
+        return monotonic and rss[-1] - rss[0] > self.growth_mb
+
+    def __call__(self, global_iter, owners):
+        """Call once per iteration; returns a message to print, if any."""
+        if self.budget_mb > 0:
+            total_mb = self.total_mb()
+            if total_mb > self.budget_mb:
+                raise MemoryError('[{}] {:.0f} MB resident exceeds the budget of {:.0f} MB\n{}'.format(
+                    global_iter, total_mb, self.budget_mb, self.report(owners)))
+        if not self.enabled or global_iter % self.step != 0:
+            return None
+        sample = self.sample(global_iter)
+        self.history.append(sample)
+        if self.log_path is not None:
+            with open(self.log_path, 'a') as f:
+                f.write(json.dumps(sample) + '\n')
+
+        if self.growing():
+            rss = [s['total_rss_mb'] for s in self.history]
+            return '[Memory] {} RSS grew monotonically by {:.0f} MB over the last {} samples\n{}'.format(
+                self.phase, rss[-1] - rss[0], self.window, self.report(owners))
+        return None
+
+    def summary(self):
+        if not self.history:
+            return ''
+        sample = self.history[-1]
+        message = '[Memory] {} rss {:.0f} MB, {} workers {:.0f} MB'.format(
+            self.phase, sample['rss_mb'], sample['n_workers'], sample['workers_rss_mb'])
+        if 'cuda_allocated_mb' in sample:
+            message += ', cuda {:.0f} MB allocated / {:.0f} MB reserved'.format(
+                sample['cuda_allocated_mb'], sample['cuda_reserved_mb'])
+        return message
+
+    def report(self, owners, top=10):
+        entries, totals = tensor_census(owners)
+        lines = ['  by owner: ' + ', '.join('{} {:.1f} MB'.format(owner, size) for owner, size in
+                                           sorted(totals.items(), key=lambda item: -item[1]))]
+        for owner, path, size, device in entries[:top]:
+            lines.append('  {:>9.2f} MB  {}{}  ({})'.format(size, owner, path, device))
+        return '\n'.join(lines)
@@ -0,0 +1,172 @@
+"""metrics.py
+
+Disentanglement metrics for models trained on dSprites:
+    beta-VAE metric   (Higgins et al, ICLR, 2017)
+    FactorVAE metric  (Kim & Mnih, ICML, 2018)
+    MIG               (Chen et al, NeurIPS, 2018)
+
+The encoder runs once, in batches, over the whole dataset. All metrics are then
+computed from the cached posterior means with vectorized numpy indexing, so no
+python loop runs per sample.
+"""
+
+import numpy as np
+import torch
+
+
+def encode_dataset(net, data_tensor, z_dim, batch_size=2048, uses_cuda=False):
+    """Return the posterior means and log-variances of every image in data_tensor."""
+    mus = np.empty([data_tensor.size(0), z_dim], dtype=np.float32)
+    logvars = np.empty([data_tensor.size(0), z_dim], dtype=np.float32)
+    with torch.no_grad():
+        for start in range(0, data_tensor.size(0), batch_size):
+            x = data_tensor[start:start+batch_size]
+            x = x.cuda() if uses_cuda else x
+            distributions = net._encode(x).view(x.size(0), -1).cpu().numpy()
+            mus[start:start+x.size(0)] = distributions[:, :z_dim]
+            logvars[start:start+x.size(0)] = distributions[:, z_dim:]
+    return mus, logvars
+
+
+class FactorSampler(object):
+    """Maps ground-truth factor combinations to dataset indices."""
+
+    def __init__(self, latents_classes):
+        latents_classes = np.asarray(latents_classes, dtype=np.int64)
+        self.sizes = latents_classes.max(0) + 1
+        self.bases = np.concatenate([np.cumprod(self.sizes[::-1])[::-1][1:], [1]]).astype(np.int64)
+        self.lookup = np.empty(int(np.prod(self.sizes)), dtype=np.int64)
+        self.lookup[latents_classes.dot(self.bases)] = np.arange(latents_classes.shape[0])
+        # constant factors (e.g. the colour of dSprites) carry no information
+        self.factors = np.flatnonzero(self.sizes > 1)
+
+    def sample(self, rng, shape):
+        """Sample uniformly random factor classes of the given leading shape."""
+        return rng.randint(0, self.sizes, size=tuple(shape) + (len(self.sizes),))
+
+    def sample_fixed(self, rng, n_points, batch_size, share='all'):
+        """Sample n_points groups of batch_size factor vectors that share one factor.
+
+        share='all' keeps the chosen factor constant inside a group (FactorVAE),
+        share='pairs' draws two groups whose rows agree on the chosen factor (beta-VAE).
+        """
+        k = self.factors[rng.randint(len(self.factors), size=n_points)]
+        v1 = self.sample(rng, [n_points, batch_size])
+        rows = np.arange(n_points)[:, None]
+        cols = np.arange(batch_size)[None, :]
+        if share == 'all':
+            v1[rows, cols, k[:, None]] = v1[np.arange(n_points), 0, k][:, None]
+            return k, self.indices(v1)
+        v2 = self.sample(rng, [n_points, batch_size])
+        v2[rows, cols, k[:, None]] = v1[rows, cols, k[:, None]]
+        return k, self.indices(v1), self.indices(v2)
+
+    def indices(self, classes):
+        return self.lookup[classes.dot(self.bases)]
+
+
+def _linear_classifier_accuracy(x_train, y_train, x_eval, y_eval, n_classes, n_steps=500, lr=1e-2):
+    x_train = torch.from_numpy(x_train)
+    y_train = torch.from_numpy(y_train)
+    x_eval = torch.from_numpy(x_eval)
+    y_eval = torch.from_numpy(y_eval)
+
+    mean = x_train.mean(0, keepdim=True)
+    std = x_train.std(0, keepdim=True).clamp(min=1e-8)
+    x_train = (x_train - mean) / std
+    x_eval = (x_eval - mean) / std
+
+    classifier = torch.nn.Linear(x_train.size(1), n_classes)
+    optimizer = torch.optim.Adam(classifier.parameters(), lr=lr)
+    for _ in range(n_steps):
+        loss = torch.nn.functional.cross_entropy(classifier(x_train), y_train)
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+
+    with torch.no_grad():
+        train_acc = (classifier(x_train).argmax(1) == y_train).float().mean().item()
+        eval_acc = (classifier(x_eval).argmax(1) == y_eval).float().mean().item()
+    return train_acc, eval_acc
+
+
+def beta_vae_metric(mus, sampler, rng, n_train=10000, n_eval=5000, batch_size=64):
+    def features(n_points):
+        k, idx1, idx2 = sampler.sample_fixed(rng, n_points, batch_size, share='pairs')
+        z_diff = np.abs(mus[idx1] - mus[idx2]).mean(1)
+        return z_diff.astype(np.float32), np.searchsorted(sampler.factors, k)
+
+    x_train, y_train = features(n_train)
+    x_eval, y_eval = features(n_eval)
+    train_acc, eval_acc = _linear_classifier_accuracy(x_train, y_train, x_eval, y_eval,
+                                                      len(sampler.factors))
+    return {'beta_vae_train_accuracy': train_acc, 'beta_vae_eval_accuracy': eval_acc}
+
+
+def factor_vae_metric(mus, sampler, rng, n_train=10000, n_eval=5000, batch_size=64,
+                      n_variance=10000, prune_threshold=0.05):
+    scale = mus[rng.randint(mus.shape[0], size=n_variance)].std(0)
+    active = scale ** 2 > prune_threshold
+    if not active.any():
+        return {'factor_vae_train_accuracy': 0., 'factor_vae_eval_accuracy': 0., 'active_dims': 0}
+    scale = np.where(active, scale, 1.)
+
+    def votes(n_points):
+        k, idx = sampler.sample_fixed(rng, n_points, batch_size, share='all')
+        variances = (mus[idx] / scale).var(1)
+        variances[:, ~active] = np.inf
+        return variances.argmin(1), np.searchsorted(sampler.factors, k)
+
+    d_train, k_train = votes(n_train)
+    d_eval, k_eval = votes(n_eval)
+    counts = np.zeros([mus.shape[1], len(sampler.factors)], dtype=np.int64)
+    np.add.at(counts, (d_train, k_train), 1)
+    majority = counts.argmax(1)
+
+    return {'factor_vae_train_accuracy': float(counts.max(1).sum()) / n_train,
+            'factor_vae_eval_accuracy': float((majority[d_eval] == k_eval).mean()),
+            'active_dims': int(active.sum())}
+
+
+def _discrete_entropy(counts):
+    p = counts / counts.sum(-1, keepdims=True)
+    return -(p * np.log(np.where(p > 0, p, 1.))).sum(-1)
+
+
+def mutual_information_gap(mus, latents_classes, factors, n_bins=20):
+    n, z_dim = mus.shape
+    low, high = mus.min(0), mus.max(0)
+    codes = ((mus - low) / np.maximum(high - low, 1e-8) * n_bins).astype(np.int64)
+    codes = np.clip(codes, 0, n_bins - 1) + np.arange(z_dim) * n_bins
+
+    gaps = []
+    for k in factors:
+        classes = latents_classes[:, k].astype(np.int64)
+        n_classes = int(classes.max()) + 1
+        joint = np.bincount((codes * n_classes + classes[:, None]).ravel(),
+                            minlength=z_dim * n_bins * n_classes)
+        joint = joint.reshape(z_dim, n_bins, n_classes) / float(n)
+        p_code = joint.sum(2, keepdims=True)
+        p_class = joint.sum(1, keepdims=True)
+        ratio = np.where(joint > 0, joint / np.maximum(p_code * p_class, 1e-12), 1.)
+        mi = (joint * np.log(ratio)).sum((1, 2))
+        top = np.sort(mi)[::-1]
+        gaps.append((top[0] - top[1]) / _discrete_entropy(np.bincount(classes)))
+
+    return {'mig': float(np.mean(gaps)), 'mig_per_factor': [float(g) for g in gaps]}
+
+
+def compute_metrics(net, dataset, z_dim, uses_cuda=False, batch_size=2048, seed=0):
+    """Run the full metric suite on a CustomTensorDataset holding dSprites."""
+    if getattr(dataset, 'latents_classes', None) is None:
+        raise ValueError('disentanglement metrics need a dataset with ground-truth latents (dsprites)')
+
+    rng = np.random.RandomState(seed)
+    mus, logvars = encode_dataset(net, dataset.data_tensor, z_dim, batch_size, uses_cuda)
+    sampler = FactorSampler(dataset.latents_classes)
+
+    scores = {}
+    scores.update(beta_vae_metric(mus, sampler, rng))
+    scores.update(factor_vae_metric(mus, sampler, rng))
+    scores.update(mutual_information_gap(mus, dataset.latents_classes, sampler.factors))
+    return scores
@@ -1,5 +1,6 @@
 """implementing models"""
 
+import torch
 import torch.nn as nn
 import torch.nn.init as init
 from torch.autograd import Variable
@@ -16,7 +17,8 @@ class View(nn.Module):
         self.size = size
 
     def forward(self, tensor):
-        return tensor.view(self.size)
+        # reshape: statically quantized conv stacks hand over channels_last tensors
+        return tensor.reshape(self.size)
 
 def kaiming_init(m):
     if isinstance(m, (nn.Linear, nn.Conv2d)):
@@ -200,3 +202,95 @@ class SCAN_net(AutoEncoder):
             nn.Sigmoid(),
         )
         self.weight_init()
+
+
+def group_layers(layers):
+    """One layer evaluating the given identical layers side by side, the i-th on the i-th channel group."""
+    n = len(layers)
+    layer = layers[0]
+    if isinstance(layer, View):
+        # grouped channels are contiguous, so a flattening View becomes a 1x1 feature map
+        size = layer.size
+        return View((-1, size[1] * n) + (tuple(size[2:]) or (1, 1)))
+    elif isinstance(layer, nn.Linear):
+        # a Linear layer on a 1x1 feature map is a 1x1 convolution
+        grouped = nn.Conv2d(layer.in_features * n, layer.out_features * n, 1, groups=n)
+        weights = [l.weight.data.view(l.out_features, l.in_features, 1, 1) for l in layers]
+    elif isinstance(layer, (nn.Conv2d, nn.ConvTranspose2d)):
+        grouped = type(layer)(layer.in_channels * n, layer.out_channels * n, layer.kernel_size,
+                              layer.stride, layer.padding, groups=n)
+        weights = [l.weight.data for l in layers]
+    else:
+        return layer
+    grouped.weight.data.copy_(torch.cat(weights))
+    grouped.bias.data.copy_(torch.cat([l.bias.data for l in layers]))
+    return grouped
+
+# per-parameter optimizer buffers, split between the replicas; other entries, such as Adam's step, are shared
+OPTIM_BUFFERS = ('exp_avg', 'exp_avg_sq', 'max_exp_avg_sq')
+
+class GroupedAutoEncoder(nn.Module):
+    """n AutoEncoder replicas evaluated as one net of grouped convolutions.
+
+    The i-th channel group of every layer holds the weights of replica i, so
+    every parameter splits into the replica parameters along its first dim.
+    forward returns x_recon, mu and logvar stacked along a leading replica dim.
+    """
+
+    def __init__(self, replicas):
+        super(GroupedAutoEncoder, self).__init__()
+        self.n = len(replicas)
+        self.z_dim = replicas[0].z_dim
+        self.nc = replicas[0].nc
+        self.shapes = [param.shape for param in replicas[0].parameters()]
+        self.encoder = nn.Sequential(*[group_layers(layers) for layers in
+                                       zip(*[replica.encoder for replica in replicas])])
+        self.decoder = nn.Sequential(*[group_layers(layers) for layers in
+                                       zip(*[replica.decoder for replica in replicas])])
+
+    def forward(self, x):
+        distributions = self._encode(x)
+        mu = distributions[..., :self.z_dim]
+        logvar = distributions[..., self.z_dim:]
+        z = reparametrize(mu, logvar)
+        x_recon = self._decode(z)
+
+        return x_recon, mu, logvar
+
+    def _encode(self, x):
+        distributions = self.encoder(x.repeat(1, self.n, 1, 1))
+        return distributions.view(x.size(0), self.n, -1).transpose(0, 1)
+    def _decode(self, z):
+        batch_size = z.size(1)
+        x = self.decoder(z.transpose(0, 1).reshape(batch_size, self.n * self.z_dim, 1, 1))
+        return x.view(batch_size, self.n, self.nc, x.size(2), x.size(3)).transpose(0, 1)
+
+    def split(self, index, tensor, i):
+        """Replica i's part of a tensor shaped like the index-th parameter."""
+        return tensor.chunk(self.n)[i].reshape(self.shapes[index])
+    def merge(self, index, tensors):
+        """Inverse of split over all the replicas."""
+        return torch.cat([tensor.reshape(-1, *self.parameter(index).shape[1:]) for tensor in tensors])
+    def parameter(self, index):
+        return list(self.parameters())[index]
+
+    def replica_state_dict(self, i):
+        return {name: self.split(index, param.data, i).clone()
+                for index, (name, param) in enumerate(self.named_parameters())}
+    def load_replica_state_dicts(self, state_dicts):
+        for index, (name, param) in enumerate(self.named_parameters()):
+            param.data.copy_(self.merge(index, [state_dict[name] for state_dict in state_dicts]))
+
+    def replica_optim_state(self, optim_state, i):
+        """Replica i's part of the optimizer state_dict of this net's parameters."""
+        state = {index: {key: self.split(index, value, i).clone() if key in OPTIM_BUFFERS else value
+                         for key, value in param_state.items()}
+                 for index, param_state in optim_state['state'].items()}
+        return {'state': state, 'param_groups': optim_state['param_groups']}
+    def merge_optim_states(self, optim_states):
+        """Inverse of replica_optim_state over all the replicas."""
+        state = {index: {key: self.merge(index, [s['state'][index][key] for s in optim_states])
+                         if key in OPTIM_BUFFERS else value
+                         for key, value in param_state.items()}
+                 for index, param_state in optim_states[0]['state'].items()}
+        return {'state': state, 'param_groups': optim_states[0]['param_groups']}
@@ -0,0 +1,181 @@
+"""profiling.py
+
+Per-stage wall-clock timing of the training loop and torch.profiler capture.
+
+Stages nest: the time of an inner stage (e.g. 'frozen' inside 'forward') is
+subtracted from its parent, so the stages of one iteration add up to its step
+time.
+"""
+
+import os
+import time
+from collections import OrderedDict, deque
+
+import numpy as np
+import torch
+
+
+class _NullStage(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_STAGE = _NullStage()
+
+
+class _Stage(object):
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+        self.record = None
+
+    def __enter__(self):
+        self.timer.sync()
+        if self.timer.record:
+            self.record = torch.profiler.record_function(self.name)
+            self.record.__enter__()
+        self.child_time = 0.
+        self.start = time.time()
+        self.timer.stack.append(self)
+        return self
+
+    def __exit__(self, *exc):
+        self.timer.sync()
+        elapsed = time.time() - self.start
+        self.timer.stack.pop()
+        if self.timer.stack:
+            self.timer.stack[-1].child_time += elapsed
+        self.timer.add(self.name, elapsed - self.child_time)
+        if self.record is not None:
+            self.record.__exit__(*exc)
+        return False
+
+
+class StageTimer(object):
+    """Accumulates the time of named stages per iteration over a rolling window."""
+
+    def __init__(self, enabled=True, window=1000, uses_cuda=False):
+        self.enabled = enabled
+        self.window = window
+        self.uses_cuda = uses_cuda
+        self.record = False
+        self.stack = []
+        self.current = OrderedDict()
+        self.history = OrderedDict()
+        self.steps = deque(maxlen=window)
+        self.samples = deque(maxlen=window)
+        self.step_start = None
+
+    def __call__(self, name):
+        if not self.enabled:
+            return NULL_STAGE
+        return _Stage(self, name)
+
+    def sync(self):
+        if self.uses_cuda:
+            torch.cuda.synchronize()
+
+    def add(self, name, seconds):
+        self.current[name] = self.current.get(name, 0.) + seconds
+
+    def iterate(self, iterable, name='data'):
+        """Yield from iterable, timing every fetch as stage name."""
+        iterator = iter(iterable)
+        while True:
+            with self(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def step_begin(self):
+        if self.enabled and self.step_start is None:
+            self.step_start = time.time()
+
+    def step_end(self, n_samples):
+        """Close an iteration that started at the previous step_end (or step_begin)."""
+        if not self.enabled:
+            return
+        now = time.time()
+        for name in self.current:
+            if name not in self.history:
+                self.history[name] = deque([0.] * len(self.steps), maxlen=self.window)
+        for name in self.history:
+            self.history[name].append(self.current.get(name, 0.))
+        self.steps.append(now - self.step_start)
+        self.samples.append(n_samples)
+        self.current = OrderedDict()
+        self.step_start = now
+
+    def summary(self):
+        if not self.steps:
+            return {}
+        total = float(np.sum(self.steps))
+        summary = OrderedDict()
+        for name, history in self.history.items():
+            ms = np.asarray(history) * 1e3
+            summary[name] = {'mean_ms': float(ms.mean()),
+                             'p50_ms': float(np.percentile(ms, 50)),
+                             'p90_ms': float(np.percentile(ms, 90)),
+                             'p99_ms': float(np.percentile(ms, 99)),
+                             'share': float(ms.sum() / 1e3 / total)}
+        summary['step'] = {'mean_ms': total / len(self.steps) * 1e3,
+                           'iters_per_sec': len(self.steps) / total,
+                           'samples_per_sec': float(np.sum(self.samples)) / total}
+        return summary
+
+    def format(self):
+        summary = self.summary()
+        if not summary:
+            return ''
+        step = summary.pop('step')
+        lines = ['[Timing] {:.1f} ms/iter, {:.1f} iters/s, {:.1f} samples/s (last {} iters)'.format(
+            step['mean_ms'], step['iters_per_sec'], step['samples_per_sec'], len(self.steps))]
+        for name, stats in summary.items():
+            lines.append('  {:<10} mean {:8.2f}  p50 {:8.2f}  p90 {:8.2f}  p99 {:8.2f} ms  {:5.1%}'.format(
+                name, stats['mean_ms'], stats['p50_ms'], stats['p90_ms'], stats['p99_ms'], stats['share']))
+        return '\n'.join(lines)
+
+
+class TraceWindow(object):
+    """Captures a torch.profiler trace (with memory) of iterations [start, start+n_iters)."""
+
+    def __init__(self, start, n_iters, output_dir, uses_cuda=False):
+        self.start = start
+        self.stop = start + n_iters
+        self.output_dir = output_dir
+        self.uses_cuda = uses_cuda
+        self.profiler = None
+
+    def step(self, global_iter, timer=None):
+        """Call at the beginning of every iteration; returns a summary when a trace is written."""
+        if self.start < 0:
+            return None
+        if global_iter == self.start and self.profiler is None:
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if self.uses_cuda:
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            self.profiler = torch.profiler.profile(activities=activities, record_shapes=True,
+                                                   profile_memory=True)
+            self.profiler.__enter__()
+            if timer is not None:
+                timer.record = True
+        elif global_iter == self.stop and self.profiler is not None:
+            return self.close(timer)
+        return None
+
+    def close(self, timer=None):
+        if self.profiler is None:
+            return None
+        self.profiler.__exit__(None, None, None)
+        if timer is not None:
+            timer.record = False
+        os.makedirs(self.output_dir, exist_ok=True)
+        file_path = os.path.join(self.output_dir, 'trace_{}_{}.json'.format(self.start, self.stop))
+        self.profiler.export_chrome_trace(file_path)
+        table = self.profiler.key_averages().table(sort_by='self_cpu_time_total', row_limit=15)
+        self.profiler = None
+        return "=> saved profiler trace '{}'\n{}".format(file_path, table)
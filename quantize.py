@@ -0,0 +1,135 @@
+"""quantize.py
+
+Int8 CPU inference for the frozen nets.
+
+Linear layers are quantized dynamically (int8 weights, activations quantized on
+the fly). With --quant_static, the conv/deconv stacks of DAE_net and
+BetaVAE_*_net are quantized statically, with activation ranges calibrated on a
+sample of the dataset. SCAN_net is all Linear and always uses the dynamic path.
+
+The job compares the quantized img2sym / reconstruction paths against float32
+on a held-out sample, writes quant_report.json and saves the quantized graphs
+next to the exported bundle.
+"""
+
+import os
+import copy
+import json
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.ao.quantization import quantize_dynamic, get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+from inference import load_nets, Encoder, Img2Sym
+from utils import sample_batch, throughput
+
+
+def quantize_dynamic_net(net):
+    return quantize_dynamic(copy.deepcopy(net).eval(), {nn.Linear}, dtype=torch.qint8)
+
+
+def quantize_static_sequential(sequential, calibration, backend, batch_size=256):
+    qconfig_mapping = get_default_qconfig_mapping(backend)
+    prepared = prepare_fx(copy.deepcopy(sequential).eval(), qconfig_mapping, (calibration[:1],))
+    with torch.no_grad():
+        for chunk in calibration.split(batch_size):
+            prepared(chunk)
+    return convert_fx(prepared)
+
+
+def quantize_image_net(net, images, static=False, backend='fbgemm'):
+    """Quantize a DAE_net or BetaVAE_*_net, calibrating the static path on images."""
+    if not static:
+        return quantize_dynamic_net(net)
+    with torch.no_grad():
+        codes = net.encoder(images)[:, :net.z_dim]
+    qnet = copy.deepcopy(net).eval()
+    qnet.encoder = quantize_static_sequential(net.encoder, images, backend)
+    qnet.decoder = quantize_static_sequential(net.decoder, codes, backend)
+    return qnet
+
+
+class Reconstruction(nn.Module):
+    """image -> beta-VAE posterior mean -> beta-VAE decoder -> DAE, as SCAN's visual path"""
+
+    def __init__(self, beta_VAE_net, DAE_net=None):
+        super(Reconstruction, self).__init__()
+        self.encoder = Encoder(beta_VAE_net)
+        self.decoder = beta_VAE_net.decoder
+        self.DAE_net = DAE_net
+
+    def forward(self, x):
+        x_recon = self.decoder(self.encoder(x))
+        return x_recon if self.DAE_net is None else self.DAE_net(x_recon)
+
+
+def compare(graphs, qgraphs, x, y, batch_size):
+    report = {}
+    with torch.no_grad():
+        for name in graphs:
+            out, qout = graphs[name](x), qgraphs[name](x)
+            entry = {'output_mse': (out - qout).pow(2).mean().item(),
+                     'float32_samples_per_sec': throughput(graphs[name], x[:batch_size]),
+                     'int8_samples_per_sec': throughput(qgraphs[name], x[:batch_size])}
+            entry['speedup'] = entry['int8_samples_per_sec'] / entry['float32_samples_per_sec']
+            if name == 'img2sym':
+                entry['float32_accuracy'] = ((out > 0.5).float() == y).float().mean().item()
+                entry['int8_accuracy'] = ((qout > 0.5).float() == y).float().mean().item()
+                entry['agreement'] = ((out > 0.5) == (qout > 0.5)).float().mean().item()
+            else:
+                entry['float32_recon_mse'] = (out - x).pow(2).mean().item()
+                entry['int8_recon_mse'] = (qout - x).pow(2).mean().item()
+            report[name] = entry
+    return report
+
+
+def run(args):
+    from dataset import return_data
+
+    if args.quant_backend in torch.backends.quantized.supported_engines:
+        torch.backends.quantized.engine = args.quant_backend
+    nets = load_nets(args, ['DAE', 'beta_VAE', 'SCAN'] if args.SCAN else ['beta_VAE'])
+    require_attr = 'SCAN' in nets
+    dataset = return_data(args, require_attr).dataset
+
+    rng = np.random.RandomState(args.seed)
+    indices = rng.choice(len(dataset), args.quant_calib_samples + args.quant_samples, replace=False)
+    calibration = sample_batch(dataset, indices[:args.quant_calib_samples], args.num_workers)
+    evaluation = sample_batch(dataset, indices[args.quant_calib_samples:], args.num_workers)
+    if require_attr:
+        calibration, (x, y) = calibration[0], evaluation[:2]
+        y = y.float()
+    else:
+        x, y = evaluation, None
+
+    qnets = {}
+    for phase, net in nets.items():
+        if phase == 'SCAN':
+            qnets[phase] = quantize_dynamic_net(net)
+        else:
+            qnets[phase] = quantize_image_net(net, calibration, args.quant_static, args.quant_backend)
+
+    def graphs_of(nets):
+        graphs = {'reconstruction': Reconstruction(nets['beta_VAE'], nets.get('DAE')).eval()}
+        if 'SCAN' in nets:
+            graphs['img2sym'] = Img2Sym(nets['beta_VAE'], nets['SCAN']).eval()
+        return graphs
+
+    graphs, qgraphs = graphs_of(nets), graphs_of(qnets)
+    report = {'static': args.quant_static, 'backend': torch.backends.quantized.engine,
+              'calibration_samples': args.quant_calib_samples, 'eval_samples': args.quant_samples,
+              'graphs': compare(graphs, qgraphs, x, y, args.batch_size)}
+
+    export_dir = os.path.join(args.root_dir, args.export_dir)
+    os.makedirs(export_dir, exist_ok=True)
+    with torch.no_grad():
+        for name, qgraph in qgraphs.items():
+            torch.jit.trace(qgraph, x[:1]).save(os.path.join(export_dir, 'quantized_{}.pt'.format(name)))
+    with open(os.path.join(export_dir, 'quant_report.json'), 'w') as f:
+        json.dump(report, f, indent=2)
+
+    for name, entry in report['graphs'].items():
+        print('[{}] '.format(name) + ' '.join('{}:{:.4f}'.format(key, value) for key, value in entry.items()))
+    return report
@@ -0,0 +1,282 @@
+"""scheduler.py
+
+Runs a sweep of main.py trainings on one node without oversubscribing it.
+
+    python scheduler.py sweep.json --cores_per_run 8 --gpus 0,1
+
+Every run gets its own set of cores: its process is pinned to them, and its
+torch threads and loader workers are sized to fit. Runs start as soon as their
+dependencies have finished and enough cores are free; smaller runs backfill
+cores that a larger queued run cannot use yet. At the end, a table of the
+throughput of every run is printed and saved to <log_dir>/summary.json.
+
+A sweep spec is a JSON file:
+
+    {"common": {"--dataset": "celeba", "--vis_on": false},
+     "runs": [
+        {"name": "DAE", "phase": "DAE", "args": {"--lr": 1e-3, "--batch_size": 100, "--max_iter": 2e5}},
+        {"name": "bvae", "phase": "beta_VAE", "after": ["DAE"], "cores": 16,
+         "args": {"--max_iter": 2e6}, "sweep": {"--beta": [20, 53], "--seed": [1, 2]}},
+        {"name": "scan", "phase": "SCAN", "after": ["bvae_beta53_seed1"], "args": {"--Lambda": 30}}]}
+
+A run with a "sweep" expands into the cartesian product of its values, named
+<name>_<flag><value>_... . Each run trains under its own env name (its name,
+unless its args set --<phase>_env_name), and is given the env names of the
+runs it comes "after", so a SCAN run reads the beta-VAE and DAE it depends on.
+A name in "after" refers to a run or to all the expansions of a swept run.
+Without "after", a run depends on the runs of the spec that train the env names
+it reads (DAE and beta_VAE by default); those missing from the spec are expected
+to exist already.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+import subprocess
+
+PHASES = ['DAE', 'beta_VAE', 'SCAN']
+UPSTREAM = {'DAE': [], 'beta_VAE': ['DAE'], 'SCAN': ['beta_VAE', 'DAE']}
+
+
+def format_value(value):
+    if isinstance(value, bool):
+        return str(value)
+    elif isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class Run(object):
+    def __init__(self, name, phase, args, after=None, cores=None, explicit_after=False):
+        if phase not in PHASES:
+            raise ValueError('run {}: phase must be one of {}'.format(name, PHASES))
+        self.name = name
+        self.phase = phase
+        self.args = args
+        self.after = after or []
+        self.explicit_after = explicit_after
+        self.cores = cores
+        self.status = 'queued'
+        self.process = None
+        self.core_ids = []
+        self.gpu = None
+        self.start_time = self.end_time = None
+        self.start_iter = self.end_iter = None
+
+    def env_name(self, phase):
+        return self.args.get('--{}_env_name'.format(phase), self.name if phase == self.phase else phase)
+
+    def argv(self):
+        argv = ['--SCAN', '--phase', self.phase]
+        for flag, value in self.args.items():
+            argv += [flag, format_value(value)]
+        return argv
+
+
+def expand(spec):
+    """Return the runs of a spec, with sweeps expanded and dependencies resolved."""
+    common = spec.get('common', {})
+    runs, groups = [], {}
+    for entry in spec['runs']:
+        sweep = entry.get('sweep', {})
+        flags = list(sweep)
+        for values in itertools.product(*[sweep[flag] for flag in flags]):
+            name = '_'.join([entry['name']] + ['{}{}'.format(flag.lstrip('-'), format_value(value))
+                                               for flag, value in zip(flags, values)])
+            args = dict(common, **entry.get('args', {}))
+            args.update(zip(flags, values))
+            runs.append(Run(name, entry['phase'], args, list(entry.get('after', [])), entry.get('cores'),
+                            'after' in entry))
+            groups.setdefault(entry['name'], []).append(name)
+
+    by_name = {run.name: run for run in runs}
+    if len(by_name) != len(runs):
+        raise ValueError('run names must be unique')
+    trains = {(run.phase, run.env_name(run.phase)): run.name for run in runs}
+    for run in runs:
+        if run.explicit_after:
+            run.after = [name for group in run.after for name in groups.get(group, [group])]
+            for name in run.after:
+                if name not in by_name:
+                    raise ValueError('run {} comes after unknown run {}'.format(run.name, name))
+        else:
+            run.after = [trains[(phase, run.env_name(phase))] for phase in UPSTREAM[run.phase]
+                         if (phase, run.env_name(phase)) in trains]
+
+    runs = order(runs, by_name)
+    for run in runs:
+        # a run reads the env names its dependencies trained and read, which are final by now
+        for name in run.after:
+            upstream = by_name[name]
+            for phase in [upstream.phase] + UPSTREAM[upstream.phase]:
+                run.args.setdefault('--{}_env_name'.format(phase), upstream.env_name(phase))
+        run.args.setdefault('--{}_env_name'.format(run.phase), run.name)
+    return runs
+
+
+def order(runs, by_name):
+    """Topological order, keeping the spec order among independent runs."""
+    ordered, done, visiting = [], set(), set()
+    def visit(run):
+        if run.name in done:
+            return
+        if run.name in visiting:
+            raise ValueError('dependency cycle through run {}'.format(run.name))
+        visiting.add(run.name)
+        for name in run.after:
+            visit(by_name[name])
+        visiting.discard(run.name)
+        done.add(run.name)
+        ordered.append(run)
+    for run in runs:
+        visit(run)
+    return ordered
+
+
+def checkpoint_iter(run):
+    """Iteration of the run's checkpoint, 0 if it has none."""
+    from main import parser
+    from inference import checkpoint_path
+    from utils import load_state
+    args = parser.parse_args(run.argv())
+    file_path = checkpoint_path(args, run.phase)
+    if not os.path.isfile(file_path):
+        return 0
+    return load_state(file_path)['iter']
+
+
+class Scheduler(object):
+    def __init__(self, runs, core_ids, cores_per_run, log_dir, gpus=(), runs_per_gpu=1, poll=1.):
+        self.runs = runs
+        self.free_cores = sorted(core_ids)
+        self.cores_per_run = cores_per_run
+        self.log_dir = log_dir
+        self.gpu_slots = {gpu: runs_per_gpu for gpu in gpus}
+        self.poll = poll
+        for run in runs:
+            run.cores = min(run.cores or cores_per_run, len(core_ids))
+
+    def ready(self, run):
+        status = [self.by_name[name].status for name in run.after]
+        if any(s in ['failed', 'skipped'] for s in status):
+            run.status = 'skipped'
+            return False
+        return all(s == 'done' for s in status)
+
+    def launch(self, run):
+        run.core_ids, self.free_cores = self.free_cores[:run.cores], self.free_cores[run.cores:]
+        # loader workers decode while the main process trains; both share the run's cores
+        workers = run.args.get('--num_workers', max(1, run.cores // 2))
+        threads = run.args.get('--num_threads', max(1, run.cores - int(workers)))
+        run.args['--num_workers'], run.args['--num_threads'] = workers, threads
+
+        env = dict(os.environ, OMP_NUM_THREADS=str(threads), MKL_NUM_THREADS=str(threads))
+        if self.gpu_slots:
+            run.gpu = max(self.gpu_slots, key=self.gpu_slots.get)
+            self.gpu_slots[run.gpu] -= 1
+            env['CUDA_VISIBLE_DEVICES'] = str(run.gpu)
+        else:
+            run.args.setdefault('--cuda', False)
+
+        run.start_iter = checkpoint_iter(run)
+        command = [sys.executable, 'main.py'] + run.argv()
+        log = open(os.path.join(self.log_dir, run.name + '.log'), 'w')
+        log.write(' '.join(command) + '\n')
+        log.flush()
+        core_ids = run.core_ids
+        run.process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT, env=env,
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       preexec_fn=lambda: os.sched_setaffinity(0, core_ids))
+        log.close()
+        run.status = 'running'
+        run.start_time = time.time()
+        print('[Scheduler] started {} on cores {}-{} ({} threads, {} workers{})'.format(
+            run.name, core_ids[0], core_ids[-1], threads, workers,
+            '' if run.gpu is None else ', gpu {}'.format(run.gpu)))
+
+    def finish(self, run, returncode):
+        run.end_time = time.time()
+        run.status = 'done' if returncode == 0 else 'failed'
+        run.end_iter = checkpoint_iter(run)
+        self.free_cores = sorted(self.free_cores + run.core_ids)
+        if run.gpu is not None:
+            self.gpu_slots[run.gpu] += 1
+        print('[Scheduler] {} {} after {:.0f}s (exit {})'.format(
+            run.name, run.status, run.end_time - run.start_time, returncode))
+
+    def run(self):
+        self.by_name = {run.name: run for run in self.runs}
+        os.makedirs(self.log_dir, exist_ok=True)
+        try:
+            while True:
+                for run in self.runs:
+                    if run.status == 'running' and run.process.poll() is not None:
+                        self.finish(run, run.process.returncode)
+                # in dependency order; a run that does not fit lets the next ones backfill
+                for run in self.runs:
+                    if run.status != 'queued' or not self.ready(run):
+                        continue
+                    if run.cores <= len(self.free_cores) and (not self.gpu_slots or max(self.gpu_slots.values()) > 0):
+                        self.launch(run)
+                if not any(run.status in ['queued', 'running'] for run in self.runs):
+                    break
+                time.sleep(self.poll)
+        except KeyboardInterrupt:
+            for run in self.runs:
+                if run.status == 'running':
+                    run.process.terminate()
+            raise
+        return self.summary()
+
+    def summary(self):
+        rows = []
+        for run in self.runs:
+            row = {'name': run.name, 'phase': run.phase, 'status': run.status, 'cores': run.cores}
+            if run.end_time is not None:
+                elapsed = run.end_time - run.start_time
+                iters = run.end_iter - run.start_iter
+                batch_size = int(run.args.get('--batch_size', 64))
+                row.update({'wall_sec': elapsed, 'iters': iters, 'iters_per_sec': iters / elapsed,
+                            'samples_per_sec': iters * batch_size / elapsed})
+            rows.append(row)
+
+        print('{:<32} {:<9} {:<8} {:>5} {:>9} {:>9} {:>8} {:>10}'.format(
+            'run', 'phase', 'status', 'cores', 'wall (s)', 'iters', 'iters/s', 'samples/s'))
+        for row in rows:
+            if 'wall_sec' in row:
+                print('{name:<32} {phase:<9} {status:<8} {cores:>5} {wall_sec:>9.0f} {iters:>9} '
+                      '{iters_per_sec:>8.2f} {samples_per_sec:>10.1f}'.format(**row))
+            else:
+                print('{name:<32} {phase:<9} {status:<8} {cores:>5}'.format(**row))
+        with open(os.path.join(self.log_dir, 'summary.json'), 'w') as f:
+            json.dump(rows, f, indent=2)
+        return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('spec', type=str, help='sweep spec (JSON)')
+    parser.add_argument('--cores', default=0, type=int, help='number of cores to use, 0 for every core this process may run on')
+    parser.add_argument('--cores_per_run', default=8, type=int, help='cores of a run that does not set its own')
+    parser.add_argument('--gpus', default='', type=str, help='comma separated GPU ids; runs are CPU-only without')
+    parser.add_argument('--runs_per_gpu', default=1, type=int, help='number of runs sharing a GPU')
+    parser.add_argument('--log_dir', default='runs', type=str, help='directory of the run logs and summary')
+    parser.add_argument('--dry_run', action='store_true', help='print the expanded runs and exit')
+    args = parser.parse_args()
+
+    with open(args.spec) as f:
+        runs = expand(json.load(f))
+    if args.dry_run:
+        for run in runs:
+            print('{} (after {}): main.py {}'.format(run.name, ', '.join(run.after) or '-', ' '.join(run.argv())))
+        sys.exit(0)
+
+    core_ids = sorted(os.sched_getaffinity(0))
+    if args.cores > 0:
+        core_ids = core_ids[:args.cores]
+    gpus = [gpu for gpu in args.gpus.split(',') if gpu]
+    rows = Scheduler(runs, core_ids, args.cores_per_run, args.log_dir, gpus, args.runs_per_gpu).run()
+    sys.exit(0 if all(row['status'] == 'done' for row in rows) else 1)
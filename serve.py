@@ -0,0 +1,233 @@
+"""serve.py
+
+Multi-process CPU serving of the frozen nets from a single shared copy of the weights.
+
+The parent loads the DAE, beta-VAE and SCAN nets once into two slots in shared
+memory and forks the workers, which use them read-only through the serving
+graphs of inference.py. A hot-swap loads the new checkpoint into the idle slot
+in place, once the requests still reading that slot are done, and then flips
+the active slot index. Workers pick the active slot per request, so a swap needs
+no restart, and its cost does not depend on the number of workers. With
+watch_sec, the pool hot-swaps by itself whenever training rewrites the served
+checkpoint.
+
+CPU only: CUDA contexts do not survive a fork.
+"""
+
+import os
+import copy
+import time
+import threading
+
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+
+from inference import PHASES, checkpoint_path, load_net, serving_graphs
+from memory import rss_mb, private_mb
+
+
+class SharedWeights(object):
+    """Two slots of the frozen nets in shared memory; requests read the active one."""
+
+    def __init__(self, args, ckpt_name=None, context=None):
+        context = context or mp.get_context('fork')
+        self.args = args
+        self.phases = PHASES if args.SCAN else ['beta_VAE']
+        nets = {phase: load_net(args, phase, ckpt_name) for phase in self.phases}
+        self.slots = [nets, copy.deepcopy(nets)]
+        for slot in self.slots:
+            for net in slot.values():
+                net.share_memory()
+        self.graphs = [serving_graphs(slot) for slot in self.slots]
+        self.ckpt_name = ckpt_name
+        self.mtimes = self.checkpoint_mtimes(ckpt_name)
+
+        self.lock = context.Lock()
+        self.active = context.Value('i', 0, lock=False)
+        self.readers = context.Array('i', 2, lock=False)
+        self.versions = context.Array('i', 2, lock=False)
+
+    def checkpoint_mtimes(self, ckpt_name=None):
+        return [os.path.getmtime(checkpoint_path(self.args, phase, ckpt_name)) for phase in self.phases]
+
+    def acquire(self):
+        with self.lock:
+            slot = self.active.value
+            self.readers[slot] += 1
+        return slot
+
+    def release(self, slot):
+        with self.lock:
+            self.readers[slot] -= 1
+
+    def swap(self, ckpt_name=None):
+        """Load a checkpoint into the idle slot and make it active; returns the seconds taken."""
+        start = time.time()
+        nets = {phase: load_net(self.args, phase, ckpt_name) for phase in self.phases}
+        active = self.active.value
+        idle = 1 - active
+        # only requests that started before the previous swap can still read the idle slot
+        while self.readers[idle] > 0:
+            time.sleep(1e-3)
+        with torch.no_grad():
+            for phase, net in self.slots[idle].items():
+                states = nets[phase].state_dict()
+                for name, tensor in net.state_dict().items():
+                    if tensor.shape != states[name].shape:
+                        raise ValueError('{} {} changed shape from {} to {}, a hot-swap cannot resize it'.format(
+                            phase, name, tuple(tensor.shape), tuple(states[name].shape)))
+                    tensor.copy_(states[name])
+        with self.lock:
+            self.versions[idle] = self.versions[active] + 1
+            self.active.value = idle
+        self.ckpt_name = ckpt_name
+        self.mtimes = self.checkpoint_mtimes(ckpt_name)
+        return time.time() - start
+
+    def poll(self):
+        """Swap when the files of the served checkpoint changed since it was loaded; returns the swap time or None."""
+        if self.checkpoint_mtimes(self.ckpt_name) == self.mtimes:
+            return None
+        return self.swap(self.ckpt_name)
+
+
+def _worker(weights, tasks, results, num_threads):
+    torch.set_num_threads(num_threads)
+    with torch.no_grad():
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            request_id, name, x = task
+            slot = weights.acquire()
+            # read while the slot is held: a swap may overwrite it once released
+            version = weights.versions[slot]
+            try:
+                output, error = weights.graphs[slot][name](x), None
+            except Exception as e:
+                output, error = None, repr(e)
+            finally:
+                weights.release(slot)
+            results.put((request_id, output, version, error))
+
+
+class ServingPool(object):
+    """Forked workers answering (graph name, input batch) requests from SharedWeights."""
+
+    def __init__(self, args, n_workers, num_threads=1, ckpt_name=None, watch_sec=0.):
+        context = mp.get_context('fork')
+        self.weights = SharedWeights(args, ckpt_name, context)
+        self.tasks = context.Queue()
+        self.results = context.Queue()
+        self.workers = [context.Process(target=_worker, args=(self.weights, self.tasks, self.results, num_threads),
+                                        daemon=True) for _ in range(n_workers)]
+        for worker in self.workers:
+            worker.start()
+        self.n_submitted = 0
+        self.swap_lock = threading.Lock()
+        self.swaps = []
+        # started after the fork: the workers get no copy of the thread
+        self.closed = threading.Event()
+        self.watcher = None
+        if watch_sec > 0:
+            self.watcher = threading.Thread(target=self.watch, args=(watch_sec,), daemon=True)
+            self.watcher.start()
+
+    def watch(self, watch_sec):
+        """Hot-swap whenever training rewrites the served checkpoint."""
+        while not self.closed.wait(watch_sec):
+            try:
+                self.poll()
+            except (IOError, OSError, EOFError, RuntimeError) as e:
+                # a phase's checkpoint may be missing for a moment, or mid-way through being rewritten
+                print('[Serve] hot-swap skipped: {}'.format(e))
+
+    def poll(self):
+        with self.swap_lock:
+            swap_sec = self.weights.poll()
+            if swap_sec is not None:
+                self.swaps.append(swap_sec)
+        return swap_sec
+
+    @property
+    def graph_names(self):
+        return list(self.weights.graphs[0].keys())
+
+    def submit(self, name, x):
+        if name not in self.weights.graphs[0]:
+            raise KeyError('no serving graph {}, available: {}'.format(name, self.graph_names))
+        request_id = self.n_submitted
+        self.n_submitted += 1
+        self.tasks.put((request_id, name, x))
+        return request_id
+
+    def result(self, timeout=None):
+        """Return (request_id, output, weights version) of the next finished request."""
+        request_id, output, version, error = self.results.get(timeout=timeout)
+        if error is not None:
+            raise RuntimeError('request {} failed: {}'.format(request_id, error))
+        return request_id, output, version
+
+    def swap(self, ckpt_name=None):
+        with self.swap_lock:
+            swap_sec = self.weights.swap(ckpt_name)
+            self.swaps.append(swap_sec)
+        return swap_sec
+
+    def memory(self):
+        return {'parent_rss_mb': rss_mb(),
+                'worker_rss_mb': [rss_mb(worker.pid) for worker in self.workers],
+                'worker_private_mb': [private_mb(worker.pid) for worker in self.workers]}
+
+    def close(self):
+        self.closed.set()
+        if self.watcher is not None:
+            self.watcher.join()
+        for _ in self.workers:
+            self.tasks.put(None)
+        for worker in self.workers:
+            worker.join()
+
+
+def run(args):
+    """Serve random requests, hot-swapping to --serve_swap_ckpt halfway, and report latency and memory."""
+    pool = ServingPool(args, args.serve_workers, args.serve_threads, watch_sec=args.serve_watch)
+    try:
+        nc = pool.weights.slots[0]['beta_VAE'].nc
+        names = [name for name in ['img2sym', 'sym2img'] if name in pool.graph_names] or ['beta_VAE_encoder']
+        inputs = {'img2sym': torch.rand(args.serve_batch_size, nc, 64, 64),
+                  'beta_VAE_encoder': torch.rand(args.serve_batch_size, nc, 64, 64),
+                  'sym2img': torch.bernoulli(torch.rand(args.serve_batch_size, 40))}
+
+        start = time.time()
+        submitted = {}
+        for i in range(args.serve_requests):
+            name = names[i % len(names)]
+            submitted[pool.submit(name, inputs[name])] = time.time()
+        swap_sec = pool.swap(args.serve_swap_ckpt)
+
+        latencies, versions = [], []
+        for _ in range(args.serve_requests):
+            request_id, _, version = pool.result()
+            latencies.append(time.time() - submitted[request_id])
+            versions.append(version)
+        elapsed = time.time() - start
+        memory = pool.memory()
+    finally:
+        pool.close()
+
+    latencies = np.asarray(latencies) * 1e3
+    report = {'workers': args.serve_workers, 'requests': args.serve_requests,
+              'requests_per_sec': args.serve_requests / elapsed,
+              'p50_ms': float(np.percentile(latencies, 50)), 'p99_ms': float(np.percentile(latencies, 99)),
+              'swap_sec': swap_sec, 'served_after_swap': int(np.sum(np.asarray(versions) > 0)),
+              'n_swaps': len(pool.swaps)}
+    report.update(memory)
+    print('[Serve] {} workers: {:.1f} requests/s, p50 {:.1f} ms, p99 {:.1f} ms, swap {:.3f}s '
+          '({} requests served by the new weights)'.format(
+              report['workers'], report['requests_per_sec'], report['p50_ms'], report['p99_ms'],
+              report['swap_sec'], report['served_after_swap']))
+    print('[Serve] parent rss {:.0f} MB, worker private {} MB'.format(
+        report['parent_rss_mb'], ', '.join('{:.0f}'.format(mb) for mb in report['worker_private_mb'])))
+    return report
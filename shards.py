@@ -0,0 +1,156 @@
+"""shards.py
+
+Sharded storage for image datasets.
+
+A packed dataset is a directory of large shard files holding the encoded images
+back to back, plus an index:
+    shard-00000.bin, shard-00001.bin, ...
+    index.npz     shard, offset and length of every image, and CelebA attributes if any
+    index.json    number of images and shards, attribute names
+
+ShardedImageDataset streams it with large sequential reads: each worker reads
+whole shards, in an order shuffled per epoch, and mixes their images through a
+shuffle buffer. Shards are split across distributed ranks (RANK, WORLD_SIZE)
+and then across loader workers.
+"""
+
+import os
+import io
+import json
+
+import numpy as np
+from torch.utils.data import IterableDataset, get_worker_info
+
+from dataset import CustomImageFolder, CustomMixDataset, open_image
+
+
+FOLDERS = {'celeba': 'CelebA', '3dchairs': '3DChairs'}
+
+
+def shard_root(name, dset_dir):
+    return os.path.join(dset_dir, FOLDERS[name.lower()] + '_shards')
+
+
+def pack_shards(paths, out_dir, shard_bytes=256 * 2**20, attrs=None, keys=None):
+    """Pack image files into shards of about shard_bytes, keeping their order."""
+    os.makedirs(out_dir, exist_ok=True)
+    shard = np.zeros(len(paths), dtype=np.int32)
+    offset = np.zeros(len(paths), dtype=np.int64)
+    length = np.zeros(len(paths), dtype=np.int64)
+
+    n_shards = 0
+    f = None
+    for i, path in enumerate(paths):
+        if f is None or f.tell() >= shard_bytes:
+            if f is not None:
+                f.close()
+            f = open(os.path.join(out_dir, 'shard-{:05d}.bin'.format(n_shards)), 'wb')
+            n_shards += 1
+        with open(path, 'rb') as image_file:
+            data = image_file.read()
+        shard[i], offset[i], length[i] = n_shards - 1, f.tell(), len(data)
+        f.write(data)
+    if f is not None:
+        f.close()
+
+    index = {'shard': shard, 'offset': offset, 'length': length}
+    if attrs is not None:
+        index['attrs'] = np.asarray(attrs, dtype=np.float32)
+    np.savez(os.path.join(out_dir, 'index.npz'), **index)
+    with open(os.path.join(out_dir, 'index.json'), 'w') as f:
+        json.dump({'n': len(paths), 'n_shards': n_shards, 'keys': keys}, f)
+    return n_shards
+
+
+class ShardedImageDataset(IterableDataset):
+    def __init__(self, root, transform=None, require_attr=False, buffer_size=2000, seed=0, draft_size=None):
+        self.root = root
+        self.transform = transform
+        self.buffer_size = buffer_size
+        self.seed = seed
+        self.draft_size = draft_size
+        self.epoch = 0
+        self.rank = int(os.environ.get('RANK', 0))
+        self.world_size = int(os.environ.get('WORLD_SIZE', 1))
+
+        with open(os.path.join(root, 'index.json')) as f:
+            meta = json.load(f)
+        index = np.load(os.path.join(root, 'index.npz'))
+        self.len = meta['n']
+        self.n_shards = meta['n_shards']
+        self.keys = meta['keys']
+        self.shard = index['shard']
+        self.offset = index['offset']
+        self.length = index['length']
+        self.attr_tensor = index['attrs'] if require_attr else None
+        # images of every shard, in file order
+        order = np.lexsort((self.offset, self.shard))
+        self.shard_members = np.split(order, np.cumsum(np.bincount(self.shard, minlength=self.n_shards))[:-1])
+
+    def __len__(self):
+        return self.len // self.world_size
+
+    def set_epoch(self, epoch):
+        """Reseed the shard order. Call with the same value on every rank."""
+        self.epoch = epoch
+
+    def shard_path(self, shard):
+        return os.path.join(self.root, 'shard-{:05d}.bin'.format(shard))
+
+    def item(self, index, data):
+        img = open_image(io.BytesIO(data), self.draft_size)
+        if self.transform is not None:
+            img = self.transform(img)
+        if self.attr_tensor is None:
+            return img
+        return [img, self.attr_tensor[index], self.keys]
+
+    def __getitem__(self, index):
+        with open(self.shard_path(self.shard[index]), 'rb') as f:
+            f.seek(self.offset[index])
+            return self.item(index, f.read(self.length[index]))
+
+    def assigned_shards(self):
+        worker = get_worker_info()
+        worker_id, num_workers = (0, 1) if worker is None else (worker.id, worker.num_workers)
+        shards = np.random.RandomState([self.seed, self.epoch]).permutation(self.n_shards)
+        return shards[self.rank::self.world_size][worker_id::num_workers], worker_id
+
+    def __iter__(self):
+        shards, worker_id = self.assigned_shards()
+        rng = np.random.RandomState([self.seed, self.epoch, self.rank, worker_id])
+        # without set_epoch, successive epochs in the main process still differ
+        self.epoch += 1
+
+        buffer = []
+        for shard in shards:
+            with open(self.shard_path(shard), 'rb') as f:
+                data = f.read()
+            for index in self.shard_members[shard]:
+                item = self.item(index, data[self.offset[index]:self.offset[index] + self.length[index]])
+                if len(buffer) < self.buffer_size:
+                    buffer.append(item)
+                    continue
+                i = rng.randint(len(buffer))
+                buffer[i], item = item, buffer[i]
+                yield item
+        rng.shuffle(buffer)
+        for item in buffer:
+            yield item
+
+
+def run(args):
+    """Pack the image folder of args.dataset into args.dset_dir/<name>_shards."""
+    root = os.path.join(args.dset_dir, FOLDERS[args.dataset.lower()])
+    out_dir = shard_root(args.dataset, args.dset_dir)
+    attrs, keys = None, None
+    if args.dataset.lower() == 'celeba' and os.path.isfile(os.path.join(root, 'Anno/list_attr_celeba.txt')):
+        # attributes are paired with images by position, as in CustomMixDataset
+        mix = CustomMixDataset(root)
+        image_folder, attrs, keys = mix.image_folder, mix.attr_tensor, mix.keys
+    else:
+        image_folder = CustomImageFolder(root)
+    paths = [path for path, _ in image_folder.imgs]
+
+    n_shards = pack_shards(paths, out_dir, args.shard_size_mb * 2**20, attrs, keys)
+    print("=> packed {} images into {} shards at '{}'".format(len(paths), n_shards, out_dir))
@@ -4,28 +4,30 @@ import warnings
 warnings.filterwarnings("ignore")
 
 import os
+import json
 from abc import ABC, abstractmethod
-from tqdm import tqdm
-import visdom
 import random
-from PIL import Image, ImageDraw
 import math
 import numpy as np
 
 import torch
 import torch.optim as optim
-from torchvision.utils import make_grid, save_image
-from torchvision import transforms
 
-from utils import cuda, grid2gif
-from model import BetaVAE_H_net, BetaVAE_B_net, DAE_net, SCAN_net
-from dataset import return_data
+from utils import cuda, grid2gif, load_state
+from model import BetaVAE_H_net, BetaVAE_B_net, DAE_net, SCAN_net, GroupedAutoEncoder
+from profiling import StageTimer, TraceWindow
+from memory import MemoryMonitor
+from convergence import ConvergenceController
 
 #---------------------------------TEMPLATES-------------------------------------#
 class Solver(ABC):
     def __init__(self, args, require_attr=False, nc=None):
         self.global_iter = 0
         self.args = args
+        self.timer = StageTimer(args.profile, args.profile_window, args.cuda)
+        self.convergence = ConvergenceController(args.early_stop, args.plateau_metric, args.ema_decay,
+                                                 args.plateau_check_step, args.plateau_patience,
+                                                 args.plateau_min_delta, args.lr_decay_factor, args.max_lr_decays)
 
         if nc is None:
             if args.dataset.lower() == 'dsprites':
@@ -49,15 +51,40 @@ class Solver(ABC):
             os.makedirs(self.ckpt_dir, exist_ok=True)
         if not os.path.exists(self.output_dir):
             os.makedirs(self.output_dir, exist_ok=True)
+        self.memory = MemoryMonitor(args.mem_monitor, args.mem_step, args.mem_window, args.mem_growth_mb,
+                                    args.mem_budget_mb, self.env_name,
+                                    os.path.join(self.output_dir, 'memory.jsonl'), args.cuda)
         if self.args.vis_on:
+            import visdom
             self.vis = visdom.Visdom(port=self.args.vis_port)
         self.gather = DataGather()
-        self.net = cuda(self.model(self.z_dim, self.nc), self.args.cuda)
+        self.ckpt_stores = {}
+        self.net = cuda(self.build_net(), self.args.cuda)
         self.optim = optim.Adam(self.net.parameters(), lr=self.args.lr,
                                betas=(self.args.beta1, self.args.beta2), eps=self.args.epsilon)
         self.load_checkpoint(self.args.ckpt_name)
-        self.data_loader = return_data(self.args, require_attr)
-
+        self.require_attr = require_attr
+        self.latents = None
+        self._data_loader = None
+
+    @property
+    def data_loader(self):
+        # built on first use: frozen sub-solvers and inference never touch the dataset
+        if self._data_loader is None:
+            from dataset import return_data
+            self._data_loader = return_data(self.args, self.require_attr, with_index=self.latents is not None)
+        return self._data_loader
+    @data_loader.setter
+    def data_loader(self, data_loader):
+        self._data_loader = data_loader
+    @property
+    def dataset(self):
+        # batches carry dataset indices when latents are cached; this is the dataset they index
+        dataset = self.data_loader.dataset
+        return dataset.dataset if self.latents is not None else dataset
+
+    def build_net(self):
+        return self.model(self.z_dim, self.nc)
     def prepare_training(self):
         pass
     @abstractmethod
@@ -74,37 +101,81 @@ class Solver(ABC):
         self.net_mode(train=True)
         self.prepare_training()
 
+        trace = TraceWindow(self.args.trace_start, self.args.trace_iters, self.output_dir, self.args.cuda)
+
+        from tqdm import tqdm
         self.pbar = tqdm(total=self.args.max_iter)
         self.pbar.update(self.global_iter)
-        while self.global_iter < self.args.max_iter:
-            for x in self.data_loader:
+        self.timer.step_begin()
+        while self.global_iter < self.args.max_iter and not self.convergence.stopped:
+            if hasattr(self.dataset, 'set_epoch'):
+                self.dataset.set_epoch(self.global_iter)
+            for x in self.timer.iterate(self.data_loader):
                 self.global_iter += 1
                 self.pbar.update(1)
+                self.write(trace.step(self.global_iter, self.timer))
 
-                loss = self.training_process(x)
-                self.optim.zero_grad()
-                loss.backward()
-                self.optim.step()
+                self.train_step(x)
+                self.write(self.memory(self.global_iter, self.memory_owners()))
 
                 if self.global_iter%self.args.display_save_step == 0:
+                    with self.timer('ckpt'):
+                        self.save_checkpoint(self.get_win_states(), str(self.global_iter))
+                        self.save_checkpoint(self.get_win_states(), 'last')
+                    self.pbar.write('Saved checkpoint(iter:{})'.format(self.global_iter))
+                    self.write(self.timer.format())
+                    self.write(self.memory.summary())
+                    if self.latents is not None:
+                        self.write(self.latents.reload())
+                self.timer.step_end(self.args.batch_size)
+
+                self.write(self.convergence.check(self.global_iter, self.optim))
+                if self.convergence.stopped:
                     self.save_checkpoint(self.get_win_states(), str(self.global_iter))
                     self.save_checkpoint(self.get_win_states(), 'last')
-                    self.pbar.write('Saved checkpoint(iter:{})'.format(self.global_iter))
+                    with open(os.path.join(self.output_dir, 'stop_reason.json'), 'w') as f:
+                        json.dump(self.convergence.stop_reason, f, indent=2)
+                    self.pbar.write('Saved final checkpoint(iter:{})'.format(self.global_iter))
+                    break
 
+        self.write(trace.close(self.timer))
         self.pbar.write("[Training Finished]")
         self.pbar.close()
 
+    def train_step(self, x):
+        with self.timer('forward'):
+            loss = self.training_process(x)
+        with self.timer('backward'):
+            self.optim.zero_grad()
+            loss.backward()
+        with self.timer('optim'):
+            self.optim.step()
+        return loss
+
+    def write(self, message):
+        if message:
+            self.pbar.write(message)
+
+    def memory_owners(self):
+        owners = {'net': self.net, 'optim': self.optim, 'gather': self.gather.data}
+        for name in ['DAE_net', 'beta_VAE_net']:
+            if hasattr(self, name):
+                owners[name] = getattr(self, name)
+        return owners
+
     def vis_display(self, image_set, traverse=True):
-        if self.args.vis_on:
-            for image in image_set:
-                self.gather.insert(images=image.data)
-            self.vis_reconstruction()
-            self.vis_lines()
-            self.gather.flush()
-
-        if (self.args.vis_on or self.args.save_output) and traverse:
-            self.vis_traverse()
+        with self.timer('vis'):
+            if self.args.vis_on:
+                for image in image_set:
+                    self.gather.insert(images=image.data)
+                self.vis_reconstruction()
+                self.vis_lines()
+                self.gather.flush()
+
+            if (self.args.vis_on or self.args.save_output) and traverse:
+                self.vis_traverse()
     def vis_reconstruction(self):
+        from torchvision.utils import make_grid, save_image
         self.net_mode(train=False)
         x = self.gather.data['images'][0][:100]
         x = make_grid(x, normalize=True)
@@ -137,28 +208,49 @@ class Solver(ABC):
         states = {'iter': self.global_iter,
                   'win_states': win_states,
                   'net_states': self.net.state_dict(),
-                  'optim_states': self.optim.state_dict(),}
+                  'optim_states': self.optim.state_dict(),
+                  'convergence': self.convergence.state_dict(),}
 
         file_path = os.path.join(self.ckpt_dir, filename)
-        with open(file_path, mode='wb+') as f:
-            torch.save(states, f)
+        self.write_checkpoint(states, file_path)
         if not silent:
             print("=> saved checkpoint '{}' (iter {})".format(file_path, self.global_iter))
+    def write_checkpoint(self, states, file_path):
+        if self.args.ckpt_format == 'delta':
+            from ckpt_store import CheckpointStore
+            ckpt_dir = os.path.dirname(file_path)
+            if ckpt_dir not in self.ckpt_stores:
+                self.ckpt_stores[ckpt_dir] = CheckpointStore(ckpt_dir, self.args.ckpt_full_every)
+            self.ckpt_stores[ckpt_dir].save(states, file_path)
+        elif self.args.ckpt_format == 'torch':
+            # replaced, not truncated, so that readers of the previous version are unaffected
+            tmp_path = '{}.tmp{}'.format(file_path, os.getpid())
+            with open(tmp_path, mode='wb+') as f:
+                torch.save(states, f)
+            os.replace(tmp_path, file_path)
+        else:
+            raise NotImplementedError('only support ckpt_format torch or delta')
     def load_checkpoint(self, filename):
         file_path = os.path.join(self.ckpt_dir, filename)
         if os.path.isfile(file_path):
-            checkpoint = torch.load(file_path)
+            map_location = 'cuda' if self.args.cuda else 'cpu'
+            # not memory-mapped: the optimizer keeps the loaded tensors as its state, and they must
+            # survive the next write of this checkpoint
+            checkpoint = load_state(file_path, map_location)
             self.global_iter = checkpoint['iter']
             self.load_win_states(checkpoint['win_states'])
             self.net.load_state_dict(checkpoint['net_states'])
             self.optim.load_state_dict(checkpoint['optim_states'])
+            if 'convergence' in checkpoint:
+                self.convergence.load_state_dict(checkpoint['convergence'])
             print("=> loaded checkpoint '{} (iter {})'".format(file_path, self.global_iter))
         else:
             print("=> no checkpoint found at '{}'".format(file_path))
-            keys = ['lines', 'reconstruction', 'traversal', 'img2sym', 'sym2img']
-            for key in keys:
-                env_name = self.env_name + '_' + key
-                self.vis.delete_env(env_name)
+            if self.args.vis_on:
+                keys = ['lines', 'reconstruction', 'traversal', 'img2sym', 'sym2img']
+                for key in keys:
+                    env_name = self.env_name + '_' + key
+                    self.vis.delete_env(env_name)
     def tensor(self, tensor, requires_grad=True):
         return cuda(torch.tensor(tensor, dtype=torch.float32, requires_grad=requires_grad), self.args.cuda)
 
@@ -194,6 +286,7 @@ class super_beta_VAE(Solver):
         elif self.args.objective == 'B':
             C = torch.clamp(self.args.C_max/self.args.C_stop_iter*self.global_iter, 0, self.args.C_max.data[0])
             loss = recon_loss + self.args.gamma * (kld - C).abs()
+        self.convergence.update(loss=loss, recon=recon_loss, kld=kld)
 
         if self.args.vis_on and self.global_iter % self.args.gather_step == 0:
             self.gather.insert(iter=self.global_iter,
@@ -202,9 +295,28 @@ class super_beta_VAE(Solver):
 
         if self.global_iter % self.args.display_save_step == 0:
             self.vis_display([x, self.visual(x_recon)])
+            if self.args.eval_metrics:
+                self.eval_metrics()
 
         return loss
 
+    def eval_metrics(self):
+        from tqdm import tqdm
+        from metrics import compute_metrics
+        self.net_mode(train=False)
+        with self.timer('eval'):
+            scores = compute_metrics(self.net, self.dataset, self.z_dim, self.args.cuda,
+                                     self.args.metric_batch_size, self.args.seed)
+        self.net_mode(train=True)
+
+        tqdm.write('[{}] '.format(self.global_iter) + ' '.join(
+            '{}:{:.3f}'.format(key, value) for key, value in scores.items() if not isinstance(value, list)))
+        output_dir = os.path.join(self.output_dir, str(self.global_iter))
+        os.makedirs(output_dir, exist_ok=True)
+        with open(os.path.join(output_dir, 'metrics.json'), 'w') as f:
+            json.dump(scores, f, indent=2)
+        return scores
+
     def vis_lines(self):
         self.net_mode(train=False)
         def gather(name):
@@ -225,16 +337,17 @@ class super_beta_VAE(Solver):
 
         self.net_mode(train=True)
     def vis_traverse(self, limit=3, inter=2/3, loc=-1):
+        from torchvision.utils import save_image
         self.net_mode(train=False)
 
         decoder = self.net.decoder
         encoder = self.net.encoder
         interpolation = torch.arange(-limit, limit+0.1, inter)
 
-        n_dsets = len(self.data_loader.dataset)
+        n_dsets = len(self.dataset)
         rand_idx = random.randint(1, n_dsets-1)
 
-        random_img = self.data_loader.dataset.__getitem__(rand_idx)
+        random_img = self.dataset.__getitem__(rand_idx)
         random_img = self.tensor(random_img).unsqueeze(0)
         random_img_z = encoder(random_img)[:, :self.z_dim]
 
@@ -245,15 +358,15 @@ class super_beta_VAE(Solver):
             fixed_idx2 = 332800 # ellipse
             fixed_idx3 = 578560 # heart
 
-            fixed_img1 = self.data_loader.dataset.__getitem__(fixed_idx1)
+            fixed_img1 = self.dataset.__getitem__(fixed_idx1)
             fixed_img1 = self.tensor(fixed_img1).unsqueeze(0)
             fixed_img_z1 = encoder(fixed_img1)[:, :self.z_dim]
 
-            fixed_img2 = self.data_loader.dataset.__getitem__(fixed_idx2)
+            fixed_img2 = self.dataset.__getitem__(fixed_idx2)
             fixed_img2 = self.tensor(fixed_img2).unsqueeze(0)
             fixed_img_z2 = encoder(fixed_img2)[:, :self.z_dim]
 
-            fixed_img3 = self.data_loader.dataset.__getitem__(fixed_idx3)
+            fixed_img3 = self.dataset.__getitem__(fixed_idx3)
             fixed_img3 = self.tensor(fixed_img3).unsqueeze(0)
             fixed_img_z3 = encoder(fixed_img3)[:, :self.z_dim]
 
@@ -261,7 +374,7 @@ class super_beta_VAE(Solver):
                  'fixed_heart':fixed_img_z3, 'random_img':random_img_z}
         else:
             fixed_idx = 0
-            fixed_img = self.data_loader.dataset.__getitem__(fixed_idx)
+            fixed_img = self.dataset.__getitem__(fixed_idx)
             fixed_img = self.tensor(fixed_img).unsqueeze(0)
             fixed_img_z = encoder(fixed_img)[:, :self.z_dim]
 
@@ -283,8 +396,9 @@ class super_beta_VAE(Solver):
             samples = torch.cat(samples, dim=0).cpu()
             title = '{}_latent_traversal(iter:{})'.format(key, self.global_iter)
 
-            self.vis.images(samples, env=self.env_name+'_traverse',
-                            opts=dict(title=title), nrow=len(interpolation))
+            if self.args.vis_on:
+                self.vis.images(samples, env=self.env_name+'_traverse',
+                                opts=dict(title=title), nrow=len(interpolation))
 
         if self.args.save_output:
             output_dir = os.path.join(self.output_dir, str(self.global_iter))
@@ -293,8 +407,7 @@ class super_beta_VAE(Solver):
             gifs = gifs.view(len(Z), self.z_dim, len(interpolation), self.nc, 64, 64).transpose(1, 2)
             for i, key in enumerate(Z.keys()):
                 for j, val in enumerate(interpolation):
-                    save_image(tensor=gifs[i][j].cpu(),
-                               filename=os.path.join(output_dir, '{}_{}.jpg'.format(key, j)),
+                    save_image(gifs[i][j].cpu(), os.path.join(output_dir, '{}_{}.jpg'.format(key, j)),
                                nrow=self.z_dim, pad_value=1)
 
                 grid2gif(os.path.join(output_dir, key+'*.jpg'),
@@ -331,12 +444,113 @@ class beta_VAE(super_beta_VAE):
         DAE_solver = DAE(args)
         DAE_solver.net_mode(train=False)
         self.DAE_net = DAE_solver.net
+        if args.latent_cache and args.phase == 'beta_VAE':
+            from latent_store import open_store
+            self.latents = open_store(args, 'DAE', self.DAE_net)
 
+    def training_process(self, x):
+        if self.latents is not None:
+            index, x = x
+            self.x_latents = self.tensor(self.latents[index], requires_grad=False)
+        return super(beta_VAE, self).training_process(x)
     def recon_loss_function(self, x, x_recon):
-        return reconstruction_loss(self.DAE_net._encode(x), self.DAE_net._encode(x_recon), self.decoder_dist)
+        with self.timer('frozen'):
+            x_latents = self.DAE_net._encode(x) if self.latents is None else self.x_latents
+            return reconstruction_loss(x_latents, self.DAE_net._encode(x_recon), self.decoder_dist)
     def visual(self, x):
         return self.DAE_net(x)
 
+class beta_VAE_ensemble(beta_VAE):
+    """args.n_seeds beta_VAE replicas, seeded seed, seed+1, ..., trained on the same batches.
+
+    The replicas are one GroupedAutoEncoder, so the data stream and the frozen DAE
+    encoding of the inputs are shared. Adam being elementwise, the single optimizer
+    updates every replica exactly as its own optimizer would. Every replica keeps
+    its own checkpoints in <beta_VAE_env_name>_seed<seed>, loadable by the beta_VAE
+    and SCAN phases with --beta_VAE_env_name.
+    """
+    def __init__(self, args):
+        self.seeds = [args.seed + i for i in range(args.n_seeds)]
+        super(beta_VAE_ensemble, self).__init__(args)
+
+    def build_net(self):
+        replicas = []
+        for seed in self.seeds:
+            torch.manual_seed(seed)
+            replicas.append(self.model(self.z_dim, self.nc))
+        torch.manual_seed(self.args.seed)
+        return GroupedAutoEncoder(replicas)
+    def replica_ckpt_dir(self, seed):
+        ckpt_dir = os.path.join(self.args.root_dir, '{}_seed{}'.format(self.env_name, seed), self.args.ckpt_dir)
+        os.makedirs(ckpt_dir, exist_ok=True)
+        return ckpt_dir
+
+    def training_process(self, x):
+        if self.latents is not None:
+            index, x = x
+        x = self.tensor(x)
+        x_recon, mu, logvar = self.net(x)
+        with self.timer('frozen'):
+            if self.latents is not None:
+                target = self.tensor(self.latents[index], requires_grad=False)
+            else:
+                with torch.no_grad():
+                    target = self.DAE_net._encode(x)
+            encoded = self.DAE_net._encode(x_recon.reshape(-1, *x.shape[1:])).view(len(self.seeds), x.size(0), -1)
+        recon_loss = torch.stack([reconstruction_loss(target, e, self.decoder_dist) for e in encoded])
+        kld = torch.stack([kl_divergence(m, l) for m, l in zip(mu, logvar)])
+
+        if self.args.objective == 'H':
+            losses = recon_loss + self.args.beta * kld
+        elif self.args.objective == 'B':
+            C = torch.clamp(self.args.C_max/self.args.C_stop_iter*self.global_iter, 0, self.args.C_max.data[0])
+            losses = recon_loss + self.args.gamma * (kld - C).abs()
+        self.convergence.update(loss=losses.mean(), recon=recon_loss.mean(), kld=kld.mean())
+
+        if self.global_iter % self.args.display_save_step == 0:
+            for seed, l, r, k in zip(self.seeds, losses.tolist(), recon_loss.tolist(), kld.tolist()):
+                self.pbar.write('[{}] seed {} loss:{:.3f} recon_loss:{:.3f} kld:{:.3f}'.format(
+                    self.global_iter, seed, l, r, k))
+
+        return losses.sum()
+
+    def vis_traverse(self, *args, **kwargs):
+        raise NotImplementedError('traverse a single replica with --n_seeds 1 --beta_VAE_env_name {}_seed<seed>'.format(
+            self.env_name))
+
+    def save_checkpoint(self, win_states, filename, silent=True):
+        for i, seed in enumerate(self.seeds):
+            states = {'iter': self.global_iter,
+                      'win_states': win_states,
+                      'net_states': self.net.replica_state_dict(i),
+                      'optim_states': self.net.replica_optim_state(self.optim.state_dict(), i),
+                      'convergence': self.convergence.state_dict(),
+                      'seed': seed,}
+
+            file_path = os.path.join(self.replica_ckpt_dir(seed), filename)
+            self.write_checkpoint(states, file_path)
+            if not silent:
+                print("=> saved checkpoint '{}' (iter {})".format(file_path, self.global_iter))
+    def load_checkpoint(self, filename):
+        file_paths = [os.path.join(self.replica_ckpt_dir(seed), filename) for seed in self.seeds]
+        found = [os.path.isfile(file_path) for file_path in file_paths]
+        if not any(found):
+            print("=> no checkpoint found at '{}'".format(', '.join(file_paths)))
+            return
+        if not all(found):
+            missing = [file_path for file_path, exists in zip(file_paths, found) if not exists]
+            raise RuntimeError("replicas resume together, missing checkpoints '{}'".format(', '.join(missing)))
+
+        map_location = 'cuda' if self.args.cuda else 'cpu'
+        checkpoints = [load_state(file_path, map_location) for file_path in file_paths]
+        self.global_iter = checkpoints[0]['iter']
+        self.load_win_states(checkpoints[0]['win_states'])
+        self.net.load_replica_state_dicts([checkpoint['net_states'] for checkpoint in checkpoints])
+        self.optim.load_state_dict(self.net.merge_optim_states([checkpoint['optim_states'] for checkpoint in checkpoints]))
+        if 'convergence' in checkpoints[0]:
+            self.convergence.load_state_dict(checkpoints[0]['convergence'])
+        print("=> loaded checkpoints '{} (iter {})'".format(', '.join(file_paths), self.global_iter))
+
 class DAE(Solver):
     def __init__(self, args):
         self.win_recon = None
@@ -354,6 +568,7 @@ class DAE(Solver):
         x_recon = self.net(masked)
         recon_loss = reconstruction_loss(x, x_recon, self.decoder_dist)
         loss = recon_loss
+        self.convergence.update(loss=loss, recon=recon_loss)
 
         if self.args.vis_on and self.global_iter % self.args.gather_step == 0:
             self.gather.insert(iter=self.global_iter, recon_loss=recon_loss.data)
@@ -392,16 +607,28 @@ class SCAN(Solver):
         beta_VAE_solver.net_mode(train=False)
         self.beta_VAE_net = beta_VAE_solver.net
         self.DAE_net = beta_VAE_solver.DAE_net
+        if args.latent_cache:
+            from latent_store import open_store
+            self.latents = open_store(args, 'beta_VAE', self.beta_VAE_net)
 
     def training_process(self, data):
-        [x, y, keys] = data
-        x = self.tensor(x)
+        if self.latents is None:
+            [x, y, keys] = data
+            x = self.tensor(x)
+        else:
+            # the cached posteriors stand in for the images, which are only loaded to be displayed
+            [index, y, keys] = data
+            x = None
         y = self.tensor(y)
         if self.keys is None:
             self.keys = np.asarray(keys)[:, 0].tolist()
             self.n_key = len(self.keys)
         y_recon, mu_y, logvar_y = self.net(y)
-        z_x = self.beta_VAE_net._encode(x)
+        if x is None:
+            z_x = self.tensor(self.latents[index], requires_grad=False)
+        else:
+            with self.timer('frozen'):
+                z_x = self.beta_VAE_net._encode(x)
         mu_x = z_x[:, :self.args.beta_VAE_z_dim]
         logvar_x = z_x[:, self.args.beta_VAE_z_dim:]
 
@@ -410,6 +637,7 @@ class SCAN(Solver):
         relv = dual_kl_divergence(mu_x, logvar_x, mu_y, logvar_y)
 
         loss = recon_loss + self.args.beta * kld + self.args.Lambda * relv
+        self.convergence.update(loss=loss, recon=recon_loss, kld=kld, relv=relv)
 
         if self.args.vis_on and self.global_iter % self.args.gather_step == 0:
             self.gather.insert(iter=self.global_iter,
@@ -417,6 +645,8 @@ class SCAN(Solver):
                                recon_loss=recon_loss.data, kld=kld.data, relv=relv.data)
 
         if self.global_iter % self.args.display_save_step == 0:
+            if x is None:
+                x = self.tensor(torch.stack([self.dataset[i][0] for i in index.tolist()]))
             self.vis_display([x, self.visual(y)])
 
         return loss
@@ -458,6 +688,9 @@ class SCAN(Solver):
 
         self.net_mode(train=True)
     def vis_traverse(self, limit=3, inter=2/3, loc=-1, num_img2sym=4, num_sym2img=9):
+        from PIL import Image, ImageDraw
+        from torchvision.utils import make_grid, save_image
+        from torchvision import transforms
         self.net_mode(train=False)
         n_dsets = self.data_loader.__len__()
         toimage = transforms.ToPILImage('RGB')
@@ -467,15 +700,16 @@ class SCAN(Solver):
 
         def save_display(images, name, nrow):
             images = torch.stack(images, dim=0)
-            self.vis.images(images, env=self.env_name+'_'+name,
-                            opts=dict(title='iter:{}'.format(self.global_iter)), nrow=nrow)
+            if self.args.vis_on:
+                self.vis.images(images, env=self.env_name+'_'+name,
+                                opts=dict(title='iter:{}'.format(self.global_iter)), nrow=nrow)
             save_image(images, os.path.join(output_dir, '{}.jpeg'.format(name)), nrow)
 
         # img2sym
         images = []
         for i in range(num_img2sym):
             i_rand = random.randint(0, n_dsets)
-            [image, attr, keys] = self.data_loader.dataset.__getitem__(i_rand)
+            [image, attr, keys] = self.dataset.__getitem__(i_rand)
             if self.keys is None:
                 self.keys = keys
                 self.n_key = len(self.keys)
@@ -630,7 +864,7 @@ def random_occluding(images, size, cuda_or_not=True):
             left, right = right, left
         if down > up:
             down, up = up, down
-        mask = torch.zeros([nc, x, y], dtype=torch.uint8)
+        mask = torch.zeros([nc, x, y], dtype=torch.bool)
         mask[:, left : right, down : up] = 1
         return mask
 
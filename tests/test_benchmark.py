@@ -0,0 +1,37 @@
+import pytest
+
+pytest.importorskip('torch')
+
+from benchmark import compare
+
+
+def test_meta_is_not_compared():
+    baseline = {'meta': {'cpu_count': 8, 'num_workers': 4, 'images': 512}, 'loader': {'celeba': {'samples_per_sec': 100.}}}
+    results = {'meta': {'cpu_count': 64, 'num_workers': 16, 'images': 2048}, 'loader': {'celeba': {'samples_per_sec': 100.}}}
+    assert compare(results, baseline, 0.1) == {}
+
+
+def test_regressions_of_the_baseline_are_not_compared():
+    baseline = {'regressions': {'train/x/step_p50_ms': {'baseline': 1., 'current': 2., 'change': 1.}}}
+    results = {'regressions': {'train/x/step_p50_ms': {'baseline': 1., 'current': 9., 'change': 8.}}}
+    assert compare(results, baseline, 0.1) == {}
+
+
+def test_lower_is_better():
+    baseline = {'train': {'beta_VAE': {'step_p50_ms': 10.}}, 'checkpoint': {'delta': {'bytes': 1000}}}
+    assert set(compare({'train': {'beta_VAE': {'step_p50_ms': 12.}}, 'checkpoint': {'delta': {'bytes': 1200}}},
+                       baseline, 0.1)) == {'train/beta_VAE/step_p50_ms', 'checkpoint/delta/bytes'}
+    assert compare({'train': {'beta_VAE': {'step_p50_ms': 5.}}, 'checkpoint': {'delta': {'bytes': 500}}},
+                   baseline, 0.1) == {}
+
+
+def test_higher_is_better():
+    baseline = {'loader': {'celeba': {'samples_per_sec': 100.}}}
+    assert 'loader/celeba/samples_per_sec' in compare({'loader': {'celeba': {'samples_per_sec': 80.}}}, baseline, 0.1)
+    assert compare({'loader': {'celeba': {'samples_per_sec': 150.}}}, baseline, 0.1) == {}
+
+
+def test_speedup_is_higher_is_better():
+    baseline = {'decode': {'draft_speedup': 2.0}}
+    assert compare({'decode': {'draft_speedup': 3.0}}, baseline, 0.1) == {}
+    assert 'decode/draft_speedup' in compare({'decode': {'draft_speedup': 1.5}}, baseline, 0.1)
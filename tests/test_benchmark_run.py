@@ -0,0 +1,23 @@
+import json
+
+import pytest
+
+pytest.importorskip('torch')
+pytest.importorskip('torchvision')
+
+import benchmark
+from main import parse_args
+
+
+def test_run_on_synthetic_datasets(tmp_path):
+    out = tmp_path / 'bench.json'
+    args = parse_args(['--job', 'benchmark', '--cuda', 'False', '--num_workers', '0', '--bench_images', '16',
+                       '--bench_batch_sizes', '4', '--bench_warmup', '1', '--bench_steps', '2',
+                       '--bench_out', str(out)])
+    results = benchmark.run(args)
+
+    assert json.loads(out.read_text())['meta']['images'] == 16
+    for section in ['loader', 'decode', 'train', 'inference', 'startup', 'checkpoint']:
+        assert results[section], section
+    assert results['checkpoint']['lossless']
+    assert 'vis_traverse_sec' not in results['train']['DAE/batch_4']
@@ -0,0 +1,43 @@
+import os
+
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from benchmark import states_equal
+from ckpt_store import CheckpointStore
+from utils import load_state
+
+
+def train(net, optimizer, n_steps):
+    for _ in range(n_steps):
+        optimizer.zero_grad()
+        net(torch.randn(8, 4)).pow(2).mean().backward()
+        optimizer.step()
+
+
+def test_restore_matches_torch_save(tmp_path):
+    torch.manual_seed(0)
+    net = torch.nn.Sequential(torch.nn.Linear(4, 16), torch.nn.ReLU(), torch.nn.Linear(16, 2))
+    optimizer = torch.optim.Adam(net.parameters(), lr=1e-2)
+    store = CheckpointStore(str(tmp_path), full_every=3)
+    expected = {}
+    # iterations 1 and 2, 4 and 5 are deltas between the full snapshots of 0, 3 and 6
+    for i in range(7):
+        train(net, optimizer, 2)
+        states = {'iter': i, 'net_states': net.state_dict(), 'optim_states': optimizer.state_dict()}
+        for filename in [str(i), 'last']:
+            store.save(states, os.path.join(str(tmp_path), filename))
+        torch.save(states, os.path.join(str(tmp_path), 'torch_{}'.format(i)))
+        expected[i] = load_state(os.path.join(str(tmp_path), 'torch_{}'.format(i)))
+
+    for i in range(7):
+        assert states_equal(load_state(os.path.join(str(tmp_path), str(i))), expected[i])
+    assert states_equal(load_state(os.path.join(str(tmp_path), 'last')), expected[6])
+
+
+def test_objects_are_keyed_by_dtype(tmp_path):
+    store = CheckpointStore(str(tmp_path))
+    data = torch.arange(8, dtype=torch.int32).view(torch.uint8).numpy()
+    assert store.put(data, 'int32', 4) != store.put(data, 'float32', 4)
+    assert store.put(data, 'int32', 4) != store.put(data, 'int16', 2)
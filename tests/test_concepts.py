@@ -0,0 +1,60 @@
+import types
+
+import pytest
+
+np = pytest.importorskip('numpy')
+torch = pytest.importorskip('torch')
+
+from concepts import ConceptTable, NearestConcept
+from model import SCAN_net
+from solver import dual_kl_divergence
+
+
+def table(z_dim=4, n_attrs=5):
+    torch.manual_seed(0)
+    net = SCAN_net(z_dim=z_dim, nc=n_attrs).eval()
+    attrs = np.random.RandomState(0).rand(200, n_attrs) > 0.5
+    return ConceptTable.build(net, attrs.astype(np.float32), batch_size=7), attrs
+
+
+def brute_force(mu_x, logvar_x, table):
+    kl = torch.tensor([[dual_kl_divergence(mu_x[i:i+1], logvar_x[i:i+1],
+                                           table.mu[j:j+1], table.logvar[j:j+1]).item()
+                        for j in range(len(table))] for i in range(mu_x.size(0))])
+    return kl.min(1)
+
+
+def test_build_dedupes_attributes():
+    concepts, attrs = table()
+    distinct = np.unique(attrs, axis=0)
+    assert len(concepts) == len(distinct)
+    assert (concepts.attributes.numpy() == distinct).all()
+    assert concepts.counts.sum().item() == len(attrs)
+
+
+@pytest.mark.parametrize('chunk', [3, 4096])
+def test_nearest_matches_brute_force_kl(chunk):
+    concepts, _ = table()
+    torch.manual_seed(1)
+    mu_x, logvar_x = torch.randn(16, 4), torch.randn(16, 4) * 0.5
+    index, kl = concepts.nearest(mu_x, logvar_x, chunk=chunk)
+    expected_kl, expected_index = brute_force(mu_x, logvar_x, concepts)
+    assert torch.equal(index, expected_index)
+    assert torch.allclose(kl, expected_kl, rtol=1e-4, atol=1e-4)
+
+
+def test_nearest_concept_graph_and_reload(tmp_path):
+    concepts, _ = table()
+    path = str(tmp_path / 'concepts.pth')
+    torch.save(concepts.state_dict(), path)
+    concepts = ConceptTable.load(path)
+
+    torch.manual_seed(2)
+    beta_VAE_net = types.SimpleNamespace(encoder=torch.nn.Linear(6, 8), z_dim=4)
+    graph = NearestConcept(beta_VAE_net, concepts, chunk=3).eval()
+    x = torch.randn(10, 6)
+    with torch.no_grad():
+        predictions = graph(x)
+        distributions = beta_VAE_net.encoder(x)
+        _, expected_index = brute_force(distributions[:, :4], distributions[:, 4:], concepts)
+    assert torch.equal(predictions, concepts.attributes[expected_index])
@@ -0,0 +1,29 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from convergence import ConvergenceController
+from main import parse_args
+
+
+def test_resume_keeps_the_smoothing():
+    controller = ConvergenceController('stop', 'loss', ema_decay=0.9)
+    for value in [5., 4., 3., 2.5, 2.4]:
+        controller.update(loss=torch.tensor(value), recon=torch.tensor(value / 2))
+    resumed = ConvergenceController('stop', 'loss', ema_decay=0.9)
+    resumed.load_state_dict(controller.state_dict())
+    assert resumed.smoothed() == pytest.approx(controller.smoothed())
+
+    controller.update(loss=torch.tensor(2.3), recon=torch.tensor(1.))
+    resumed.update(loss=torch.tensor(2.3), recon=torch.tensor(1.))
+    assert resumed.smoothed() == pytest.approx(controller.smoothed())
+
+
+def test_plateau_metric_is_checked_against_the_phase():
+    assert parse_args(['--early_stop', 'stop', '--SCAN', '--phase', 'SCAN', '--plateau_metric', 'relv',
+                       '--vis_on', 'False']).plateau_metric == 'relv'
+    for argv in [['--SCAN', '--phase', 'beta_VAE', '--plateau_metric', 'relv'],
+                 ['--SCAN', '--phase', 'DAE', '--plateau_metric', 'kld'],
+                 ['--plateau_metric', 'los']]:
+        with pytest.raises(SystemExit):
+            parse_args(['--early_stop', 'decay'] + argv)
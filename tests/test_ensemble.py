@@ -0,0 +1,40 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from model import BetaVAE_B_net, GroupedAutoEncoder
+
+
+def train_step(net, optimizer, nc):
+    x_recon, mu, logvar = net(torch.rand(4, nc, 64, 64))
+    optimizer.zero_grad()
+    (x_recon.pow(2).mean() + mu.pow(2).mean() + logvar.exp().mean()).backward()
+    optimizer.step()
+
+
+@pytest.mark.parametrize('nc', [1, 3])
+def test_optim_state_resume(nc):
+    # with nc=1 the last decoder bias has one element per replica, like Adam's step
+    torch.manual_seed(0)
+    net = GroupedAutoEncoder([BetaVAE_B_net(10, nc) for _ in range(2)])
+    optimizer = torch.optim.Adam(net.parameters(), lr=1e-3)
+    train_step(net, optimizer, nc)
+    states = optimizer.state_dict()
+    replica_states = [net.replica_optim_state(states, i) for i in range(2)]
+
+    resumed = torch.optim.Adam(net.parameters(), lr=1e-3)
+    resumed.load_state_dict(net.merge_optim_states(replica_states))
+    for index, param_state in resumed.state_dict()['state'].items():
+        for key, value in param_state.items():
+            assert torch.equal(torch.as_tensor(value), torch.as_tensor(states['state'][index][key]))
+    train_step(net, resumed, nc)
+
+
+def test_replica_optim_state_shapes():
+    net = GroupedAutoEncoder([BetaVAE_B_net(10, 1) for _ in range(2)])
+    optimizer = torch.optim.Adam(net.parameters(), lr=1e-3)
+    train_step(net, optimizer, 1)
+    replica_state = net.replica_optim_state(optimizer.state_dict(), 0)
+    for index, param_state in replica_state['state'].items():
+        assert param_state['exp_avg'].shape == net.shapes[index]
+        assert torch.as_tensor(param_state['step']).numel() == 1
@@ -0,0 +1,32 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from latent_stats import LatentStatistics, prune_net
+from model import BetaVAE_H_net, SCAN_net
+
+
+@pytest.mark.parametrize('net, shape', [(BetaVAE_H_net(10, 3), (8, 3, 64, 64)), (SCAN_net(10, 40), (8, 40))])
+def test_pruned_net_matches_full_net_with_inactive_latents_at_the_prior(net, shape):
+    torch.manual_seed(0)
+    net.eval()
+    active_dims = [0, 3, 4, 9]
+    pruned = prune_net(net, active_dims).eval()
+    x = torch.rand(*shape)
+    with torch.no_grad():
+        distributions = net._encode(x)
+        pruned_distributions = pruned._encode(x)
+        assert torch.allclose(pruned_distributions[:, :4], distributions[:, active_dims], atol=1e-6)
+        assert torch.allclose(pruned_distributions[:, 4:], distributions[:, 10:][:, active_dims], atol=1e-6)
+
+        z = torch.zeros(8, 10)
+        z[:, active_dims] = distributions[:, active_dims]
+        assert torch.allclose(pruned._decode(z[:, active_dims]), net._decode(z), atol=1e-5)
+
+
+def test_collapsed_latents_are_inactive():
+    stats = LatentStatistics(3)
+    mu = torch.stack([torch.randn(100), torch.zeros(100), 2 * torch.randn(100)], 1)
+    logvar = torch.stack([torch.full((100,), -2.), torch.zeros(100), torch.zeros(100)], 1)
+    stats.update(mu, logvar)
+    assert stats.active_dims(0.01).tolist() == [0, 2]
@@ -0,0 +1,78 @@
+import os
+import json
+
+import pytest
+
+torch = pytest.importorskip('torch')
+np = pytest.importorskip('numpy')
+
+import latent_store
+from inference import checkpoint_path
+from main import parse_args
+from model import DAE_net
+
+
+def make_args(root_dir, *argv):
+    return parse_args(['--root_dir', root_dir, '--cuda', 'False', '--SCAN', '--phase', 'beta_VAE'] + list(argv))
+
+
+def save_checkpoint(args, net):
+    os.makedirs(os.path.dirname(checkpoint_path(args, 'DAE')), exist_ok=True)
+    torch.save({'iter': 1, 'net_states': net.state_dict()}, checkpoint_path(args, 'DAE'))
+
+
+def write_version(args, latents):
+    """What --job latent_cache leaves behind for the current DAE checkpoint."""
+    root = latent_store.store_dir(args, 'DAE')
+    version = latent_store.version_of(args, 'DAE')
+    os.makedirs(os.path.join(root, version), exist_ok=True)
+    np.save(latent_store.chunk_path(os.path.join(root, version), 0), latents)
+    with open(os.path.join(root, version, 'meta.json'), 'w') as f:
+        json.dump({'data': latent_store.data_settings(args), 'n_chunks': 1, 'iter': 1}, f)
+    with open(os.path.join(root, 'CURRENT'), 'w') as f:
+        f.write(version)
+    return version
+
+
+def test_open_store_refuses_latents_of_another_checkpoint(tmp_path):
+    args = make_args(str(tmp_path))
+    torch.manual_seed(0)
+    save_checkpoint(args, DAE_net(100, 3))
+    write_version(args, np.zeros((4, 100), dtype=np.float32))
+    frozen = DAE_net(100, 3)
+    store = latent_store.open_store(args, 'DAE', frozen)
+    assert len(store) == 4
+
+    save_checkpoint(args, DAE_net(100, 3))
+    with pytest.raises(ValueError):
+        latent_store.open_store(args, 'DAE', frozen)
+    stale = latent_store.open_store(make_args(str(tmp_path), '--latent_allow_stale', 'True'), 'DAE', frozen)
+    assert len(stale) == 4
+
+
+def test_reload_switches_latents_and_frozen_net_together(tmp_path):
+    args = make_args(str(tmp_path))
+    torch.manual_seed(0)
+    save_checkpoint(args, DAE_net(100, 3))
+    write_version(args, np.zeros((4, 100), dtype=np.float32))
+    frozen = DAE_net(100, 3)
+    store = latent_store.open_store(args, 'DAE', frozen)
+    assert store.reload() is None
+
+    new_net = DAE_net(100, 3)
+    save_checkpoint(args, new_net)
+    version = write_version(args, np.ones((4, 100), dtype=np.float32))
+    assert store.reload() is not None
+    assert store.version == version
+    assert (store[[0, 1]] == 1).all()
+    for key, value in frozen.state_dict().items():
+        assert torch.equal(value, new_net.state_dict()[key])
+
+    # a checkpoint that moved on again is not paired with the latents of the previous one
+    save_checkpoint(args, DAE_net(100, 3))
+    root = latent_store.store_dir(args, 'DAE')
+    os.makedirs(os.path.join(root, 'other'))
+    with open(os.path.join(root, 'CURRENT'), 'w') as f:
+        f.write('other')
+    assert 'kept' in store.reload()
+    assert store.version == version
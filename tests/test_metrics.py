@@ -0,0 +1,59 @@
+import itertools
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('torch')
+
+from metrics import FactorSampler, beta_vae_metric, factor_vae_metric, mutual_information_gap
+
+
+def factor_set():
+    # a constant factor, like the colour of dSprites, and three varying ones
+    latents_classes = np.array(list(itertools.product(range(1), range(4), range(5), range(6))))
+    return latents_classes[np.random.RandomState(0).permutation(len(latents_classes))]
+
+
+def disentangled_codes(latents_classes, rng):
+    mus = rng.normal(scale=0.01, size=(len(latents_classes), 5)).astype(np.float32)
+    mus[:, :3] += latents_classes[:, 1:]
+    # two unused latents at the prior
+    mus[:, 3:] = rng.normal(scale=1e-3, size=(len(latents_classes), 2))
+    return mus
+
+
+def test_factor_sampler_lookup():
+    latents_classes = factor_set()
+    sampler = FactorSampler(latents_classes)
+    assert sampler.factors.tolist() == [1, 2, 3]
+    rng = np.random.RandomState(0)
+    classes = sampler.sample(rng, [50])
+    assert (latents_classes[sampler.indices(classes)] == classes).all()
+
+    k, idx = sampler.sample_fixed(rng, 20, 8, share='all')
+    shared = latents_classes[idx][np.arange(20), :, k]
+    assert (shared == shared[:, :1]).all()
+
+
+def test_disentangled_codes_score_high():
+    latents_classes = factor_set()
+    sampler = FactorSampler(latents_classes)
+    rng = np.random.RandomState(0)
+    mus = disentangled_codes(latents_classes, rng)
+
+    assert mutual_information_gap(mus, latents_classes, sampler.factors)['mig'] > 0.8
+    factor_vae = factor_vae_metric(mus, sampler, rng, n_train=500, n_eval=500, batch_size=16, n_variance=500)
+    assert factor_vae['factor_vae_eval_accuracy'] > 0.95
+    assert factor_vae['active_dims'] == 3
+    beta_vae = beta_vae_metric(mus, sampler, rng, n_train=500, n_eval=500, batch_size=16)
+    assert beta_vae['beta_vae_eval_accuracy'] > 0.9
+
+
+def test_entangled_codes_score_low():
+    latents_classes = factor_set()
+    sampler = FactorSampler(latents_classes)
+    rng = np.random.RandomState(0)
+    # every latent mixes every factor equally
+    mus = np.repeat(latents_classes[:, 1:].sum(1, keepdims=True), 3, axis=1).astype(np.float32)
+    mus += rng.normal(scale=0.01, size=mus.shape)
+    assert mutual_information_gap(mus, latents_classes, sampler.factors)['mig'] < 0.2
@@ -0,0 +1,44 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+quantize = pytest.importorskip('quantize')
+
+from model import BetaVAE_H_net, DAE_net
+
+
+@pytest.fixture
+def backend():
+    engines = torch.backends.quantized.supported_engines
+    for engine in ['fbgemm', 'x86', 'qnnpack']:
+        if engine in engines:
+            torch.backends.quantized.engine = engine
+            return engine
+    pytest.skip('no quantized engine')
+
+
+@pytest.mark.parametrize('net_class, z_dim', [(BetaVAE_H_net, 10), (DAE_net, 100)])
+def test_static_quantization_runs(backend, net_class, z_dim):
+    torch.manual_seed(0)
+    net = net_class(z_dim, 3).eval()
+    images = torch.rand(32, 3, 64, 64)
+    qnet = quantize.quantize_image_net(net, images, static=True, backend=backend)
+
+    with torch.no_grad():
+        codes = net.encoder(images)[:, :z_dim]
+        qcodes = qnet.encoder(images)[:, :z_dim]
+        recon, qrecon = net.decoder(codes), qnet.decoder(codes)
+    assert qcodes.shape == codes.shape
+    assert qrecon.shape == recon.shape == (32, 3, 64, 64)
+    # int8 activations: close, not equal
+    assert (qrecon - recon).abs().mean().item() < 0.1
+
+
+def test_compare_static_reconstruction(backend):
+    torch.manual_seed(0)
+    net = BetaVAE_H_net(10, 3).eval()
+    images = torch.rand(16, 3, 64, 64)
+    qnet = quantize.quantize_image_net(net, images, static=True, backend=backend)
+    graphs = {'reconstruction': quantize.Reconstruction(net).eval()}
+    qgraphs = {'reconstruction': quantize.Reconstruction(qnet).eval()}
+    report = quantize.compare(graphs, qgraphs, images, None, batch_size=8)
+    assert report['reconstruction']['output_mse'] >= 0
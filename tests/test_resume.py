@@ -0,0 +1,44 @@
+import copy
+
+import pytest
+
+torch = pytest.importorskip('torch')
+
+import solver
+from main import parse_args
+
+
+def make_args(root_dir, *argv):
+    return parse_args(['--root_dir', root_dir, '--dataset', 'dsprites', '--cuda', 'False', '--vis_on', 'False',
+                       '--save_output', 'False', '--batch_size', '4'] + list(argv))
+
+
+def train(model, n_steps=2):
+    model.net_mode(train=True)
+    model.prepare_training()
+    for _ in range(n_steps):
+        model.global_iter += 1
+        model.train_step(torch.rand(4, 1, 64, 64))
+
+
+@pytest.mark.parametrize('argv, solver_class', [
+    ([], solver.ori_beta_VAE),
+    (['--SCAN', '--phase', 'beta_VAE', '--n_seeds', '2'], solver.beta_VAE_ensemble),
+    (['--SCAN', '--phase', 'beta_VAE', '--ckpt_format', 'delta'], solver.beta_VAE),
+])
+def test_resume_then_save(tmp_path, argv, solver_class):
+    model = solver_class(make_args(str(tmp_path), *argv))
+    train(model)
+    model.save_checkpoint(model.get_win_states(), 'last')
+
+    resumed = solver_class(make_args(str(tmp_path), *argv))
+    assert resumed.global_iter == model.global_iter
+    train(resumed)
+    # rewrites the checkpoint the optimizer state was loaded from
+    resumed.save_checkpoint(resumed.get_win_states(), 'last')
+    saved = copy.deepcopy(resumed.net.state_dict())
+    train(resumed)
+
+    reloaded = solver_class(make_args(str(tmp_path), *argv))
+    for key, value in reloaded.net.state_dict().items():
+        assert torch.equal(value, saved[key])
@@ -0,0 +1,40 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('torch')
+
+from dataset import AttributeBalancedSampler
+
+
+def attributes():
+    # attribute 0 is rare (only image 5), attribute 1 is on everywhere, attribute 2 never
+    attr = np.zeros([100, 3], dtype=np.float32)
+    attr[5, 0] = 1
+    attr[:, 1] = 1
+    return attr
+
+
+@pytest.mark.parametrize('coverage', [0., -0.5, 1.5])
+def test_coverage_out_of_range(coverage):
+    with pytest.raises(ValueError):
+        AttributeBalancedSampler(attributes(), batch_size=8, n_batches=4, coverage=coverage)
+
+
+def test_batches_shape_and_epochs():
+    sampler = AttributeBalancedSampler(attributes(), batch_size=8, n_batches=10, coverage=0.5, chunk=3)
+    first = list(sampler)
+    assert len(first) == len(sampler) == 10
+    assert all(len(batch) == 8 for batch in first)
+    assert all(0 <= i < 100 for batch in first for i in batch)
+    assert list(sampler) != first
+
+
+@pytest.mark.parametrize('alpha, rare_share', [(0., 0.5), (1., 100. / 101)])
+def test_rare_attribute_share(alpha, rare_share):
+    sampler = AttributeBalancedSampler(attributes(), batch_size=10, n_batches=500, coverage=0.4, alpha=alpha)
+    batches = np.array(list(sampler))
+    balanced, uniform = batches[:, :4], batches[:, 4:]
+    # the rare attribute's only positive fills its share of the balanced part, plus uniform hits
+    expected = rare_share + (1 - rare_share) / 100.
+    assert abs((balanced == 5).mean() - expected) < 0.05
+    assert (uniform == 5).mean() < 0.05
@@ -0,0 +1,50 @@
+import os
+import sys
+import time
+
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from inference import checkpoint_path
+from main import parse_args
+from model import BetaVAE_H_net, DAE_net, SCAN_net
+
+pytestmark = pytest.mark.skipif(not sys.platform.startswith('linux'), reason='serving workers are forked')
+
+
+def save_nets(args, seed):
+    torch.manual_seed(seed)
+    nets = {'DAE': DAE_net(args.DAE_z_dim, 3), 'beta_VAE': BetaVAE_H_net(args.beta_VAE_z_dim, 3),
+            'SCAN': SCAN_net(args.SCAN_z_dim, 40)}
+    for phase, net in nets.items():
+        os.makedirs(os.path.dirname(checkpoint_path(args, phase)), exist_ok=True)
+        tmp_path = checkpoint_path(args, phase) + '.tmp'
+        torch.save({'iter': seed, 'net_states': net.state_dict()}, tmp_path)
+        os.replace(tmp_path, checkpoint_path(args, phase))
+    return nets
+
+
+def test_hot_swap_on_checkpoint_change(tmp_path):
+    import serve
+    args = parse_args(['--root_dir', str(tmp_path), '--cuda', 'False', '--SCAN'])
+    nets = save_nets(args, 0)
+    x = torch.rand(2, 40)
+    pool = serve.ServingPool(args, n_workers=2)
+    try:
+        pool.submit('sym2img', x)
+        _, output, version = pool.result(timeout=60)
+        assert version == 0
+        assert pool.poll() is None
+
+        time.sleep(0.01)
+        nets = save_nets(args, 1)
+        assert pool.poll() is not None
+        pool.submit('sym2img', x)
+        _, output, version = pool.result(timeout=60)
+        assert version == 1
+        expected = serve.serving_graphs({phase: net.eval() for phase, net in nets.items()})['sym2img']
+        with torch.no_grad():
+            assert torch.allclose(output, expected(x), atol=1e-6)
+    finally:
+        pool.close()
@@ -0,0 +1,55 @@
+import os
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('torch')
+Image = pytest.importorskip('PIL.Image')
+
+from shards import pack_shards, ShardedImageDataset
+
+
+def red(img):
+    return img.getpixel((0, 0))[0]
+
+
+@pytest.fixture
+def packed(tmp_path):
+    paths = []
+    for i in range(23):
+        path = str(tmp_path / 'img_{:02d}.png'.format(i))
+        Image.new('RGB', (8, 8), (i * 10, 0, 0)).save(path)
+        paths.append(path)
+    attrs = np.arange(23 * 2, dtype=np.float32).reshape(23, 2)
+    out_dir = str(tmp_path / 'shards')
+    # a few hundred bytes per shard, so the images span several shards
+    n_shards = pack_shards(paths, out_dir, shard_bytes=300, attrs=attrs, keys=['a', 'b'])
+    return out_dir, n_shards, attrs
+
+
+def test_random_access_keeps_order(packed):
+    out_dir, n_shards, attrs = packed
+    assert n_shards > 2
+    assert len([name for name in os.listdir(out_dir) if name.endswith('.bin')]) == n_shards
+
+    dataset = ShardedImageDataset(out_dir, transform=red, require_attr=True)
+    assert len(dataset) == 23
+    for i in range(23):
+        value, attr, keys = dataset[i]
+        assert value == i * 10
+        assert (attr == attrs[i]).all()
+        assert keys == ['a', 'b']
+
+
+def test_iteration_covers_every_image_once(packed):
+    out_dir, _, _ = packed
+    dataset = ShardedImageDataset(out_dir, transform=red, buffer_size=4, seed=1)
+    first = list(dataset)
+    second = list(dataset)
+    assert sorted(first) == [i * 10 for i in range(23)]
+    assert sorted(second) == sorted(first)
+    # the epoch advances, so the order is reshuffled
+    assert first != second
+
+    dataset.set_epoch(0)
+    assert list(dataset) == first
@@ -1,5 +1,6 @@
 """utils.py"""
 
+import time
 import argparse
 import subprocess
 
@@ -12,6 +13,44 @@ def cuda(tensor, uses_cuda):
     return tensor.cuda() if uses_cuda else tensor
 
 
+def load_state(file_path, map_location='cpu', mmap=False):
+    """torch.load restricted to tensors and plain containers, optionally memory-mapped.
+
+    Manifests of ckpt_store are restored to the checkpoint they describe.
+    """
+    try:
+        states = torch.load(file_path, map_location=map_location, weights_only=True, mmap=mmap)
+    except TypeError:
+        # torch < 2.1 supports neither weights_only nor mmap
+        states = torch.load(file_path, map_location=map_location)
+    except RuntimeError:
+        if not mmap:
+            raise
+        # only the zipfile format can be memory-mapped, not the legacy one
+        states = torch.load(file_path, map_location=map_location, weights_only=True)
+    if isinstance(states, dict) and '__ckpt_store__' in states:
+        import ckpt_store
+        states = ckpt_store.restore(states, file_path, map_location)
+    return states
+
+
+def sample_batch(dataset, indices, num_workers):
+    """The items of a dataset at indices, collated into one batch."""
+    from torch.utils.data import DataLoader, Subset
+    loader = DataLoader(Subset(dataset, indices), batch_size=len(indices), num_workers=num_workers)
+    return next(iter(loader))
+
+
+def throughput(graph, x, n_repeat=20):
+    """Samples/sec of a graph on the batch x, after one warmup pass."""
+    with torch.no_grad():
+        graph(x)
+        start = time.time()
+        for _ in range(n_repeat):
+            graph(x)
+    return n_repeat * x.size(0) / (time.time() - start)
+
+
 def str2bool(v):
     # codes from : https://stackoverflow.com/questions/15008758/parsing-boolean-values-with-argparse
 